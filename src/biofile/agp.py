@@ -7,6 +7,16 @@
 # process NCBI agp format file
 # **********************************************************************
 
+from bisect import bisect_right
+
+try:
+    import numpy as np
+except ImportError:                     # numpy is only used by lift_array
+    np = None
+
+GAP_TYPES = ('N', 'U')                  # gap of specified, unknown size
+
+
 class Agp(object):
     def __init__(self, items):
         self.items = items
@@ -17,7 +27,7 @@ class Agp(object):
 
     @property
     def is_gap(self):
-        return True if self.items[4] == 'N' else False
+        return self.items[4] in GAP_TYPES
 
     @property
     def gaplen(self):
@@ -73,3 +83,133 @@ def parse(agpfile):
 def read(agpfile):
     return parse(agpfile)
 
+
+# **********************************************************************
+# liftover between contig and scaffold coordinates
+# **********************************************************************
+class _Components(object):
+    """placements of one sequence sorted by start: [start, end) on it maps
+    to [tstart, tend) of target name, reverse if strand is '-'"""
+    def __init__(self, items):
+        items.sort()
+        self.starts = [item[0] for item in items]
+        self.ends = [item[1] for item in items]
+        self.items = items
+        self._arrays = None
+
+    def find(self, pos):
+        i = bisect_right(self.starts, pos) - 1
+        if i >= 0 and pos < self.ends[i]:
+            return self.items[i]
+        return None
+
+    def arrays(self):
+        if self._arrays is None:
+            names = np.empty(len(self.items) + 1, dtype=object)
+            names[:-1] = [item[2] for item in self.items]
+            names[-1] = None            # not placed
+            self._arrays = (np.array(self.starts, dtype=np.int64),
+                            np.array(self.ends, dtype=np.int64), names,
+                            np.array([item[3] for item in self.items],
+                                     dtype=np.int64),
+                            np.array([item[5] for item in self.items],
+                                     dtype=bool))
+        return self._arrays
+
+
+def _lift(item, pos):
+    start, end, name, tstart, tend, reverse = item
+    if reverse:
+        return name, tstart + (end - 1 - pos), reverse
+    return name, tstart + (pos - start), reverse
+
+
+class Liftover(object):
+    """Convert 0-based positions between contigs and scaffolds of an AGP
+    (file name or Agp iterable). Gaps are not placed on any contig"""
+    def __init__(self, agps):
+        if isinstance(agps, basestring):
+            agps = parse(agps)
+        scafs, contigs = {}, {}
+        for agp in agps:
+            if agp.is_gap:
+                continue
+            reverse = agp.strand == '-'
+            scafs.setdefault(agp.scaf, []).append(
+                (agp.scaf_start, agp.scaf_end, agp.contig, agp.contig_start,
+                 agp.contig_end, reverse))
+            contigs.setdefault(agp.contig, []).append(
+                (agp.contig_start, agp.contig_end, agp.scaf, agp.scaf_start,
+                 agp.scaf_end, reverse))
+        self._scafs = dict([(name, _Components(items))
+                            for name, items in scafs.iteritems()])
+        self._contigs = dict([(name, _Components(items))
+                              for name, items in contigs.iteritems()])
+
+    def __repr__(self):
+        return '<Liftover scaffolds:{0} contigs:{1}>'.format(
+            len(self._scafs), len(self._contigs))
+
+    def _convert(self, comps, name, pos, strand):
+        comp = comps.get(name)
+        item = comp.find(pos) if comp is not None else None
+        if item is None:
+            return None
+        name, pos, reverse = _lift(item, pos)
+        if reverse:
+            strand = '-' if strand == '+' else '+'
+        return name, pos, strand
+
+    def to_scaffold(self, contig, pos, strand='+'):
+        """(scaffold, pos, strand) of pos on contig, None if not placed"""
+        return self._convert(self._contigs, contig, pos, strand)
+
+    def to_contig(self, scaf, pos, strand='+'):
+        """(contig, pos, strand) of pos on scaffold, None if in a gap"""
+        return self._convert(self._scafs, scaf, pos, strand)
+
+    def lift_interval(self, contig, start, end, strand='+'):
+        """(scaffold, start, end, strand) of [start, end) on contig, None
+        if the interval is not inside one placed component"""
+        comp = self._contigs.get(contig)
+        item = comp.find(start) if comp is not None else None
+        if item is None or end > item[1]:
+            return None
+        name, first, reverse = _lift(item, start)
+        name, last, reverse = _lift(item, end - 1)
+        if reverse:
+            strand = '-' if strand == '+' else '+'
+            first, last = last, first
+        return name, first, last + 1, strand
+
+    def _convert_array(self, comps, name, positions):
+        if np is None:
+            raise ImportError('numpy is required by Liftover.*_array')
+        positions = np.asarray(positions, dtype=np.int64)
+        comp = comps.get(name)
+        if comp is None:
+            names = np.empty(len(positions), dtype=object)
+            return (names, np.full(len(positions), -1, dtype=np.int64),
+                    np.zeros(len(positions), dtype=bool))
+        starts, ends, names, tstarts, reverses = comp.arrays()
+        idx = np.searchsorted(starts, positions, side='right') - 1
+        placed = idx >= 0
+        placed[placed] &= positions[placed] < ends[idx[placed]]
+        idx[~placed] = 0
+        reverse = reverses[idx]
+        lifted = np.where(reverse, tstarts[idx] + ends[idx] - 1 - positions,
+                          tstarts[idx] + positions - starts[idx])
+        lifted[~placed] = -1
+        reverse &= placed
+        idx[~placed] = len(names) - 1
+        return names[idx], lifted, reverse
+
+    def to_scaffold_array(self, contig, positions):
+        """lift numpy array of positions on contig, return (scaffold names
+        (None if not placed), positions (-1 if not placed), reverse mask)"""
+        return self._convert_array(self._contigs, contig, positions)
+
+    def to_contig_array(self, scaf, positions):
+        """same as to_scaffold_array from scaffold to contigs"""
+        return self._convert_array(self._scafs, scaf, positions)
+
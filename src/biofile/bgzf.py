@@ -0,0 +1,218 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: bgzf.py
+#
+# read and write BGZF (blocked gzip) files with virtual offsets
+# **********************************************************************
+"""BGZF is a series of gzip members of at most 64kb of data each, the
+compressed size of every member is kept in a 'BC' extra field. So a file
+position can be given as a virtual offset:
+
+    (offset of block in file << 16) | offset of data in the block
+
+which can be seeked to without decompressing the file from the start.
+A BGZF file is a valid gzip file, so gzip.open can read it too.
+"""
+
+import struct
+import zlib
+
+MAGIC = '\x1f\x8b\x08\x04'
+BLOCK_SIZE = 65280                      # data of one block, as bgzip does
+# empty block closing every BGZF file
+EOF_BLOCK = ('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+             '\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+
+def is_bgzf(fname):
+    with open(fname, 'rb') as handle:
+        head = handle.read(16)
+    return head[:4] == MAGIC and head[12:14] == 'BC'
+
+
+def make_voffset(block, within):
+    return (block << 16) | within
+
+
+def split_voffset(voffset):
+    return voffset >> 16, voffset & 0xffff
+
+
+def _read_block(handle):
+    """return (compressed size, data) of block at handle, None at end"""
+    head = handle.read(12)
+    if not head:
+        return None
+    if len(head) < 12 or head[:4] != MAGIC:
+        raise ValueError('Not a BGZF block at {0}'.format(handle.tell() - 12))
+    xlen, = struct.unpack('<H', head[10:12])
+    extra = handle.read(xlen)
+    bsize = None
+    i = 0
+    while i < xlen:                     # find BC subfield
+        sid, slen = extra[i:i+2], struct.unpack('<H', extra[i+2:i+4])[0]
+        if sid == 'BC':
+            bsize, = struct.unpack('<H', extra[i+4:i+6])
+        i += 4 + slen
+    if bsize is None:
+        raise ValueError('No BC field in gzip member, not a BGZF file')
+    cdata = handle.read(bsize - xlen - 19)
+    crc, isize = struct.unpack('<II', handle.read(8))
+    data = zlib.decompress(cdata, -15)
+    if len(data) != isize or zlib.crc32(data) & 0xffffffff != crc:
+        raise ValueError('Corrupted BGZF block')
+    return bsize + 1, data
+
+
+class BgzfReader(object):
+    """read lines of BGZF file, tell and seek use virtual offsets"""
+    def __init__(self, fname):
+        self.name = fname
+        self._handle = open(fname, 'rb')
+        self._block = 0                 # file offset of current block
+        self._size = 0                  # compressed size of current block
+        self._data = ''
+        self._within = 0
+        self._load(0)
+
+    def _load(self, block):
+        self._handle.seek(block)
+        result = _read_block(self._handle)
+        self._block = block
+        self._within = 0
+        if result is None:
+            self._size, self._data = 0, ''
+        else:
+            self._size, self._data = result
+
+    def _next_block(self):
+        """load the next block with data, False at end of file"""
+        while self._size:
+            self._load(self._block + self._size)
+            if self._data:
+                return True
+        return False
+
+    def tell(self):
+        if self._within >= len(self._data) and self._size:
+            return make_voffset(self._block + self._size, 0)
+        return make_voffset(self._block, self._within)
+
+    def seek(self, voffset, whence=0):
+        block, within = split_voffset(voffset)
+        if block != self._block or not self._size:
+            self._load(block)
+        self._within = within
+
+    def read(self, size=-1):
+        chunks = []
+        while size:
+            if self._within >= len(self._data) and not self._next_block():
+                break
+            end = (len(self._data) if size < 0 else
+                   min(len(self._data), self._within + size))
+            chunks.append(self._data[self._within:end])
+            if size > 0:
+                size -= end - self._within
+            self._within = end
+        return ''.join(chunks)
+
+    def readline(self):
+        chunks = []
+        while True:
+            if self._within >= len(self._data) and not self._next_block():
+                break
+            idx = self._data.find('\n', self._within)
+            if idx >= 0:
+                chunks.append(self._data[self._within:idx+1])
+                self._within = idx + 1
+                break
+            chunks.append(self._data[self._within:])
+            self._within = len(self._data)
+        return ''.join(chunks)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BgzfWriter(object):
+    """write data to BGZF file in blocks of BLOCK_SIZE, tell gives the
+    virtual offset of the next byte written"""
+    def __init__(self, fname, level=6):
+        self.name = fname
+        self._handle = open(fname, 'wb')
+        self._level = level
+        self._buffer = []
+        self._size = 0                  # bytes in buffer
+        self._offset = 0                # file offset of next block
+
+    def _write_block(self, data):
+        compress = zlib.compressobj(self._level, zlib.DEFLATED, -15)
+        cdata = compress.compress(data) + compress.flush()
+        block = ''.join((MAGIC, '\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00',
+                         struct.pack('<H', len(cdata) + 25), cdata,
+                         struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+                                     len(data))))
+        self._handle.write(block)
+        self._offset += len(block)
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= BLOCK_SIZE:
+            data = ''.join(self._buffer)
+            idx = 0
+            while len(data) - idx >= BLOCK_SIZE:
+                self._write_block(data[idx:idx+BLOCK_SIZE])
+                idx += BLOCK_SIZE
+            self._buffer = [data[idx:]]
+            self._size = len(data) - idx
+
+    def flush(self):
+        """write buffered data as a block, the next write starts a block"""
+        if self._size:
+            self._write_block(''.join(self._buffer))
+            self._buffer = []
+            self._size = 0
+        self._handle.flush()
+
+    def tell(self):
+        return make_voffset(self._offset, self._size)
+
+    def close(self):
+        self.flush()
+        self._handle.write(EOF_BLOCK)
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def bgzip(fname, outfile=None):
+    """compress fname to outfile (fname + '.gz') in BGZF"""
+    outfile = outfile or fname + '.gz'
+    with open(fname, 'rb') as handle:
+        with BgzfWriter(outfile) as out:
+            for data in iter(lambda: handle.read(BLOCK_SIZE), ''):
+                out.write(data)
+    return outfile
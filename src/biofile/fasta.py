@@ -12,8 +12,12 @@ function read: return the first fasta record
 class Fasta: easy way to deal with fasta record
 """
 
+import os
+import sys
+
 from xopen import xopen                 # get read gzip file support
 LINE_WIDTH = 60                         # each line contain bases
+FAI_EXT = '.fai'                        # samtools faidx index
 
 
 class Fasta(object):
@@ -68,3 +72,153 @@ def read(fname):
     except StopIteration:
         raise ValueError, 'Fasta file: {0} is Empty'.format(fname)
 
+
+
+# **********************************************************************
+# fai index: fetch slices of sequences without reading the whole file
+# **********************************************************************
+class FaiRecord(object):
+    def __init__(self, name, length, offset, linebases, linewidth):
+        self.name = name
+        self.length = int(length)
+        self.offset = int(offset)       # file offset of first base
+        self.linebases = int(linebases) # bases of each line
+        self.linewidth = int(linewidth) # bytes of each line with newline
+
+    def file_offset(self, pos):
+        return (self.offset + pos // self.linebases * self.linewidth +
+                pos % self.linebases)
+
+    def __repr__(self):
+        return '\t'.join(map(str, (self.name, self.length, self.offset,
+                                    self.linebases, self.linewidth)))
+
+
+def index(fname, idxfile=None):
+    """write samtools compatible fai index of plain text fasta fname to
+    fname + '.fai' unless idxfile is given, return [FaiRecord]"""
+    records = []
+    with open(fname, 'rb') as handle:
+        offset = 0
+        rec = None
+        short = False                   # a line shorter than linebases
+        for line in handle:
+            size = len(line)
+            if line.startswith('>'):
+                rec = FaiRecord(line[1:].split(None, 1)[0], 0,
+                                offset + size, 0, 0)
+                records.append(rec)
+                short = False
+            elif rec is not None:
+                bases = len(line.rstrip('\r\n'))
+                if not bases:
+                    offset += size
+                    continue
+                if not rec.linebases:
+                    rec.linebases, rec.linewidth = bases, size
+                elif short or bases > rec.linebases or (
+                        bases == rec.linebases and size != rec.linewidth):
+                    raise ValueError('Different line length in {0}: {1}'
+                                     .format(fname, rec.name))
+                if bases < rec.linebases:
+                    short = True
+                rec.length += bases
+            offset += size
+    with open(idxfile or fname + FAI_EXT, 'w') as out:
+        for rec in records:
+            print >>out, repr(rec)
+    return records
+
+
+class IndexedFasta(object):
+    """fetch sequence slices of fasta file indexed by index()"""
+    def __init__(self, fname, idxfile=None):
+        idxfile = idxfile or fname + FAI_EXT
+        if not os.path.exists(idxfile):
+            index(fname, idxfile)
+        self.records = {}
+        self.names = []
+        with open(idxfile, 'r') as handle:
+            for line in handle:
+                if line.strip():
+                    rec = FaiRecord(*line.rstrip('\r\n').split('\t')[:5])
+                    self.records[rec.name] = rec
+                    self.names.append(rec.name)
+        self._handle = open(fname, 'rb')
+
+    def __contains__(self, name):
+        return name in self.records
+
+    def length(self, name):
+        return self.records[name].length
+
+    def fetch(self, name, start=0, end=None):
+        """bases of [start, end) of sequence name, 0-based"""
+        rec = self.records[name]
+        if end is None or end > rec.length:
+            end = rec.length
+        start = max(start, 0)
+        if start >= end:
+            return ''
+        beg = rec.file_offset(start)
+        self._handle.seek(beg)
+        data = self._handle.read(rec.file_offset(end - 1) + 1 - beg)
+        return data.replace('\n', '').replace('\r', '')
+
+    def fetch_chunks(self, name, start=0, end=None, size=1 << 20):
+        """yield [start, end) of sequence name as pieces of size bases"""
+        if end is None:
+            end = self.records[name].length
+        for pos in xrange(start, end, size):
+            yield self.fetch(name, pos, min(pos + size, end))
+
+    def close(self):
+        self._handle.close()
+
+
+class FastaWriter(object):
+    """write fasta records piece by piece in lines of width bases, output
+    is collected and written in blocks of about size bytes"""
+    def __init__(self, fname, width=LINE_WIDTH, size=1 << 20):
+        self._handle = xopen(fname, 'w')
+        self.width = width
+        self.size = size
+        self._lines = []
+        self._nbytes = 0
+        self._rest = ''                 # bases of unfinished line
+
+    def _add(self, text):
+        self._lines.append(text)
+        self._nbytes += len(text)
+        if self._nbytes >= self.size:
+            self.flush()
+
+    def start(self, name):
+        """start record name, ends the last one"""
+        self.end()
+        self._add('>{0}\n'.format(name))
+
+    def write(self, seq):
+        """append bases to current record"""
+        seq = self._rest + seq
+        full = len(seq) - len(seq) % self.width
+        if full:
+            self._add(''.join(['{0}\n'.format(seq[i:i+self.width])
+                               for i in xrange(0, full, self.width)]))
+        self._rest = seq[full:]
+
+    def end(self):
+        if self._rest:
+            self._add(self._rest + '\n')
+            self._rest = ''
+
+    def flush(self):
+        self._handle.write(''.join(self._lines))
+        self._lines = []
+        self._nbytes = 0
+
+    def close(self):
+        self.end()
+        self.flush()
+        if self._handle is not sys.stdout:
+            self._handle.close()
@@ -7,10 +7,43 @@
 # parse blat program output psl file
 # **********************************************************************
 
+import marshal
+import os
+import tempfile
+from array import array
+from itertools import chain, groupby, islice
+
+from pyngs.lib.libinterval import GenomeIndex
+
+CACHE_EXT = '.pslc'                     # binary cache next to psl file
+CACHE_MAGIC = 'PSLC3'
+CACHE_END = 'END'                       # (CACHE_END, count) after chunks
+CACHE_CHUNK = 10000                     # records marshaled at once
+
+# columns 1-8, 11-13, 15-18 of psl line
+INT_COLUMNS = (0, 1, 2, 3, 4, 5, 6, 7, 10, 11, 12, 14, 15, 16, 17)
+INT_FIELDS = ('match', 'mismatch', 'repmatch', 'n_count', 'q_gap_count',
+              'q_gap_bases', 't_gap_count', 't_gap_bases', 'qsize',
+              'qstart', 'qend', 'tsize', 'tstart', 'tend', 'block_count')
+
+
+def _int_array(comma_string):
+    """comma separated ints (eg. '10,20,') to array('i')"""
+    if not isinstance(comma_string, basestring):
+        return array('i', comma_string)
+    comma_string = comma_string.rstrip(',')
+    if not comma_string:
+        return array('i')
+    return array('i', map(int, comma_string.split(',')))
+
+
 class Psl(object):
     """One line of PSL lines represent alignments, and typically taken from
-    files generated by BLAT or psLayout.
+    files generated by BLAT or psLayout. Blocks are kept in array('i').
     """
+    __slots__ = INT_FIELDS + ('strand', 'qname', 'tname', 'block_sizes',
+                              'qstarts', 'tstarts', 'qseq', 'tseq')
+
     def __init__(self, match, mismatch, repmatch, n_count, q_gap_count,
                  q_gap_bases, t_gap_count, t_gap_bases, strand, qname,
                  qsize, qstart, qend, tname, tsize, tstart, tend,
@@ -73,50 +106,362 @@ class Psl(object):
         self.block_count = int(block_count)
 
         # 19 Comma-separated list of sizes of each block
-        self.block_sizes = self._deal_comma_string(block_sizes)
+        self.block_sizes = _int_array(block_sizes)
 
         # 20 Comma-separated list of starting positions of each block in
         #    query
-        self.qstarts = self._deal_comma_string(qstarts)
+        self.qstarts = _int_array(qstarts)
 
         # 21 Comma-separated list of starting positions of each block in
         #    target
-        self.tstarts = self._deal_comma_string(tstarts)
+        self.tstarts = _int_array(tstarts)
 
         self.qseq = qseq                # query sequence
         self.tseq = tseq                # target sequence
 
-    def _deal_comma_string(self, comma_string):
-        """split comma_string to int value list"""
-        return [int(val) for val in comma_string.split(',') if val]
+    @classmethod
+    def from_items(cls, items):
+        """Psl of split psl line, scalars and blocks are converted to int
+        by one map call"""
+        psl = cls.__new__(cls)
+        blocks = ','.join([items[18].rstrip(','), items[19].rstrip(','),
+                           items[20].rstrip(',')])
+        try:
+            ints = map(int, [items[i] for i in INT_COLUMNS] +
+                       blocks.split(','))
+        except ValueError:              # no blocks
+            ints = map(int, [items[i] for i in INT_COLUMNS])
+            ints.extend(chain(_int_array(items[18]), _int_array(items[19]),
+                              _int_array(items[20])))
+        (psl.match, psl.mismatch, psl.repmatch, psl.n_count,
+         psl.q_gap_count, psl.q_gap_bases, psl.t_gap_count, psl.t_gap_bases,
+         psl.qsize, psl.qstart, psl.qend, psl.tsize, psl.tstart, psl.tend,
+         psl.block_count) = ints[:15]
+        blocks = array('i', ints[15:])
+        n = len(blocks) // 3
+        psl.block_sizes = blocks[:n]
+        psl.qstarts = blocks[n:2*n]
+        psl.tstarts = blocks[2*n:]
+        psl.strand = items[8]
+        psl.qname = items[9]
+        psl.tname = items[13]
+        psl.qseq = items[21] if len(items) > 21 else None
+        psl.tseq = items[22] if len(items) > 22 else None
+        return psl
+
+    def _to_tuple(self):
+        return (tuple([getattr(self, field) for field in INT_FIELDS]),
+                self.strand, self.qname, self.tname,
+                (self.block_sizes + self.qstarts + self.tstarts).tostring(),
+                self.qseq, self.tseq)
+
+    @classmethod
+    def _from_tuple(cls, data):
+        psl = cls.__new__(cls)
+        psl.__setstate__(data)
+        return psl
+
+    def __getstate__(self):             # __slots__ without __dict__
+        return self._to_tuple()
+
+    def __setstate__(self, data):
+        psl = self
+        ((psl.match, psl.mismatch, psl.repmatch, psl.n_count,
+          psl.q_gap_count, psl.q_gap_bases, psl.t_gap_count, psl.t_gap_bases,
+          psl.qsize, psl.qstart, psl.qend, psl.tsize, psl.tstart, psl.tend,
+          psl.block_count), psl.strand, psl.qname, psl.tname, blocks,
+         psl.qseq, psl.tseq) = data
+        blocks = array('i', blocks)
+        n = len(blocks) // 3
+        psl.block_sizes = blocks[:n]
+        psl.qstarts = blocks[n:2*n]
+        psl.tstarts = blocks[2*n:]
+
+    @property
+    def score(self):
+        """pslScore of UCSC: match + repmatch / 2 - mismatch - gaps"""
+        return (self.match + (self.repmatch >> 1) - self.mismatch -
+                self.q_gap_count - self.t_gap_count)
+
+    @property
+    def cover(self):
+        """fraction of query in aligned blocks"""
+        if not self.qsize:
+            return 0.0
+        return float(self.match + self.mismatch + self.repmatch) / self.qsize
+
+    @property
+    def tblocks(self):
+        """[start, end) of each block on target"""
+        return [(start, start + size)
+                for start, size in zip(self.tstarts, self.block_sizes)]
 
     def __repr__(self):
-        qstarts = ','.join([str(qstart) for qstart in self.qstarts + ['']])
-        qends = ','.join([str(qend) for qend in self.qends + ['']])
+        def _join(values):
+            return ''.join(['{0},'.format(value) for value in values])
 
-        return '\t'.join(map(str, (
-            self.match, self.mismatch, self.repmatch, self.n_count,
-            self.q_gap_count, self.q_gap_bases, self.t_gap_count,
-            self.t_gap_bases, self.strand, self.qname, self.qsize,
-            self.qstart, self.qend, self.tname, self.tsize, self.tstart,
-            self.tend, self.block_count, self.block_sizes,
-            qstarts, tstarts)))
+        items = [self.match, self.mismatch, self.repmatch, self.n_count,
+                 self.q_gap_count, self.q_gap_bases, self.t_gap_count,
+                 self.t_gap_bases, self.strand, self.qname, self.qsize,
+                 self.qstart, self.qend, self.tname, self.tsize, self.tstart,
+                 self.tend, self.block_count, _join(self.block_sizes),
+                 _join(self.qstarts), _join(self.tstarts)]
+        if self.qseq is not None:
+            items.append(self.qseq)
+        if self.tseq is not None:
+            items.append(self.tseq)
+        return '\t'.join(map(str, items))
 
 
-def parse(fname):
+def _parse_text(fname):
     with open(fname, 'r') as handle:
-        for line in handle:
-            # find break line
-            if line.startswith('-----'):
-                break
-        for line in handle:             # PSL Data lines
+        first = handle.readline()
+        if first.startswith('psLayout'): # skip header to break line
+            for line in handle:
+                if line.startswith('-----'):
+                    break
+            lines = handle
+        else:                           # psl without header (-noHead)
+            lines = chain([first], handle)
+        for line in lines:              # PSL Data lines
             line = line.rstrip()        # trim right newline char
             if not line:                # ignore blank line
                 continue
-            items = line.split('\t')
-            yield Psl(*items)
+            yield Psl.from_items(line.split('\t'))
+
+
+def _source_stat(fname):
+    stat = os.stat(fname)
+    return (stat.st_size, int(stat.st_mtime))
+
+
+def _load_cache(fname):
+    """yield Psl of valid cache file of fname, None if cache is stale"""
+    cachefile = fname + CACHE_EXT
+    if not os.path.exists(cachefile):
+        return None
+    handle = open(cachefile, 'rb')
+    try:
+        if marshal.load(handle) != (CACHE_MAGIC,) + _source_stat(fname):
+            handle.close()
+            return None
+    except (EOFError, ValueError, TypeError):
+        handle.close()
+        return None
+
+    def _iter():
+        count = 0
+        with handle:
+            while True:
+                try:
+                    chunk = marshal.load(handle)
+                except (EOFError, ValueError, TypeError):
+                    chunk = None
+                if not isinstance(chunk, list):
+                    break
+                for data in chunk:
+                    yield Psl._from_tuple(data)
+                count += len(chunk)
+        if chunk != (CACHE_END, count):
+            # truncated cache (eg. interrupted write): rebuild it from
+            # fname and go on after the records already yielded
+            for psl in islice(_parse_and_cache(fname), count, None):
+                yield psl
+    return _iter()
+
+
+def _dump(out, data):
+    """marshal data to cache file out, None when the write failed"""
+    try:
+        marshal.dump(data, out)
+        return out
+    except (IOError, OSError):          # eg. disk full, go on without cache
+        out.close()
+        return None
+
+
+def _parse_and_cache(fname):
+    """yield Psl of fname and save them to the cache file, the cache is
+    only kept when all records were read. Records are still yielded when
+    the cache can not be written (eg. read-only directory)"""
+    cachefile = fname + CACHE_EXT
+    tmpfile = '{0}.{1}.tmp'.format(cachefile, os.getpid())
+    stat = _source_stat(fname)
+    try:
+        out = open(tmpfile, 'wb')
+    except (IOError, OSError):
+        out = None
+    if out is not None:
+        out = _dump(out, (CACHE_MAGIC,) + stat)
+    done = False
+    try:
+        chunk = []
+        count = 0
+        for psl in _parse_text(fname):
+            count += 1
+            if out is not None:
+                chunk.append(psl._to_tuple())
+                if len(chunk) >= CACHE_CHUNK:
+                    out = _dump(out, chunk)
+                    chunk = []
+            yield psl
+        if out is not None and chunk:
+            out = _dump(out, chunk)
+        if out is not None:
+            out = _dump(out, (CACHE_END, count))
+        done = True
+    finally:
+        if out is not None:
+            out.close()
+        try:
+            if out is not None and done and _source_stat(fname) == stat:
+                os.rename(tmpfile, cachefile)
+            elif os.path.exists(tmpfile):
+                os.remove(tmpfile)
+        except OSError:
+            pass
+
+
+def parse(fname, cache=False):
+    """yield Psl of fname. With cache the records are read from the binary
+    cache file fname + '.pslc' when it is newer, otherwise the cache is
+    (re)built while parsing. The cache is invalid when size or mtime of
+    fname changed, a truncated cache is rebuilt when it is read"""
+    if cache:
+        cached = _load_cache(fname)
+        if cached is not None:
+            return cached
+        return _parse_and_cache(fname)
+    return _parse_text(fname)
+
+
+def read(fname, cache=False):
+    return parse(fname, cache=cache)
+
+
+# **********************************************************************
+# target side index of alignment blocks
+# **********************************************************************
+def index_blocks(psls):
+    """GenomeIndex of the target blocks of psls (Psl iterable or psl file
+    name) by tname, value of each block is (Psl, block number). Gaps
+    between blocks are not indexed"""
+    if isinstance(psls, basestring):
+        psls = parse(psls)
+    index = GenomeIndex()
+    for psl in psls:
+        for i, (start, end) in enumerate(psl.tblocks):
+            index.add(psl.tname, start, end, (psl, i))
+    return index
+
+
+def overlap_hits(index, tname, start, end):
+    """Psl with a block overlapping [start, end) of tname, each once"""
+    seen = set()
+    hits = []
+    for bstart, bend, (psl, i) in index.overlap(tname, start, end):
+        if id(psl) not in seen:
+            seen.add(id(psl))
+            hits.append(psl)
+    return hits
+
+
+def join_hits(index, regions):
+    """yield (region, [Psl, ...]) of each (tname, start, end, ...) region"""
+    for region in regions:
+        yield region, overlap_hits(index, region[0], region[1], region[2])
+
+
+# **********************************************************************
+# best hits of each query, like pslReps
+# **********************************************************************
+def _select(psls, near, min_cover):
+    """psls of one query scoring within near fraction of the best"""
+    if min_cover:
+        psls = [psl for psl in psls if psl.cover >= min_cover]
+    if not psls:
+        return []
+    best = max([psl.score for psl in psls])
+    cutoff = best - abs(best) * near
+    return [psl for psl in psls if psl.score >= cutoff]
+
+
+def _select_partition(fname, near, min_cover):
+    groups = {}
+    with open(fname, 'r') as handle:
+        for line in handle:
+            psl = Psl.from_items(line.rstrip('\n').split('\t'))
+            groups.setdefault(psl.qname, []).append(psl)
+    for qname in groups:
+        for psl in _select(groups[qname], near, min_cover):
+            yield psl
+
+
+def best_hits(psls, near=0.01, min_cover=0.0, grouped=True,
+              maxhits=1000000, npart=16, tmpdir=None):
+    """Yield the best alignments of each query: score (Psl.score) at least
+    best - near * best of the query, and cover >= min_cover.
+
+    Arguments:
+    - `psls`: Psl iterable or psl file name
+    - `grouped`: alignments of each query are consecutive (eg. sorted by
+                 qname), only one query is kept in memory, ValueError is
+                 raised when a query shows up again. Otherwise the
+                 alignments are grouped in a dict, when more than maxhits
+                 are kept all spill to npart temp files by hash of qname,
+                 which are selected one by one at the end
+    """
+    if isinstance(psls, basestring):
+        psls = parse(psls)
+
+    if grouped:
+        seen = set()
+        for qname, group in groupby(psls, key=lambda psl: psl.qname):
+            if qname in seen:
+                raise ValueError('Alignments of query {0} are not '
+                                 'consecutive, use grouped=False'
+                                 .format(qname))
+            seen.add(qname)
+            for psl in _select(list(group), near, min_cover):
+                yield psl
+        return
 
+    groups = {}
+    nhit = 0
+    parts = []
+    try:
+        for psl in psls:
+            groups.setdefault(psl.qname, []).append(psl)
+            nhit += 1
+            if nhit > maxhits:          # spill all to partitions
+                if not parts:
+                    for i in xrange(npart):
+                        fd, fname = tempfile.mkstemp(suffix='.part.psl',
+                                                     dir=tmpdir)
+                        os.close(fd)
+                        parts.append(open(fname, 'w'))
+                for qname, group in groups.iteritems():
+                    parts[hash(qname) % npart].write(
+                        ''.join(['{0!r}\n'.format(hit) for hit in group]))
+                groups.clear()
+                nhit = 0
 
-def read(fname):
-    return parse(fname)
+        if not parts:
+            for group in groups.itervalues():
+                for psl in _select(group, near, min_cover):
+                    yield psl
+            return
 
+        for qname, group in groups.iteritems():
+            parts[hash(qname) % npart].write(
+                ''.join(['{0!r}\n'.format(hit) for hit in group]))
+        groups.clear()
+        for part in parts:
+            part.close()
+            for psl in _select_partition(part.name, near, min_cover):
+                yield psl
+    finally:
+        for part in parts:
+            part.close()
+            if os.path.exists(part.name):
+                os.remove(part.name)
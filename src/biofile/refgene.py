@@ -8,7 +8,7 @@
 # annotation SNP
 # **********************************************************************
 
-from pyngs.lib.libgene import Exon, Gene
+from pyngs.lib.libgene import Exon, Gene, GeneIndex, cached
 
 # **********************************************************************
 # Below block is parse ucsc record
@@ -149,7 +149,15 @@ def deal_refgene_record_line(line, sep='\t'):
 # **********************************************************************
 # parse ucsc record and return a Gene instance
 # **********************************************************************
-def parse(fname):
+def parse(fname, cache=False):
+    """yield Gene of each refGene record of fname, with cache through the
+    binary gene model cache next to fname (see libgene.cached)"""
+    if cache:
+        return iter(cached(fname, _parse))
+    return _parse(fname)
+
+
+def _parse(fname):
     with open(fname, 'r') as handle:
         for line in handle:
             line = line.rstrip()
@@ -159,24 +167,13 @@ def parse(fname):
 
 
 # **********************************************************************
-# divide genes to blocks, each block size is 0.1M
+# index genes by chrom and strand
 # **********************************************************************
-def parse_gene_list(fname, block=100000):
-    genes = {'-': {}, '+': {}}
-
-    for gene in parse(fname):
-        chrom, gname = gene.name.split('.')[-2:]
-        strand = gene.strand
-        if chrom not in genes[strand]:
-            genes[strand][chrom] = {}
-        # calc block ids
-        start_block_id = gene.start // block
-        end_block_id = gene.end // block
-        for i in xrange(start_block_id, end_block_id+1):
-            if i not in genes[strand][chrom]:
-                genes[strand][chrom][i] = []
-            genes[strand][chrom][i].append(gene)
-    return genes
+def parse_gene_list(fname, cache=False):
+    """libgene.GeneIndex of genes of refGene.txt fname"""
+    if cache:                           # GeneIndex of GeneModels is lazy
+        return GeneIndex(cached(fname, _parse))
+    return GeneIndex(_parse(fname))
 
 
 def main(args):
@@ -14,7 +14,22 @@ position, and variable number of optional fields for flexible or aligner
 specific information.
 """
 
-# import re
+import gzip
+import heapq
+import os
+import re
+import sys
+import tempfile
+from collections import Counter, OrderedDict
+from pyngs.lib import libbin
+from pyngs.lib.libmp import pool_map
+from pyngs.util import byte_shards, read_range
+from xopen import xopen
+
+try:
+    import numpy as np
+except ImportError:                     # numpy is only used by parse_batches
+    np = None
 
 
 # Constant variable
@@ -36,9 +51,17 @@ MASK_READ2 = 0x80        # the last fragment in the template
 MASK_SECONDARY = 0x100   # secondary alignment
 MASK_FAILQC = 0x200      # not passing quality controls
 MASK_DUPLICATE = 0x400   # PCR or optical duplicate
+MASK_SUPPLEMENTARY = 0x800 # supplementary alignment
+
+SORT_COORDINATE = 'coordinate'          # @HD SO: value of sort order
+SORT_QUERYNAME = 'queryname'
 
 
 # CIGAR_RE = '\*|(?:[0-9]+[MIDNSHPX=])+'
+RE_CIGAR_OP = re.compile('([0-9]+)([MIDNSHPX=])')
+
+CIGAR_REF_OPS = 'MDN=X'                 # operations consume reference
+CIGAR_QUERY_OPS = 'MIS=X'               # operations consume query sequence
 
 
 # class Cigar(object):
@@ -90,6 +113,17 @@ MASK_DUPLICATE = 0x400   # PCR or optical duplicate
 #         return flen
 
 
+def parse_cigar(cigar):
+    """split cigar string to [(op, length), ...], '*' return []"""
+    return [(op, int(l)) for l, op in RE_CIGAR_OP.findall(cigar)]
+
+
+def cigar_reflen(cigar):
+    """number of reference bases covered by the cigar string"""
+    return sum([int(l) for l, op in RE_CIGAR_OP.findall(cigar)
+                if op in CIGAR_REF_OPS])
+
+
 class Flag(object):
     """
     ======================================================================
@@ -218,13 +252,18 @@ class Sam(object):
     def aend(self):
         """aligned end position of the read on the reference genome.
         Return None if not available"""
-        pass
+        alen = self.alen
+        if alen is None:
+            return None
+        return self.pos + alen
 
     @property
     def alen(self):
         """aligned length of read on the reference genome.
         Return None if not available"""
-        pass
+        if self.pos == -1 or self.cigar == '*':
+            return None
+        return cigar_reflen(self.cigar)
 
     @property
     def is_paired(self):
@@ -344,12 +383,45 @@ class SamFile(object):
         self.header = header
         self._offset = offset
         self._handle = handle
+        self._index = None
 
     def __iter__(self):
         return self
 
     def reset(self):
-        self._handle(self._offset, 0)
+        self._handle.seek(self._offset, 0)
+
+    def fetch(self, rname, start=0, end=None):
+        """yield Sam records on rname overlapping [start, end), 0-based
+        like Sam.pos. The file must be indexed by index(); fetch moves the
+        file handle, call reset() before iterating the whole file again"""
+        if self._index is None:
+            idxfile = self.filename + libbin.INDEX_EXT
+            if not os.path.exists(idxfile):
+                raise IOError('No index file: {0}, run sam.index first'
+                              .format(idxfile))
+            self._index = libbin.load(idxfile)
+
+        if end is None:
+            end = libbin.MAX_POS
+
+        handle = self._handle
+        for obeg, oend in self._index.chunks(rname, start, end):
+            handle.seek(obeg, 0)
+            offset = obeg
+            while offset < oend:
+                line = handle.readline()
+                if not line:
+                    break
+                offset += len(line)
+                items = line.split(TAB, 6)
+                if items[2] != rname:
+                    return
+                pos = int(items[3]) - 1
+                if pos >= end:          # sorted, no more overlaps
+                    return
+                if _aligned_end(pos, items[5]) > start:
+                    yield _parse_line(line.rstrip())
 
     def next(self):
         while True:
@@ -373,6 +445,70 @@ def _parse_line(samline):
                tlen, seq, qual, *tags)
 
 
+def _aligned_end(pos, cigar):
+    """end of the alignment, a record without cigar cover one base"""
+    if cigar == '*':
+        return pos + 1
+    return pos + (cigar_reflen(cigar) or 1)
+
+
+def index(samfile, idxfile=None):
+    """build the binning and linear index of coordinate sorted samfile,
+    the index is saved to samfile + '.pbi' unless idxfile is given"""
+    idx = libbin.Index()
+    with open(samfile, 'rb') as handle:
+        offset = 0
+        last_rname, last_pos = None, -1
+        for line in handle:
+            obeg = offset
+            offset += len(line)
+            if line.startswith('@'):
+                continue
+            items = line.split(TAB, 6)
+            if len(items) < 6:          # blank line
+                continue
+            rname = items[2]
+            if rname == '*':            # unplaced reads at the end
+                break
+            pos = int(items[3]) - 1
+            if rname != last_rname:
+                if rname in idx:
+                    raise ValueError('{0} is not sorted by coordinate: {1}'
+                                     .format(samfile, rname))
+                last_rname, last_pos = rname, -1
+            elif pos < last_pos:
+                raise ValueError('{0} is not sorted by coordinate: {1}:{2}'
+                                 .format(samfile, rname, pos + 1))
+            last_pos = pos
+            idx.add(rname, pos, _aligned_end(pos, items[5]), obeg, offset)
+
+    idx.save(idxfile or samfile + libbin.INDEX_EXT)
+    return idx
+
+
+def read_header(samfile):
+    """return header lines of samfile"""
+    header = []
+    with xopen(samfile, 'r') as handle:
+        for line in handle:
+            if not line.startswith('@'):
+                break
+            header.append(line.rstrip('\r\n'))
+    return header
+
+
+def get_sq(header):
+    """return [(name, length), ...] of @SQ header lines in order"""
+    sqs = []
+    for line in header:
+        if not line.startswith('@SQ'):
+            continue
+        fields = dict(field.split(':', 1) for field in
+                      line.rstrip().split(TAB)[1:])
+        sqs.append((fields['SN'], int(fields['LN'])))
+    return sqs
+
+
 def parse(samfile):
     with open(samfile, 'r') as handle:
         for line in handle:
@@ -399,3 +535,528 @@ def read(samfile):
     handle.seek(offset, 0)
     return SamFile(samfile, header, handle, offset)
 
+
+# **********************************************************************
+# external merge sort: sorted runs are spilled to temp files and merged
+# **********************************************************************
+def _get_refs(header):
+    """reference name -> index in @SQ header order"""
+    return dict((name, i) for i, (name, length) in enumerate(get_sq(header)))
+
+
+def _sort_header(header, by):
+    """set SO: of @HD line to by"""
+    header = list(header)
+    if header and header[0].startswith('@HD'):
+        fields = [field for field in header[0].split(TAB)
+                  if not field.startswith('SO:')]
+        header[0] = TAB.join(fields + ['SO:' + by])
+    else:
+        header.insert(0, '@HD\tVN:1.4\tSO:' + by)
+    return header
+
+
+def _sort_key(by, refs):
+    """return key function of one sam line"""
+    if by == SORT_COORDINATE:
+        unmapped = len(refs)            # unplaced reads at the end
+        def _key(line):
+            qname, flag, rname, pos, other = line.split(TAB, 4)
+            if rname == '*':
+                return (unmapped, 0, 0)
+            try:
+                return (refs[rname], int(pos), int(flag) & MASK_REVERSE)
+            except KeyError:
+                raise ValueError('Reference not in @SQ header: {0}'
+                                 .format(rname))
+        return _key
+    elif by == SORT_QUERYNAME:
+        def _key(line):
+            qname, flag, other = line.split(TAB, 2)
+            flag = int(flag)
+            return (qname, flag & (MASK_READ1 | MASK_READ2), flag)
+        return _key
+    raise ValueError('Unknown sort order: {0}'.format(by))
+
+
+def _open_run(fname, mode):
+    if fname.endswith('.gz'):
+        return gzip.open(fname, mode, compresslevel=1)
+    return open(fname, mode)
+
+
+def _write_run(lines, by, refs, tmpdir=None, compress=False):
+    """sort lines and spill them to a temp file, return the file name"""
+    lines.sort(key=_sort_key(by, refs))
+    fd, fname = tempfile.mkstemp(suffix='.run.sam.gz' if compress
+                                 else '.run.sam', dir=tmpdir)
+    os.close(fd)
+    with _open_run(fname, 'wb') as handle:
+        handle.writelines(lines)
+    return fname
+
+
+def _iter_run(fname, key):
+    with _open_run(fname, 'rb') as handle:
+        for line in handle:
+            yield key(line), line
+
+
+def _merge_runs(runs, out, key):
+    for k, line in heapq.merge(*[_iter_run(run, key) for run in runs]):
+        out.write(line)
+
+
+def _get_chunks(handle, first, size):
+    """split alignment lines to chunks of about size bytes"""
+    chunk, nbytes = [], 0
+    if first:
+        chunk.append(first)
+        nbytes += len(first)
+    for line in handle:
+        if not line.strip():
+            continue
+        if not line.endswith('\n'):    # last line without newline
+            line += '\n'
+        chunk.append(line)
+        nbytes += len(line)
+        if nbytes >= size:
+            yield chunk
+            chunk, nbytes = [], 0
+    if chunk:
+        yield chunk
+
+
+def sort(samfile, outfile, by=SORT_COORDINATE, memory=512 * 1024 * 1024,
+         pnum=1, tmpdir=None, compress=False, maxopen=256):
+    """Sort samfile by coordinate or queryname into outfile
+
+    Arguments:
+    - `memory`: bytes of sam text kept in memory, split by the pnum
+                processes sorting runs in parallel
+    - `tmpdir`: directory for sorted runs, default is system temp dir
+    - `compress`: gzip sorted runs, fewer disk IO for more CPU
+    - `maxopen`: max runs merged at once, more runs are merged in passes
+    Coordinate order follow @SQ lines, unmapped reads go to the end.
+    Queryname order is plain string order with read1 before read2.
+    """
+    handle = xopen(samfile, 'r')
+    header = []
+    line = handle.readline()
+    while line.startswith('@'):
+        header.append(line.rstrip('\n'))
+        line = handle.readline()
+    refs = _get_refs(header)
+    key = _sort_key(by, refs)
+    size = max(memory // (pnum + 1), 1024)
+
+    runs = []
+    try:
+        chunks = _get_chunks(handle, line if line.strip() else '', size)
+        for run in pool_map(_write_run, ((chunk,) for chunk in chunks),
+                            args=(by, refs, tmpdir, compress), pnum=pnum):
+            runs.append(run)
+        handle.close()
+
+        while len(runs) > maxopen:      # too many runs, merge in passes
+            fd, fname = tempfile.mkstemp(suffix=os.path.splitext(runs[0])[1],
+                                         dir=tmpdir)
+            os.close(fd)
+            with _open_run(fname, 'wb') as out:
+                _merge_runs(runs[:maxopen], out, key)
+            for run in runs[:maxopen]:
+                os.remove(run)
+            runs = runs[maxopen:] + [fname]
+
+        out = xopen(outfile, 'w')
+        for line in _sort_header(header, by):
+            out.write(line + '\n')
+        _merge_runs(runs, out, key)
+        if out is not sys.stdout:
+            out.close()
+    finally:
+        for run in runs:
+            if os.path.exists(run):
+                os.remove(run)
+
+
+# **********************************************************************
+# pair mates of unsorted sam: unmatched reads wait in memory keyed by
+# qname, the oldest ones spill to hash partitioned temp files
+# **********************************************************************
+def _mate_order(line1, line2):
+    """read1 first"""
+    if int(line2.split(TAB, 2)[1]) & MASK_READ1:
+        return line2, line1
+    return line1, line2
+
+
+def _resolve_partition(fname, orphan=None):
+    pending = {}
+    with open(fname, 'r') as handle:
+        for line in handle:
+            line = line.rstrip('\n')
+            qname = line.split(TAB, 1)[0]
+            mate = pending.pop(qname, None)
+            if mate is None:
+                pending[qname] = line
+            else:
+                yield _mate_order(mate, line)
+    if orphan:
+        for line in pending.itervalues():
+            orphan(line)
+
+
+def pair_lines(lines, maxreads=1000000, npart=16, tmpdir=None, orphan=None):
+    """Yield (line1, line2) mate pairs from sam lines in any order, read1
+    comes first. A pair is yielded as soon as both mates are seen.
+
+    Arguments:
+    - `lines`: sam lines, header lines are skipped
+    - `maxreads`: max unmatched reads kept in memory, when exceeded the
+                  oldest half spill to npart temp files by hash of qname,
+                  which are paired after all lines have been read
+    - `orphan`: called with each line whose mate never appears
+    Secondary and supplementary alignments are skipped.
+    """
+    pending = OrderedDict()
+    parts = []
+    try:
+        for line in lines:
+            if line.startswith('@'):
+                continue
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            qname, flag, other = line.split(TAB, 2)
+            if int(flag) & (MASK_SECONDARY | MASK_SUPPLEMENTARY):
+                continue
+            mate = pending.pop(qname, None)
+            if mate is not None:
+                yield _mate_order(mate, line)
+                continue
+            pending[qname] = line
+
+            if len(pending) > maxreads:  # spill the oldest half
+                if not parts:
+                    for i in xrange(npart):
+                        fd, fname = tempfile.mkstemp(suffix='.part.sam',
+                                                     dir=tmpdir)
+                        os.close(fd)
+                        parts.append(open(fname, 'w'))
+                for i in xrange(len(pending) // 2):
+                    qname, line = pending.popitem(last=False)
+                    parts[hash(qname) % npart].write(line + '\n')
+
+        if not parts:
+            if orphan:
+                for line in pending.itervalues():
+                    orphan(line)
+            return
+
+        for qname, line in pending.iteritems():
+            parts[hash(qname) % npart].write(line + '\n')
+        pending.clear()
+        for part in parts:
+            part.close()
+            for pair in _resolve_partition(part.name, orphan):
+                yield pair
+    finally:
+        for part in parts:
+            part.close()
+            if os.path.exists(part.name):
+                os.remove(part.name)
+
+
+def pair(samfile, **kwargs):
+    """yield (read1, read2) Sam records of samfile in any order, see
+    pair_lines for kwargs"""
+    with xopen(samfile, 'r') as handle:
+        for line1, line2 in pair_lines(handle, **kwargs):
+            yield _parse_line(line1), _parse_line(line2)
+
+
+# **********************************************************************
+# flagstat like summary statistics from raw sam columns
+# **********************************************************************
+class SamStats(object):
+    """alignment counters, stats of file shards are added with +="""
+    COUNTERS = ('total', 'failqc', 'secondary', 'supplementary', 'duplicate',
+                'mapped', 'paired', 'read1', 'read2', 'proper_pair',
+                'both_mapped', 'singleton', 'mate_diff_ref',
+                'mate_diff_ref_q5', 'clipped', 'clipped_bases', 'bases')
+
+    def __init__(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.mapq = Counter()           # mapq of mapped primary reads
+        self.nm = Counter()             # NM tag of mapped primary reads
+        self.tlen = Counter()           # insert size of pairs, once a pair
+
+    def add(self, line):
+        """count one sam alignment line"""
+        items = line.split(TAB, 11)
+        flag = int(items[1])
+        self.total += 1
+        if flag & MASK_FAILQC:
+            self.failqc += 1
+        if flag & MASK_DUPLICATE:
+            self.duplicate += 1
+        mapped = not flag & MASK_UNMAPPED
+        if mapped:
+            self.mapped += 1
+        if flag & MASK_SECONDARY:
+            self.secondary += 1
+            return
+        if flag & MASK_SUPPLEMENTARY:
+            self.supplementary += 1
+            return
+
+        if flag & MASK_MULTI_FRAG:
+            self.paired += 1
+            if flag & MASK_READ1:
+                self.read1 += 1
+            if flag & MASK_READ2:
+                self.read2 += 1
+            if mapped and flag & MASK_PROP_ALIGN:
+                self.proper_pair += 1
+            if mapped:
+                if flag & MASK_MATE_UNMAPPED:
+                    self.singleton += 1
+                else:
+                    self.both_mapped += 1
+                    if items[6] != '=' and items[6] != items[2]:
+                        self.mate_diff_ref += 1
+                        if int(items[4]) >= 5:
+                            self.mate_diff_ref_q5 += 1
+                    tlen = int(items[8])
+                    if tlen > 0:
+                        self.tlen[tlen] += 1
+
+        if not mapped:
+            return
+        self.mapq[int(items[4])] += 1
+        if len(items) > 11:
+            idx = items[11].find('NM:i:')
+            if idx != -1 and (idx == 0 or items[11][idx-1] == TAB):
+                end = items[11].find(TAB, idx)
+                self.nm[int(items[11][idx+5:end if end != -1 else None])] += 1
+
+        clipped = 0
+        for length, op in RE_CIGAR_OP.findall(items[5]):
+            if op in CIGAR_QUERY_OPS:
+                self.bases += int(length)
+                if op == 'S':
+                    clipped += int(length)
+        if clipped:
+            self.clipped += 1
+            self.clipped_bases += clipped
+
+    def __iadd__(self, other):
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.mapq.update(other.mapq)
+        self.nm.update(other.nm)
+        self.tlen.update(other.tlen)
+        return self
+
+    def _percent(self, num, total):
+        return '{0:.2f}%'.format(100.0 * num / total) if total else 'N/A'
+
+    def report(self):
+        """return flagstat like report lines"""
+        primary = self.total - self.secondary - self.supplementary
+        lines = [
+            '{0} in total'.format(self.total),
+            '{0} QC failure'.format(self.failqc),
+            '{0} secondary'.format(self.secondary),
+            '{0} supplementary'.format(self.supplementary),
+            '{0} duplicates'.format(self.duplicate),
+            '{0} mapped ({1})'.format(
+                self.mapped, self._percent(self.mapped, self.total)),
+            '{0} paired in sequencing'.format(self.paired),
+            '{0} read1'.format(self.read1),
+            '{0} read2'.format(self.read2),
+            '{0} properly paired ({1})'.format(
+                self.proper_pair, self._percent(self.proper_pair,
+                                                self.paired)),
+            '{0} with itself and mate mapped'.format(self.both_mapped),
+            '{0} singletons ({1})'.format(
+                self.singleton, self._percent(self.singleton, self.paired)),
+            '{0} with mate mapped to a different chr'.format(
+                self.mate_diff_ref),
+            '{0} with mate mapped to a different chr (mapQ>=5)'.format(
+                self.mate_diff_ref_q5),
+            '{0} soft clipped reads ({1} of mapped primary)'.format(
+                self.clipped, self._percent(self.clipped,
+                                            sum(self.mapq.values()))),
+            '{0} soft clipped bases ({1})'.format(
+                self.clipped_bases, self._percent(self.clipped_bases,
+                                                  self.bases)),
+            ]
+        for name in ('mapq', 'nm', 'tlen'):
+            counter = getattr(self, name)
+            for key in sorted(counter):
+                lines.append('{0}\t{1}\t{2}'.format(name.upper(), key,
+                                                     counter[key]))
+        return lines
+
+    def __repr__(self):
+        return '<SamStats total:{0} mapped:{1}>'.format(self.total,
+                                                        self.mapped)
+
+
+def _stats_lines(lines):
+    stats = SamStats()
+    for line in lines:
+        if line.startswith('@') or not line.strip():
+            continue
+        stats.add(line)
+    return stats
+
+
+def _stats_range(beg, end, samfile):
+    return _stats_lines(read_range(samfile, beg, end))
+
+
+def stats(samfile, pnum=1):
+    """SamStats of samfile, plain text samfile is split to byte shards
+    counted by pnum processes and merged"""
+    if pnum < 2 or samfile.endswith('.gz') or samfile == '-':
+        with xopen(samfile, 'r') as handle:
+            return _stats_lines(handle)
+
+    samfileobj = read(samfile)
+    offset = samfileobj._offset
+    samfileobj._handle.close()
+
+    total = SamStats()
+    for part in pool_map(_stats_range, byte_shards(samfile, pnum * 4, offset),
+                         args=(samfile,), pnum=pnum):
+        total += part
+    return total
+
+
+# **********************************************************************
+# columnar batches: numpy arrays of the numeric columns next to raw lines
+# **********************************************************************
+MISSING = -1                            # value of absent tag or '*' field
+
+
+def _get_tag(line, key):
+    """value of key ('\\tNM:') in sam line, i tags as int, A tags as
+    ord(char)"""
+    idx = line.find(key)
+    if idx == -1:
+        return MISSING
+    tp = line[idx+4]
+    end = line.find(TAB, idx + 1)
+    val = line[idx+6:end] if end != -1 else line[idx+6:]
+    if tp == 'i':
+        return int(val)
+    elif tp == 'A':
+        return ord(val)
+    return MISSING
+
+
+class SamBatch(object):
+    """A block of alignments as column arrays, row i is lines[i]
+
+    flag, rid, pos, mapq, mrid, pnext, tlen: int arrays, pos and pnext
+    are 0-based, rid and mrid are reference index in @SQ order ('*' is -1)
+    clipped: bool array, soft clip in cigar
+    tags: {tag: int32 array}, integer tags by value, single character
+          tags by ord(char), absent tag is MISSING
+    """
+    def __init__(self, lines, refs, tags=('NM',)):
+        self.lines = lines
+        self.refs = refs
+        flag, rid, pos, mapq, mrid, pnext, tlen, clipped = (
+            [], [], [], [], [], [], [], [])
+        keys = [TAB + tag + ':' for tag in tags]
+        values = [[] for tag in tags]
+        for line in lines:
+            items = line.split(TAB, 9)
+            flag.append(int(items[1]))
+            rid.append(self._rid(items[2]))
+            pos.append(int(items[3]) - 1)
+            mapq.append(int(items[4]))
+            clipped.append('S' in items[5])
+            mrid.append(rid[-1] if items[6] == '=' else self._rid(items[6]))
+            pnext.append(int(items[7]) - 1)
+            tlen.append(int(items[8]))
+            for key, vals in zip(keys, values):
+                vals.append(_get_tag(line, key))
+
+        self.flag = np.array(flag, dtype=np.uint16)
+        self.rid = np.array(rid, dtype=np.int32)
+        self.pos = np.array(pos, dtype=np.int32)
+        self.mapq = np.array(mapq, dtype=np.uint8)
+        self.mrid = np.array(mrid, dtype=np.int32)
+        self.pnext = np.array(pnext, dtype=np.int32)
+        self.tlen = np.array(tlen, dtype=np.int32)
+        self.clipped = np.array(clipped, dtype=np.bool_)
+        self.tags = dict((tag, np.array(vals, dtype=np.int32))
+                         for tag, vals in zip(tags, values))
+
+    def _rid(self, rname):
+        if rname == '*':
+            return MISSING
+        if rname not in self.refs:      # reference not in header
+            self.refs[rname] = len(self.refs)
+        return self.refs[rname]
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __repr__(self):
+        return '<SamBatch records:{0}>'.format(len(self.lines))
+
+    def __getattr__(self, key):
+        """tag arrays are also reached as batch.NM"""
+        tags = self.__dict__.get('tags', {})
+        if key in tags:
+            return tags[key]
+        raise AttributeError(key)
+
+    def has(self, mask):
+        """bool array, True where any bit of mask is set, eg.
+        batch.has(MASK_UNMAPPED)"""
+        return (self.flag & mask) != 0
+
+    def select(self, keep):
+        """lines where bool array keep is True"""
+        lines = self.lines
+        return [lines[i] for i in np.flatnonzero(keep)]
+
+
+def parse_batches(samfile, size=65536, tags=('NM',)):
+    """yield SamBatch of at most size alignments of samfile, see SamBatch
+    for the columns. Reference ids follow the @SQ header order"""
+    if np is None:
+        raise ImportError('numpy is required by sam.parse_batches')
+
+    handle = xopen(samfile, 'r')
+    header = []
+    line = handle.readline()
+    while line.startswith('@'):
+        header.append(line)
+        line = handle.readline()
+    refs = _get_refs(header)
+
+    lines = []
+    if line.strip():
+        lines.append(line.rstrip('\r\n'))
+    for line in handle:
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        lines.append(line)
+        if len(lines) >= size:
+            yield SamBatch(lines, refs, tags)
+            lines = []
+    if lines:
+        yield SamBatch(lines, refs, tags)
+
+    if handle is not sys.stdin:
+        handle.close()
@@ -8,13 +8,65 @@
 # **********************************************************************
 """Read and Parse VCF (Variant Call Format) version 4.1"""
 
+import gzip
+import os
 import re
+import sys
+from collections import OrderedDict
+
+from pyngs.biofile import bgzf
+from pyngs.lib import libbin
+from pyngs.lib.libmp import pool_map
+from pyngs.util import byte_shards, read_range
+
+try:
+    import numpy as np
+except ImportError:                     # numpy is only used by genotype_matrix
+    np = None
 
 # File meta-information is included after the ## string, often as
 # key=value pairs.
 # A single 'fileformat' field is always required, must be the first
 # line in the file
 
+# Values of INFO and FORMAT fields are cast by Type, Number=1 gives one
+# value, other Number (n, A, R, G, .) a list, '.' is None
+TYPES = {'Integer': int, 'Float': float, 'String': str, 'Character': str}
+
+
+def _flag(value):
+    return True
+
+
+def make_converter(number, type_):
+    """function converting value string of field with Number number and
+    Type type_"""
+    if type_ == 'Flag':
+        return _flag
+    cast = TYPES.get(type_, str)
+    if number == '1':
+        def _convert(value):
+            if value is True:           # key without value
+                return True
+            return None if value == '.' else cast(value)
+    else:
+        def _convert(value):
+            if value is True:
+                return True
+            return [None if item == '.' else cast(item)
+                    for item in value.split(',')]
+    return _convert
+
+
+def format_value(value):
+    """value to VCF string, None is '.' and list is joined by ','"""
+    if value is None:
+        return '.'
+    if isinstance(value, (list, tuple)):
+        return ','.join([format_value(item) for item in value])
+    return str(value)
+
+
 # INFO fields should be described as follows (all keys are required):
 # ##INFO=<ID=ID,Number=number,Type=type,Description=”description”>
 RE_INFO = re.compile('##INFO=<ID=(?P<id>[^,]+),Number=(?P<number>[^,]+),Type=(?P<type>[^,]+),Description="(?P<desc>[^"]+)">')
@@ -25,6 +77,7 @@ class Info(object):
         self._number = number
         self._type = type
         self._desc = desc
+        self.convert = make_converter(number, type)
 
     def __repr__(self):
         return '##INFO=<ID={0},Number={1},Type={2},Description="{3}">'\
@@ -33,7 +86,7 @@ class Info(object):
 
 # FILTERs that have been applied to the data should be described as follows:
 # ##FILTER=<ID=ID,Description=”description”>
-RE_FILTER = re.compile('##FILTER=<ID=[^,]+,Description="[^"]+">')
+RE_FILTER = re.compile('##FILTER=<ID=(?P<id>[^,]+),Description="(?P<desc>[^"]+)">')
 
 class Filter(object):
     def __init__(self, id, desc):
@@ -54,6 +107,7 @@ class Format(object):
         self._number = number
         self._type = type
         self._desc = desc
+        self.convert = make_converter(number, type)
 
     def __repr__(self):
         return '##FORMAT=<ID={0},Number={1},Type={2},Description="{3}">'\
@@ -69,59 +123,320 @@ class Format(object):
 # FILTER
 # INFO
 
-class VcfRecord(object):
-    def __init__(self, source, chrom, pos, id_, ref, alt, qual, filter_,
-                 info, **kwargs):
-        self.source = source
-        self.chrom = chrom
-        self.pos = pos
-        self.id = id_
-        self.ref = ref
-        self.alt = alt
-        self.qual = qual
-        self.filter = filter_
-        self.__dict__.update(**kwargs)
-        self.deal_info(info)
-
-    def deal_info(self, info):
-        items = info.split(';')
-        self.is_indel = False
-        if items[0] == 'INDEL':
-            self.is_indel = True
-            items = items[1:]
-        self.__dict__.update(**dict([item.split('=') for item in items if item]))
+class FormatKeys(object):
+    """keys of a FORMAT column, shared by all records with the same FORMAT
+    string so each sample value is reached by index"""
+    def __init__(self, format_):
+        self.keys = format_.split(':') if format_ else []
+        self.index = dict([(key, i) for i, key in enumerate(self.keys)])
+
+    def __repr__(self):
+        return '<FormatKeys {0}>'.format(':'.join(self.keys))
+
+
+def _get_format(formats, format_):
+    try:
+        return formats[format_]
+    except KeyError:
+        keys = formats[format_] = FormatKeys(format_)
+        return keys
+
+
+class Call(object):
+    """genotype data of one sample of a VcfRecord"""
+    __slots__ = ('record', 'index')
+
+    def __init__(self, record, index):
+        self.record = record
+        self.index = index              # sample index
+
+    @property
+    def sample(self):
+        return self.record.samples[self.index]
+
+    @property
+    def data(self):
+        return self.record.sample_data[self.index]
+
+    def __getitem__(self, key):
+        idx = self.record.format.index[key]
+        data = self.data
+        if idx >= len(data):            # trailing fields may be dropped
+            return '.'
+        return data[idx]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def value(self, key, default=None):
+        """FORMAT value of key cast by header"""
+        value = self.get(key)
+        if value is None:
+            return default
+        header = self.record.header
+        return value if header is None else header.convert_format(key, value)
+
+    def __getattr__(self, key):         # FORMAT fields as attributes
+        if key not in self.record.format.index:
+            raise AttributeError(key)
+        return self.value(key)
+
+    def set(self, key, value):
+        """set FORMAT value of key, key must be in FORMAT of record"""
+        idx = self.record.format.index[key]
+        data = self.data
+        if idx >= len(data):
+            data.extend(['.'] * (idx + 1 - len(data)))
+        data[idx] = format_value(value)
+        self.record._samples_dirty = True
+        self.record._genotypes = None
 
     @property
     def genotype(self):
-        if 'PL' not in self.__dict__:
-            return '{0}/{1}'.format(self.ref, self.ref)
-        bases = [self.ref] + self.alt.split(',')
-        types = []
-        bn = len(bases)                 # bn: bases length
-        for i in xrange(bn):
-            for j in xrange(i, bn):
-                types.append((bases[i], bases[j]))
-        pls = self.PL.split(',')
-        pls = [eval(each) for each in pls]
-        _min = min(pls)
-        idx  = pls.index(_min)
-        return '{0}/{1}'.format(*types[idx])
+        """most likely genotype by PL as allele strings, eg. 'A/G'"""
+        return self.record.genotypes()[self.index]
+
+    def __repr__(self):
+        return '<Call {0} {1}>'.format(self.sample, ':'.join(self.data))
+
+
+class VcfRecord(object):
+    """One data line of VCF. pos is 0-based like Sam.pos, INFO is split
+    only when a key is asked and sample columns only when a Call is
+    asked, FORMAT keys are shared through a FormatKeys object"""
+    def __init__(self, line, samples=(), formats=None, header=None):
+        self.line = line
+        self.header = header
+        items = line.split('\t', 9)
+        if len(items) < 8:
+            raise ValueError('Too few columns of VCF line: {0}'.format(line))
+        (self.chrom, pos, self.id, self.ref, self.alt, self.qual,
+         self.filter, self._info) = items[:8]
+        self.pos = int(pos) - 1
+        self._fields = (self.chrom, self.pos, self.id, self.ref, self.alt,
+                        self.qual, self.filter)
+        self.samples = samples
+        if formats is None:
+            formats = {}
+        self.format = _get_format(formats, items[8] if len(items) > 8
+                                  else '')
+        self._samples_text = items[9] if len(items) > 9 else ''
+        self._info_dict = None
+        self._typed = None
+        self._genotypes = None          # key -> genotypes of samples
+        self._sample_data = None
+        self._info_dirty = self._samples_dirty = False
+
+    @property
+    def info(self):
+        """INFO as OrderedDict, flags have value True"""
+        if self._info_dict is None:
+            info = OrderedDict()
+            if self._info != '.':
+                for item in self._info.split(';'):
+                    if not item:
+                        continue
+                    key, sep, value = item.partition('=')
+                    info[key] = value if sep else True
+            self._info_dict = info
+        return self._info_dict
+
+    def get(self, key, default=None):
+        """INFO value of key cast by header, cast once and cached"""
+        if self._typed is None:
+            self._typed = {}
+        try:
+            return self._typed[key]
+        except KeyError:
+            pass
+        value = self.info.get(key)
+        if value is None:
+            return default
+        if self.header is not None:
+            value = self.header.convert_info(key, value)
+        self._typed[key] = value
+        return value
+
+    def set_info(self, key, value):
+        """set INFO key, value True is a flag, list is joined by ','"""
+        self.info[key] = value if value is True else format_value(value)
+        if self._typed:
+            self._typed.pop(key, None)
+        self._info_dirty = True
+
+    def del_info(self, key):
+        if key in self.info:
+            del self.info[key]
+            if self._typed:
+                self._typed.pop(key, None)
+            self._info_dirty = True
+
+    @property
+    def is_indel(self):
+        return 'INDEL' in self.info
+
+    @property
+    def modified(self):
+        return (self._info_dirty or self._samples_dirty or
+                self._fields != (self.chrom, self.pos, self.id, self.ref,
+                                 self.alt, self.qual, self.filter))
+
+    def to_line(self):
+        """VCF line of record, the parsed line if nothing was modified"""
+        if not self.modified:
+            return self.line
+        if self._info_dirty:
+            info = ';'.join([key if value is True else
+                             '{0}={1}'.format(key, value)
+                             for key, value in self.info.iteritems()]) or '.'
+        else:
+            info = self._info
+        items = [self.chrom, str(self.pos + 1), self.id, self.ref, self.alt,
+                 self.qual, self.filter, info]
+        if self.format.keys:
+            items.append(':'.join(self.format.keys))
+            if self._samples_dirty:
+                items.extend([':'.join(data) for data in self.sample_data])
+            elif self._samples_text:
+                items.append(self._samples_text)
+        return '\t'.join(items)
+
+    __str__ = to_line
+
+    @property
+    def sample_data(self):
+        """list of FORMAT value lists, one per sample"""
+        if self._sample_data is None:
+            self._sample_data = [
+                item.split(':') for item in
+                self._samples_text.rstrip('\r\n').split('\t')
+            ] if self._samples_text else []
+        return self._sample_data
+
+    def call(self, sample):
+        """Call of sample name or index"""
+        if not isinstance(sample, int):
+            sample = list(self.samples).index(sample)
+        if not -len(self.sample_data) <= sample < len(self.sample_data):
+            raise IndexError('No sample column {0}'.format(sample))
+        return Call(self, sample % len(self.sample_data))
+
+    @property
+    def calls(self):
+        return [Call(self, i) for i in xrange(len(self.sample_data))]
+
+    def values(self, key, missing='.'):
+        """value of FORMAT key of each sample"""
+        idx = self.format.index.get(key)
+        if idx is None:
+            return [missing] * len(self.sample_data)
+        return [data[idx] if idx < len(data) else missing
+                for data in self.sample_data]
+
+    def genotypes(self, key='PL'):
+        """most likely genotype of each sample by PL (or GL) as allele
+        strings joined by '/' (one allele for haploid samples), ref/ref for
+        all samples when site has no key. Called once per record and key"""
+        if self._genotypes is None:
+            self._genotypes = {}
+        try:
+            return self._genotypes[key]
+        except KeyError:
+            pass
+        if key not in self.format.index:
+            result = ['{0}/{0}'.format(self.ref)] * len(self.sample_data)
+        else:
+            bases = [self.ref] + self.alt.split(',')
+            result = []
+            indexes, ploidies = call_genotypes(self, key, ploidy=True)
+            for index, ploidy in zip(indexes.tolist(), ploidies.tolist()):
+                if index == MISSING:
+                    result.append('/'.join(['.'] * ploidy))
+                else:
+                    result.append('/'.join([bases[allele] for allele in
+                                            genotype_alleles(index, ploidy)]))
+        self._genotypes[key] = result
+        return result
+
+    def __getattr__(self, key):         # INFO fields as attributes
+        if key.startswith('_') or key not in self.info:
+            raise AttributeError(key)
+        return self.get(key)
 
     def __repr__(self):
-        return '<VcfRecord>'
+        return '<VcfRecord {0}:{1} {2}>{3}>'.format(self.chrom, self.pos + 1,
+                                                  self.ref, self.alt)
 
 
 class Header(object):
-    def __init__(self, items):
-        self.items = items
+    """meta lines of VCF parsed to Info, Filter and Format objects by ID,
+    other ## lines are kept in items"""
+    def __init__(self, meta=()):
+        self.items = []
+        self.infos = OrderedDict()
+        self.filters = OrderedDict()
+        self.formats = OrderedDict()
+        for line in meta:
+            for regex, kls, dic in ((RE_INFO, Info, self.infos),
+                                    (RE_FILTER, Filter, self.filters),
+                                    (RE_FORMAT, Format, self.formats)):
+                obj = _parse_meta(line, (regex, kls))
+                if obj is not None:
+                    dic[obj._id] = obj
+                    break
+            else:
+                self.items.append(line)
+
+    def add(self, meta):
+        """add (or replace) Info, Filter or Format object"""
+        for kls, dic in ((Info, self.infos), (Filter, self.filters),
+                         (Format, self.formats)):
+            if isinstance(meta, kls):
+                dic[meta._id] = meta
+                return
+        raise TypeError('Not Info, Filter or Format: {0!r}'.format(meta))
+
+    def lines(self, samples=()):
+        """## lines and #CHROM line of header"""
+        lines = list(self.items)
+        for dic in (self.infos, self.filters, self.formats):
+            lines.extend([repr(meta) for meta in dic.itervalues()])
+        columns = ['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER',
+                   'INFO']
+        if samples:
+            columns.append('FORMAT')
+            columns.extend(samples)
+        lines.append('\t'.join(columns))
+        return lines
+
+    def convert_info(self, key, value):
+        info = self.infos.get(key)
+        return value if info is None else info.convert(value)
+
+    def convert_format(self, key, value):
+        format_ = self.formats.get(key)
+        return value if format_ is None else format_.convert(value)
 
 
 class VCF(object):
     """Variant Call Format"""
-    def __init__(self, handle, start, samples, **kwargs):
+    def __init__(self, handle, start, samples, meta=None, filename=None,
+                 **kwargs):
         self._handle = handle
         self._start = start
         self._samples = samples
+        self._formats = {}              # FORMAT string -> FormatKeys
+        self._index = None
+        self.meta = meta or []          # ## lines
+        self.header = Header(self.meta)
+        self.filename = filename
+
+    @property
+    def samples(self):
+        return self._samples
 
     def reset(self):
         self._handle.seek(self._start)
@@ -130,18 +445,45 @@ class VCF(object):
         return self
 
     def next(self):
-        for line in self._handle:
-            if line.startswith('#'):
-                continue
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                return parse_vcfrecord(line, self._samples)
-            except:
-                raise StopIteration
+        line = self._handle.readline()
+        while line:
+            if line.strip() and not line.startswith('#'):
+                return VcfRecord(line.rstrip('\r\n'), self._samples,
+                                 self._formats, self.header)
+            line = self._handle.readline()
         raise StopIteration
 
+    def fetch(self, chrom, start=0, end=None):
+        """yield VcfRecords on chrom overlapping [start, end), 0-based like
+        VcfRecord.pos. The file must be indexed by index(); fetch moves the
+        file handle, call reset() before iterating the whole file again"""
+        if self._index is None:
+            idxfile = self.filename + libbin.INDEX_EXT
+            if not os.path.exists(idxfile):
+                raise IOError('No index file: {0}, run vcf.index first'
+                              .format(idxfile))
+            self._index = libbin.load(idxfile)
+
+        if end is None:
+            end = libbin.MAX_POS
+
+        handle = self._handle
+        for obeg, oend in self._index.chunks(chrom, start, end):
+            handle.seek(obeg)
+            while handle.tell() < oend:
+                line = handle.readline()
+                if not line:
+                    break
+                items = line.split('\t', 8)
+                if items[0] != chrom:
+                    return
+                pos = int(items[1]) - 1
+                if pos >= end:          # sorted, no more overlaps
+                    return
+                if _record_end(pos, items[3], items[7]) > start:
+                    yield VcfRecord(line.rstrip('\r\n'), self._samples,
+                                    self._formats, self.header)
+
 
 def _parse_meta(line, (regex, kls)):
     match = regex.match(line)
@@ -151,27 +493,31 @@ def _parse_meta(line, (regex, kls)):
     return kls(**dic)
 
 
-def parse_vcfrecord(line, samples):
-    items = line.split('\t')
-    chrom, pos, id_, ref, alt, qual, filter_, info = items[:8]
-    _format = items[8].split(':')
-    for i, item in enumerate(items[9:]):
-        source = samples[i]
-        data = item.split(':')
-        format_ = dict(zip(_format, data))
-        yield VcfRecord(source=source, chrom=chrom, pos=pos, id_=id_,
-                        ref=ref, alt=alt, qual=qual, filter_=filter_,
-                        info=info, **format_)
+def parse_vcfrecord(line, samples, formats=None, header=None):
+    return VcfRecord(line.rstrip('\r\n'), samples, formats, header)
+
+
+def _open(fname):
+    """BgzfReader for BGZF file (seekable by virtual offsets), gzip or
+    plain file handle otherwise"""
+    if fname.endswith('.gz'):
+        if bgzf.is_bgzf(fname):
+            return bgzf.BgzfReader(fname)
+        return gzip.open(fname, 'rb')
+    return open(fname, 'r')
 
 
 def parse(fname):
-    handle = open(fname, 'r')
-    for line in handle:                 # deal with head info block
+    handle = _open(fname)
+    meta = []
+    line = handle.readline()
+    while line:                         # deal with head info block
         line = line.strip()
-        if not line:
-            continue
-        if not line.startswith('##'):   #
+        if line and not line.startswith('##'):
             break
+        if line:
+            meta.append(line)
+        line = handle.readline()
 
     if line.startswith('#'):        # header
         samples = line.split('\t')[9:]
@@ -180,9 +526,428 @@ def parse(fname):
 
     start = handle.tell()
 
-    return VCF(handle, start, samples)
+    return VCF(handle, start, samples, meta=meta, filename=fname)
 
 
 def read(fname):
     return parse(fname)
 
+
+def _record_end(pos, ref, info):
+    """end of reference bases of record, END of INFO if given"""
+    if info.startswith('END='):
+        value = info[4:]
+    else:
+        idx = info.find(';END=')
+        if idx == -1:
+            return pos + len(ref)
+        value = info[idx+5:]
+    return int(value.split(';', 1)[0])
+
+
+def index(fname, idxfile=None):
+    """build the binning and linear index of position sorted VCF fname
+    (bgzipped or plain text), saved to fname + '.pbi' unless idxfile is
+    given. Offsets are virtual offsets for BGZF files"""
+    if fname.endswith('.gz') and not bgzf.is_bgzf(fname):
+        raise ValueError('{0} is gzip but not BGZF, compress it with '
+                         'bgzf.bgzip'.format(fname))
+    idx = libbin.Index()
+    handle = _open(fname)
+    last_chrom, last_pos = None, -1
+    obeg = handle.tell()
+    line = handle.readline()
+    while line:
+        oend = handle.tell()
+        if not line.startswith('#') and line.strip():
+            items = line.split('\t', 8)
+            chrom, pos = items[0], int(items[1]) - 1
+            if chrom != last_chrom:
+                if chrom in idx:
+                    raise ValueError('{0} is not sorted by position: {1}'
+                                     .format(fname, chrom))
+                last_chrom, last_pos = chrom, -1
+            elif pos < last_pos:
+                raise ValueError('{0} is not sorted by position: {1}:{2}'
+                                 .format(fname, chrom, pos + 1))
+            last_pos = pos
+            idx.add(chrom, pos, _record_end(pos, items[3], items[7]),
+                    obeg, oend)
+        obeg = oend
+        line = handle.readline()
+    handle.close()
+
+    idx.save(idxfile or fname + libbin.INDEX_EXT)
+    return idx
+
+
+# **********************************************************************
+# parallel processing of shards: regions by index or byte ranges of text
+# **********************************************************************
+RE_CONTIG = re.compile('##contig=<ID=(?P<id>[^,>]+).*,length=(?P<length>[0-9]+)')
+
+
+def _contig_lengths(meta):
+    lengths = {}
+    for line in meta:
+        match = RE_CONTIG.match(line)
+        if match:
+            lengths[match.group('id')] = int(match.group('length'))
+    return lengths
+
+
+def make_shards(fname, nshard):
+    """split fname to about nshard shards in file order. Indexed files are
+    cut to regions (chrom, start, end) by ##contig lengths (or the index
+    span), records are assigned to the region holding their pos. Plain
+    text files without index are cut to line aligned byte ranges (beg,
+    end). Other files give one shard None, the whole file"""
+    idxfile = fname + libbin.INDEX_EXT
+    if os.path.exists(idxfile):
+        idx = libbin.load(idxfile)
+        vcf = parse(fname)
+        vcf._handle.close()
+        contigs = _contig_lengths(vcf.meta)
+        lengths = [(ref, contigs.get(ref) or idx.span(ref))
+                   for ref in idx.refs]
+        total = sum([length for ref, length in lengths])
+        size = max(1, -(-total // nshard)) # ceil
+        shards = []
+        for ref, length in lengths:
+            starts = range(0, length, size) or [0]
+            for i, start in enumerate(starts):
+                end = (starts[i+1] if i + 1 < len(starts)
+                       else libbin.MAX_POS)
+                shards.append((ref, start, end))
+        return shards
+    if fname.endswith('.gz'):
+        return [None]
+    vcf = parse(fname)
+    vcf._handle.close()
+    return byte_shards(fname, nshard, vcf._start)
+
+
+def iter_shard(fname, shard):
+    """yield VcfRecords of shard made by make_shards"""
+    vcf = parse(fname)
+    try:
+        if shard is None:
+            for record in vcf:
+                yield record
+        elif isinstance(shard[0], basestring):
+            chrom, start, end = shard
+            for record in vcf.fetch(chrom, start, end):
+                if record.pos >= start:
+                    yield record
+        else:
+            for line in read_range(fname, shard[0], shard[1]):
+                if line.strip() and not line.startswith('#'):
+                    yield VcfRecord(line.rstrip('\r\n'), vcf._samples,
+                                    vcf._formats, vcf.header)
+    finally:
+        vcf._handle.close()
+
+
+def _run_shard(shard, fname, func, args, kwargs):
+    return func(iter_shard(fname, shard), *args, **kwargs)
+
+
+def map_shards(fname, func, args=(), kwargs={}, pnum=1, nshard=None):
+    """yield func(records, *args, **kwargs) of each shard of fname in file
+    (genomic) order, shards are run by pnum processes. func must be a
+    module level function so it can be sent to worker processes"""
+    shards = make_shards(fname, nshard or pnum * 4)
+    return pool_map(_run_shard, [(shard,) for shard in shards],
+                    args=(fname, func, args, kwargs), pnum=pnum)
+
+
+def reduce_shards(fname, func, reduce, initial=None, **kwargs):
+    """merge results of map_shards with reduce(total, result), starting
+    from initial or the first result"""
+    results = map_shards(fname, func, **kwargs)
+    if initial is None:
+        initial = next(results)
+    total = initial
+    for result in results:
+        total = reduce(total, result)
+    return total
+
+
+# **********************************************************************
+# write VCF
+# **********************************************************************
+LINE_BATCH = 4096                       # lines written at once
+
+
+class Writer(object):
+    """Write header and VcfRecords to fname, lines are collected and written
+    LINE_BATCH at a time. fname ending with .gz is written in BGZF (so it
+    can be indexed), '-' is stdout. Unmodified records are written as the
+    line they were parsed from"""
+    def __init__(self, fname, header, samples=(), compress=None,
+                 size=LINE_BATCH):
+        if compress is None:
+            compress = fname.endswith('.gz')
+        if fname == '-':
+            self._handle = sys.stdout
+        elif compress:
+            self._handle = bgzf.BgzfWriter(fname)
+        else:
+            self._handle = open(fname, 'w')
+        self._size = size
+        self._lines = header.lines(samples)
+        self.count = 0                  # records written
+
+    @classmethod
+    def like(cls, fname, vcf, **kwargs):
+        """Writer with header and samples of VCF object vcf"""
+        return cls(fname, vcf.header, vcf.samples, **kwargs)
+
+    def write(self, record):
+        self._lines.append(record.to_line())
+        self.count += 1
+        if len(self._lines) >= self._size:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            self._lines.append('')
+            self._handle.write('\n'.join(self._lines))
+            self._lines = []
+
+    def close(self):
+        self.flush()
+        if self._handle is not sys.stdout:
+            self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# **********************************************************************
+# genotype matrix: FORMAT values of all sites x samples as numpy arrays
+# **********************************************************************
+MISSING = -1                            # value of missing GT or Integer
+CHUNK = 4096                            # rows added when arrays are full
+_GT_CODES = {}                          # GT string -> alt allele count
+
+
+def gt_code(gt):
+    """number of alt alleles of GT string, MISSING if any allele missing"""
+    try:
+        return _GT_CODES[gt]
+    except KeyError:
+        alleles = gt.replace('|', '/').split('/')
+        if '.' in alleles or '' in alleles:
+            code = MISSING
+        else:
+            code = sum([1 for allele in alleles if allele != '0'])
+        _GT_CODES[gt] = code
+        return code
+
+
+def _format_dtypes(header, fields):
+    formats = header.formats
+    dtypes = []
+    for field in fields:
+        if field == 'GT':
+            dtypes.append((np.int8, MISSING))
+            continue
+        format_ = formats.get(field)
+        if format_ is None:
+            raise ValueError('FORMAT not in header: {0}'.format(field))
+        if format_._number != '1':
+            raise ValueError('FORMAT {0} has Number={1}, only one value per '
+                             'sample fits a matrix'.format(field,
+                                                           format_._number))
+        if format_._type == 'Integer':
+            dtypes.append((np.int32, MISSING))
+        elif format_._type == 'Float':
+            dtypes.append((np.float32, np.nan))
+        else:
+            raise ValueError('FORMAT {0} of Type={1} is not numeric'
+                             .format(field, format_._type))
+    return dtypes
+
+
+def _grow(arrays, size):
+    for key, array in arrays.items():
+        grown = np.empty((size,) + array.shape[1:], dtype=array.dtype)
+        grown[:len(array)] = array
+        arrays[key] = grown
+
+
+def genotype_matrix(fname, fields=('GT', 'DP', 'GQ')):
+    """read FORMAT fields of every site and sample of fname to arrays of
+    shape (sites, samples), return dict with an array for each field and
+    'CHROM', 'POS' (0-based) of the sites. GT is the number of alt
+    alleles (int8), missing values are MISSING for Integer and nan for
+    Float fields"""
+    if np is None:
+        raise ImportError('numpy is required by vcf.genotype_matrix')
+    vcf = parse(fname)
+    nsample = len(vcf.samples)
+    dtypes = _format_dtypes(vcf.header, fields)
+
+    size = CHUNK
+    arrays = {'CHROM': np.empty(size, dtype=object),
+              'POS': np.empty(size, dtype=np.int64)}
+    for field, (dtype, missing) in zip(fields, dtypes):
+        arrays[field] = np.empty((size, nsample), dtype=dtype)
+
+    n = 0
+    for record in vcf:
+        if n == size:
+            size += max(CHUNK, size // 2)
+            _grow(arrays, size)
+        arrays['CHROM'][n] = record.chrom
+        arrays['POS'][n] = record.pos
+        for field, (dtype, missing) in zip(fields, dtypes):
+            values = record.values(field)
+            if field == 'GT':
+                row = [gt_code(value) for value in values]
+            elif dtype is np.int32:
+                row = [int(value) if value not in ('.', '') else missing
+                       for value in values]
+            else:
+                row = [float(value) if value not in ('.', '') else missing
+                       for value in values]
+            arrays[field][n] = row
+        n += 1
+    vcf._handle.close()
+
+    return dict([(key, array[:n].copy()) for key, array in arrays.items()])
+
+
+# **********************************************************************
+# genotype calling: argmin of PL (argmax of GL) of all samples at once
+# **********************************************************************
+def genotype_index(j, k):
+    """index of diploid genotype j/k (j <= k) in PL/GL order of VCF spec:
+    0/0, 0/1, 1/1, 0/2, 1/2, 2/2 ..."""
+    return k * (k + 1) // 2 + j
+
+
+def _choose(n, k):
+    if k < 0 or k > n:
+        return 0
+    result = 1
+    for i in xrange(k):
+        result = result * (n - i) // (i + 1)
+    return result
+
+
+def genotype_alleles(index, ploidy=2):
+    """allele codes (sorted) of genotype index of ploidy, VCF spec order:
+    the genotype a1 <= ... <= aP has index sum of choose(ak + k - 1, k).
+    Diploid index can be numpy array"""
+    if ploidy == 2:
+        if np is not None and isinstance(index, np.ndarray):
+            k = ((np.sqrt(8 * index + 1) - 1) // 2).astype(np.int64)
+        else:
+            k = int(((8 * index + 1) ** 0.5 - 1) // 2)
+        return index - k * (k + 1) // 2, k
+    alleles = []
+    for k in xrange(ploidy, 0, -1):
+        allele = 0
+        while _choose(allele + k, k) <= index:
+            allele += 1
+        index -= _choose(allele + k - 1, k)
+        alleles.append(allele)
+    return tuple(reversed(alleles))
+
+
+def _nallele(record):
+    return len(record.alt.split(',')) + 1 if record.alt != '.' else 1
+
+
+def _ngenotype(nallele, ploidy=2):
+    """number of genotypes of ploidy over nallele alleles"""
+    return _choose(nallele + ploidy - 1, ploidy)
+
+
+def _ploidies(record, key, values):
+    """ploidy of each sample: from the number of key values (which grows
+    with ploidy when there is an ALT), else from GT, else diploid"""
+    nallele = _nallele(record)
+    gts = record.values('GT') if 'GT' in record.format.index else None
+    ploidies = []
+    for i, value in enumerate(values):
+        if nallele > 1 and value not in ('.', ''):
+            count = value.count(',') + 1
+            ploidy = 1
+            while _ngenotype(nallele, ploidy) < count:
+                ploidy += 1
+            if _ngenotype(nallele, ploidy) != count:
+                raise ValueError('{0} of sample {1} of {2} has {3} values, '
+                                 'not a genotype count of {4} alleles'
+                                 .format(key, i, record, count, nallele))
+        elif gts is not None and gts[i] not in ('.', ''):
+            ploidy = len(gts[i].replace('|', '/').split('/'))
+        else:
+            ploidy = 2
+        ploidies.append(ploidy)
+    return ploidies
+
+
+def _likelihoods(record, key):
+    """(PL scale likelihoods of record as float array (samples, genotypes
+    of the largest ploidy), ploidy of each sample), missing values and
+    padding are inf"""
+    nallele = _nallele(record)
+    values = record.values(key)
+    nsample = len(values)
+    ploidies = _ploidies(record, key, values)
+    counts = [_ngenotype(nallele, ploidy) for ploidy in ploidies]
+    width = max(counts or [0])
+    text = []
+    for value, count in zip(values, counts):
+        if value in ('.', ''):
+            text.extend(['inf'] * width)
+        else:
+            text.extend(value.split(','))
+            if count < width:
+                text.extend(['inf'] * (width - count))
+    try:
+        data = np.array(text, dtype=np.float64)
+    except ValueError:                  # '.' inside of a value
+        data = np.array([value if value != '.' else 'inf' for value in text],
+                        dtype=np.float64)
+    data = data.reshape(nsample, width)
+    if key == 'GL':                     # log10 likelihood to phred
+        data *= -10
+    data[np.isnan(data)] = np.inf
+    return data, ploidies
+
+
+def call_genotypes(records, key='PL', ploidy=False):
+    """genotype index (see genotype_alleles) of the smallest PL or largest
+    GL of each sample, MISSING for missing samples. records is a VcfRecord
+    (returns array of samples) or a list of them (returns array of shape
+    (sites, samples)). With ploidy True return (index, ploidy) arrays,
+    the index of a sample is in the genotype order of its ploidy"""
+    if np is None:
+        raise ImportError('numpy is required by vcf.call_genotypes')
+    single = isinstance(records, VcfRecord)
+    if single:
+        records = [records]
+    results = [_likelihoods(record, key) for record in records]
+    nsample = len(results[0][1]) if results else 0
+    width = max([data.shape[1] for data, ploidies in results] or [0])
+    data = np.empty((len(results), nsample, width), dtype=np.float64)
+    data.fill(np.inf)
+    for i, (values, ploidies) in enumerate(results):
+        data[i, :, :values.shape[1]] = values
+    ploidies = np.array([ploidies for values, ploidies in results],
+                        dtype=np.int64).reshape(data.shape[:2])
+    if not data.size:
+        index = np.zeros(data.shape[:2], dtype=np.int64)
+    else:
+        index = data.argmin(axis=2)
+        index[np.isinf(data).all(axis=2)] = MISSING
+    if single:
+        index, ploidies = index[0], ploidies[0]
+    return (index, ploidies) if ploidy else index
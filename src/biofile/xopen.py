@@ -30,3 +30,35 @@ def xopen(fname, mode='r'):
 
     return open(fname, mode)
 
+
+
+class BufferedWriter(object):
+    """Collect lines and write them to fname size lines at a time. The file
+    is only open while the buffer is written, so thousands of writers
+    (eg. one per reference) can be alive without running out of file
+    handles. Lines must end with newline."""
+    def __init__(self, fname, size=4096, header=None):
+        self.fname = fname
+        self.size = size
+        self.count = 0                  # lines written, header excluded
+        self._lines = list(header or [])
+        self._mode = 'w'
+
+    def write(self, line):
+        self._lines.append(line)
+        self.count += 1
+        if len(self._lines) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if not self._lines and self._mode == 'a':
+            return
+        with xopen(self.fname, self._mode) as handle:
+            handle.write(''.join(self._lines))
+        self._lines = []
+        self._mode = 'a'
+
+    close = flush
+
+    def __repr__(self):
+        return '<BufferedWriter {0} lines:{1}>'.format(self.fname, self.count)
@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: annotate.py
+#
+# annotate position sorted variants with genes in one sweep
+# **********************************************************************
+"""Sweep line annotation of variants with libgene.Gene models.
+
+Genes of each chrom are sorted by start once. Variants (anything with
+chrom and 0-based pos, eg. ann.Ann or vcf.VcfRecord) must be sorted by
+pos within chrom, with the variants of a chrom consecutive. While the
+variants are walked, genes starting at or before pos are pushed to a heap
+by end and genes ending at or before pos are popped, so the heap holds
+exactly the genes covering pos. Exon starts of a gene are sorted once
+when it enters the heap and searched with bisect.
+"""
+
+import heapq
+from bisect import bisect_right
+
+INTRON = 'INTRON'
+INTERGENIC = 'INTERGENIC'
+CLASS_ORDER = {'CDS': 0, 'UTR5': 1, 'UTR3': 2, INTRON: 3}
+
+
+def _exon_class(exon):
+    if exon.name in ('UTR5', 'UTR3'):
+        return exon.name
+    return 'CDS'
+
+
+class _ActiveGene(object):
+    """gene in the sweep with its exons sorted by start"""
+    def __init__(self, gene):
+        self.gene = gene
+        self.exons = sorted(gene.fullexons, key=lambda exon: exon.start)
+        self.starts = [exon.start for exon in self.exons]
+
+    def locate(self, pos):
+        """(exon name or INTRON, class) of pos in gene"""
+        i = bisect_right(self.starts, pos) - 1
+        if i >= 0 and pos < self.exons[i].end:
+            exon = self.exons[i]
+            return exon.name, _exon_class(exon)
+        return INTRON, INTRON
+
+
+def _by_chrom(genes):
+    chroms = {}
+    for gene in genes:
+        chroms.setdefault(gene.chrom, []).append(gene)
+    for genes in chroms.itervalues():
+        genes.sort(key=lambda gene: (gene.start, gene.end))
+    return chroms
+
+
+def sweep(variants, genes):
+    """yield (variant, hits), hits is a list of (gene, exon name, class) of
+    all genes covering variant.pos, best first: CDS, UTR5, UTR3 then
+    INTRON. exon name is eg. EXON3, UTR5 or INTRON"""
+    chroms = _by_chrom(genes)
+    done = set()
+    chrom = None
+    heap = []
+    for variant in variants:
+        if variant.chrom != chrom:
+            if variant.chrom in done:
+                raise ValueError('Variants are not grouped by chrom: {0}'
+                                 .format(variant.chrom))
+            done.add(chrom)
+            chrom = variant.chrom
+            chrom_genes = chroms.get(chrom, [])
+            idx = 0
+            heap = []
+            last = None
+        pos = variant.pos
+        if last is not None and pos < last:
+            raise ValueError('Variants are not sorted: {0}:{1}'
+                             .format(chrom, pos + 1))
+        last = pos
+
+        while idx < len(chrom_genes) and chrom_genes[idx].start <= pos:
+            gene = chrom_genes[idx]
+            if gene.end > pos:
+                heapq.heappush(heap, (gene.end, idx, _ActiveGene(gene)))
+            idx += 1
+        while heap and heap[0][0] <= pos:
+            heapq.heappop(heap)
+
+        hits = []
+        for end, i, active in sorted(heap, key=lambda item: item[1]):
+            exon, cls = active.locate(pos)
+            hits.append((active.gene, exon, cls))
+        hits.sort(key=lambda hit: CLASS_ORDER[hit[2]])
+        yield variant, hits
+
+
+def gene_name(gene):
+    """name of gene without the chrom. prefix"""
+    return gene.name.split('.')[-1]
+
+
+def annotate(anns, genes):
+    """fill gene, exon, gstart, gend and strand of each ann.Ann from the
+    best gene covering it (see sweep), intergenic Anns get gene '-', exon
+    INTERGENIC and gstart -1, gend 0. Yield the Anns"""
+    for ann, hits in sweep(anns, genes):
+        if hits:
+            gene, exon, cls = hits[0]
+            ann.gene = gene_name(gene)
+            ann.exon = exon
+            ann.gstart = gene.start
+            ann.gend = gene.end
+            ann.bitstrand = 1 if gene.strand == '+' else 2
+        else:
+            ann.gene = '-'
+            ann.exon = INTERGENIC
+            ann.gstart = -1
+            ann.gend = 0
+        yield ann
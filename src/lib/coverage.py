@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: coverage.py
+#
+# per base coverage of alignments with numpy difference arrays
+# **********************************************************************
+"""Coverage of SAM alignments
+
+Each aligned block (M, = and X runs of the CIGAR, split at D and N) adds
++1 at its start and -1 at its end of a per reference difference array
+sized by the @SQ header, the cumulative sum of the array is the depth.
+The events are collected in lists and added to the array in batches, so
+the per base work is done by numpy.
+
+Input must be grouped by reference (eg. sorted by coordinate), only one
+reference is kept in memory at a time.
+"""
+
+import sys
+from itertools import chain
+
+import numpy as np
+
+from pyngs.biofile import sam
+from pyngs.biofile.sam import (TAB, RE_CIGAR_OP, MASK_UNMAPPED,
+                               MASK_SECONDARY, MASK_FAILQC, MASK_DUPLICATE)
+from pyngs.biofile.xopen import xopen
+
+SKIP_FLAGS = MASK_UNMAPPED | MASK_SECONDARY | MASK_FAILQC | MASK_DUPLICATE
+EVENT_BATCH = 1 << 20                   # events added to array at once
+LINE_BATCH = 1 << 16                    # lines written at once
+
+
+def _add_events(diff, starts, ends):
+    for events, sign in ((starts, 1), (ends, -1)):
+        if not events:
+            continue
+        idx, counts = np.unique(np.asarray(events, dtype=np.int64),
+                                return_counts=True)
+        np.minimum(idx, len(diff) - 1, out=idx) # block past reference end
+        diff[idx] += sign * counts
+        del events[:]
+
+
+def iter_depth(samfile, min_mapq=0, skip=SKIP_FLAGS):
+    """yield (rname, depth) of each reference with alignments, depth is
+    an int32 array of reference length from @SQ header"""
+    handle = xopen(samfile, 'r')
+    header = []
+    line = handle.readline()
+    while line.startswith('@'):
+        header.append(line)
+        line = handle.readline()
+    lengths = dict(sam.get_sq(header))
+
+    done = set()
+    rname = diff = None
+    starts, ends = [], []
+    for line in chain([line], handle):
+        items = line.split(TAB, 6)
+        if len(items) < 6:
+            continue
+        if int(items[1]) & skip or int(items[4]) < min_mapq:
+            continue
+        if items[2] != rname:
+            if items[2] == '*':
+                continue
+            if rname is not None:
+                _add_events(diff, starts, ends)
+                yield rname, np.cumsum(diff, out=diff)[:-1]
+            rname = items[2]
+            if rname in done:
+                raise ValueError('{0} is not grouped by reference: {1}'
+                                 .format(samfile, rname))
+            if rname not in lengths:
+                raise ValueError('Reference not in @SQ header: {0}'
+                                 .format(rname))
+            done.add(rname)
+            diff = np.zeros(lengths[rname] + 1, dtype=np.int32)
+
+        pos = int(items[3]) - 1
+        for length, op in RE_CIGAR_OP.findall(items[5]):
+            if op in 'M=X':
+                starts.append(pos)
+                pos += int(length)
+                ends.append(pos)
+            elif op in 'DN':
+                pos += int(length)
+        if len(starts) >= EVENT_BATCH:
+            _add_events(diff, starts, ends)
+
+    if rname is not None:
+        _add_events(diff, starts, ends)
+        yield rname, np.cumsum(diff, out=diff)[:-1]
+
+    if handle is not sys.stdin:
+        handle.close()
+
+
+def _write_lines(out, lines):
+    for i in xrange(0, len(lines), LINE_BATCH):
+        out.write('\n'.join(lines[i:i+LINE_BATCH]) + '\n')
+
+
+def bedgraph(out, rname, depth, zero=False):
+    """write runs of equal depth as bedGraph lines, zero depth runs are
+    skipped unless zero is True"""
+    if not len(depth):
+        return
+    change = np.flatnonzero(depth[1:] != depth[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [len(depth)]))
+    values = depth[starts]
+    if not zero:
+        keep = values != 0
+        starts, ends, values = starts[keep], ends[keep], values[keep]
+    _write_lines(out, ['{0}\t{1}\t{2}\t{3}'.format(rname, s, e, v) for s, e, v
+                       in zip(starts.tolist(), ends.tolist(),
+                              values.tolist())])
+
+
+def binned(depth, binsize):
+    """return (bin starts, mean depth of each bin)"""
+    starts = np.arange(0, len(depth), binsize)
+    if not len(starts):
+        return starts, np.zeros(0)
+    sums = np.add.reduceat(depth, starts, dtype=np.int64)
+    sizes = np.diff(np.append(starts, len(depth)))
+    return starts, sums / sizes.astype(np.float64)
+
+
+def write_binned(out, rname, depth, binsize):
+    starts, means = binned(depth, binsize)
+    _write_lines(out, ['{0}\t{1}\t{2}\t{3:.2f}'.format(
+        rname, s, min(s + binsize, len(depth)), m)
+        for s, m in zip(starts.tolist(), means.tolist())])
+
+
+def gene_coverage(gene, depth, thresholds=(1, 10, 20)):
+    """return (exonic length, mean depth, [fraction of exonic bases with
+    depth >= each threshold]) of gene, depth None means not covered"""
+    exons = gene.fullexons
+    length = sum([exon.end - exon.start for exon in exons])
+    if depth is None or not length:
+        return length, 0.0, [0.0] * len(thresholds)
+    values = np.concatenate([depth[exon.start:exon.end] for exon in exons])
+    if not len(values):                 # exons past reference end
+        return length, 0.0, [0.0] * len(thresholds)
+    return (length, float(values.sum()) / length,
+            [float((values >= t).sum()) / length for t in thresholds])
+
+
+def gene_summary(out, genes, depth, thresholds=(1, 10, 20)):
+    """write coverage summary line of each gene"""
+    lines = []
+    for gene in genes:
+        length, mean, fractions = gene_coverage(gene, depth, thresholds)
+        lines.append('\t'.join(
+            [gene.name, str(gene.chrom), gene.strand, str(length),
+             '{0:.2f}'.format(mean)] +
+            ['{0:.4f}'.format(f) for f in fractions]))
+    if lines:
+        _write_lines(out, lines)
+
+
+def coverage(samfile, out, binsize=None, genes=None, gene_out=None,
+             min_mapq=0, thresholds=(1, 10, 20)):
+    """Write bedGraph (or binned mean coverage if binsize given) of samfile
+    to out, and coverage summary of each libgene.Gene in genes to gene_out
+    """
+    by_chrom = {}
+    for gene in genes or ():
+        by_chrom.setdefault(gene.chrom, []).append(gene)
+
+    for rname, depth in iter_depth(samfile, min_mapq=min_mapq):
+        if out is not None:
+            if binsize:
+                write_binned(out, rname, depth, binsize)
+            else:
+                bedgraph(out, rname, depth)
+        if gene_out is not None and rname in by_chrom:
+            gene_summary(gene_out, by_chrom.pop(rname), depth, thresholds)
+
+    if gene_out is not None:            # genes on references not covered
+        for chrom in sorted(by_chrom):
+            gene_summary(gene_out, by_chrom[chrom], None, thresholds)
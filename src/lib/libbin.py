@@ -0,0 +1,242 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: libbin.py
+#
+# UCSC/BAM style binning plus linear index for coordinate sorted files
+# **********************************************************************
+"""Binning index shared by the sorted text formats (SAM, bgzipped VCF).
+
+Each reference keeps two structures, the same way BAI/CSI/tabix do:
+
+    bins:    bin number -> list of [obeg, oend] file offset chunks holding
+             the records whose interval falls in that bin
+    linear:  one entry per 16kb window, the smallest offset of a record
+             overlapping the window
+
+Bins follow the CSI scheme: the smallest bins are 1 << min_shift bases
+and each of the depth levels above is 8 times larger, so the bins cover
+1 << (min_shift + 3 * depth) bases. depth starts at 5 (512Mb, as BAI) and
+grows when a record ends past the covered range, so the index is sized by
+the longest reference (plant chromosomes are often longer than 512Mb).
+
+All positions are 0-based and half-open, offsets are plain integers (file
+offsets for text files, virtual offsets for BGZF files).
+"""
+
+import struct
+
+INDEX_EXT = '.pbi'                      # pyngs binning index
+INDEX_MAGIC = 'PBI\2'
+INDEX_MAGIC_V1 = 'PBI\1'               # fixed min_shift 14, depth 5
+
+LINEAR_SHIFT = 14                       # 16kb linear index windows
+MIN_SHIFT = 14
+DEPTH = 5
+MAX_POS = (1 << 62) - 1                 # end of a region without end
+
+
+def bin_limit(min_shift=MIN_SHIFT, depth=DEPTH):
+    """end of the positions covered by the bins"""
+    return 1 << (min_shift + 3 * depth)
+
+
+def _level_first(level):
+    """number of the first bin of level"""
+    return ((1 << 3 * level) - 1) // 7
+
+
+def reg2bin(beg, end, min_shift=MIN_SHIFT, depth=DEPTH):
+    """calc the smallest bin that contain region [beg, end)"""
+    end -= 1
+    shift = min_shift
+    for level in xrange(depth, 0, -1):
+        if beg >> shift == end >> shift:
+            return _level_first(level) + (beg >> shift)
+        shift += 3
+    return 0
+
+
+def reg2bins(beg, end, min_shift=MIN_SHIFT, depth=DEPTH):
+    """list all bins which may contain records overlapping [beg, end)"""
+    end -= 1
+    bins = []
+    shift = min_shift + 3 * depth
+    for level in xrange(depth + 1):
+        first = _level_first(level)
+        bins.extend(xrange(first + (beg >> shift), first + (end >> shift) + 1))
+        shift -= 3
+    return bins
+
+
+def _bin_level(b):
+    level = 0
+    while _level_first(level + 1) <= b:
+        level += 1
+    return level
+
+
+class Index(object):
+    """binning and linear index of one coordinate sorted file"""
+    def __init__(self, min_shift=MIN_SHIFT, depth=DEPTH):
+        self.min_shift = min_shift
+        self.depth = depth
+        self.refs = []                  # reference names in file order
+        self._bins = {}                 # ref -> {bin: [[obeg, oend], ...]}
+        self._linear = {}               # ref -> [offset of 16kb window]
+
+    def __contains__(self, ref):
+        return ref in self._bins
+
+    def __repr__(self):
+        return '<Index refs:{0} depth:{1}>'.format(len(self.refs), self.depth)
+
+    @property
+    def limit(self):
+        return bin_limit(self.min_shift, self.depth)
+
+    def _deepen(self, end):
+        """add levels on top until the bins cover end, a bin keeps its
+        offset within its level, which moves one level down"""
+        depth = self.depth
+        while bin_limit(self.min_shift, depth) < end:
+            depth += 1
+        add = depth - self.depth
+        for ref, bins in self._bins.iteritems():
+            moved = {}
+            for b, chunks in bins.iteritems():
+                level = _bin_level(b)
+                moved[_level_first(level + add) + b - _level_first(level)] = \
+                    chunks
+            self._bins[ref] = moved
+        self.depth = depth
+
+    def add(self, ref, beg, end, obeg, oend):
+        """add one record covering [beg, end) stored at offsets
+        [obeg, oend), records must be added in file order"""
+        if ref not in self._bins:
+            self.refs.append(ref)
+            self._bins[ref] = {}
+            self._linear[ref] = []
+
+        if end <= beg:                  # zero length record, eg. insertion
+            end = beg + 1
+        if end > self.limit:
+            self._deepen(end)
+
+        b = reg2bin(beg, end, self.min_shift, self.depth)
+        chunks = self._bins[ref].setdefault(b, [])
+        if chunks and chunks[-1][1] == obeg: # contiguous, extend last chunk
+            chunks[-1][1] = oend
+        else:
+            chunks.append([obeg, oend])
+
+        linear = self._linear[ref]
+        last = (end - 1) >> LINEAR_SHIFT
+        if len(linear) <= last:
+            linear.extend([None] * (last + 1 - len(linear)))
+        for win in xrange(beg >> LINEAR_SHIFT, last + 1):
+            if linear[win] is None:
+                linear[win] = obeg
+
+    def span(self, ref):
+        """upper bound of the end of records on ref, 0 if ref not indexed"""
+        return len(self._linear.get(ref, ())) << LINEAR_SHIFT
+
+    def finish(self):
+        """fill empty linear windows with the offset of the next window,
+        which is still a valid lower bound for a query starting there"""
+        for linear in self._linear.itervalues():
+            nxt = 0
+            for win in xrange(len(linear) - 1, -1, -1):
+                if linear[win] is None:
+                    linear[win] = nxt
+                else:
+                    nxt = linear[win]
+
+    def chunks(self, ref, beg, end):
+        """return the sorted and merged offset chunks which may hold records
+        overlapping [beg, end) on ref"""
+        if ref not in self._bins or beg >= self.limit:
+            return []
+        bins = self._bins[ref]
+        linear = self._linear[ref]
+
+        minoff = 0
+        if linear:
+            minoff = linear[min(beg >> LINEAR_SHIFT, len(linear) - 1)] or 0
+
+        chunks = []
+        for b in reg2bins(beg, min(end, self.limit), self.min_shift,
+                          self.depth):
+            for obeg, oend in bins.get(b, ()):
+                if oend > minoff:
+                    chunks.append([max(obeg, minoff), oend])
+        chunks.sort()
+
+        merged = []
+        for chunk in chunks:
+            if merged and chunk[0] <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], chunk[1])
+            else:
+                merged.append(chunk)
+        return merged
+
+    def save(self, fname):
+        self.finish()
+        with open(fname, 'wb') as handle:
+            handle.write(INDEX_MAGIC)
+            handle.write(struct.pack('<ii', self.min_shift, self.depth))
+            handle.write(struct.pack('<i', len(self.refs)))
+            for ref in self.refs:
+                handle.write(struct.pack('<i', len(ref)))
+                handle.write(ref)
+                bins = self._bins[ref]
+                handle.write(struct.pack('<i', len(bins)))
+                for b in sorted(bins):
+                    chunks = bins[b]
+                    handle.write(struct.pack('<Ii', b, len(chunks)))
+                    for obeg, oend in chunks:
+                        handle.write(struct.pack('<QQ', obeg, oend))
+                linear = self._linear[ref]
+                handle.write(struct.pack('<i', len(linear)))
+                handle.write(struct.pack('<{0}Q'.format(len(linear)),
+                                         *linear))
+
+
+def _unpack(handle, fmt):
+    size = struct.calcsize(fmt)
+    data = handle.read(size)
+    if len(data) != size:
+        raise ValueError('Index file truncated')
+    return struct.unpack(fmt, data)
+
+
+def load(fname):
+    """load Index saved by Index.save"""
+    with open(fname, 'rb') as handle:
+        magic = handle.read(4)
+        if magic == INDEX_MAGIC:
+            index = Index(*_unpack(handle, '<ii'))
+        elif magic == INDEX_MAGIC_V1:
+            index = Index()
+        else:
+            raise ValueError('{0} is not a pyngs index file'.format(fname))
+        nref, = _unpack(handle, '<i')
+        for i in xrange(nref):
+            size, = _unpack(handle, '<i')
+            ref = handle.read(size)
+            bins = {}
+            nbin, = _unpack(handle, '<i')
+            for j in xrange(nbin):
+                b, nchunk = _unpack(handle, '<Ii')
+                chunks = _unpack(handle, '<{0}Q'.format(nchunk * 2))
+                bins[b] = [[chunks[k], chunks[k+1]]
+                           for k in xrange(0, len(chunks), 2)]
+            nlinear, = _unpack(handle, '<i')
+            linear = list(_unpack(handle, '<{0}Q'.format(nlinear)))
+            index.refs.append(ref)
+            index._bins[ref] = bins
+            index._linear[ref] = linear
+    return index
@@ -7,6 +7,21 @@
 # This module is parse Gene structure for annotation SNP
 # **********************************************************************
 
+import hashlib
+import os
+
+from pyngs.lib.libinterval import IntervalIndex
+
+try:
+    import numpy as np
+except ImportError:                     # numpy is only used by the cache
+    np = None
+
+CACHE_EXT = '.genes.npz'                # gene model cache next to source
+CACHE_VERSION = 2
+CACHE_BLOCK = 1 << 16                   # head and tail bytes in the hash
+
+
 class Exon(object):
     def __init__(self, mark, name, length, strand, start, end):
         self.mark = mark
@@ -60,6 +75,13 @@ class Gene(Exon):
         else:
             self._exons.append(exon)
 
+    @property
+    def chrom(self):
+        """genes from ucsc records are named as chrom.name"""
+        if '.' not in self.name:
+            return None
+        return self.name.split('.')[-2]
+
     @property
     def exons(self):
         if not self._exons and not self.utr5 and not self.utr3:
@@ -258,7 +280,15 @@ def deal_ucsc_record_line(line, sep='\t'):
 # **********************************************************************
 # parse ucsc record and return a Gene instance
 # **********************************************************************
-def parse_ucsc(fname):
+def parse_ucsc(fname, cache=False):
+    """yield Gene of each ucsc record of fname, with cache through the
+    binary gene model cache (see cached)"""
+    if cache:
+        return iter(cached(fname, _parse_ucsc))
+    return _parse_ucsc(fname)
+
+
+def _parse_ucsc(fname):
     with open(fname, 'r') as handle:
         for line in handle:
             line = line.rstrip()
@@ -268,26 +298,236 @@ def parse_ucsc(fname):
 
 
 # **********************************************************************
-# divide genes to blocks, each block size is 0.1M
+# binary cache of gene models: flat numpy arrays, names in string tables
 # **********************************************************************
-def parse_gene_list(fname, block=100000):
-    genes = {'-': {}, '+': {}}
-
-    for gene in parse(fname):
-        chrom, gname = gene.name.split('.')[-2:]
-        strand = gene.strand
-        if chrom not in genes[strand]:
-            genes[strand][chrom] = {}
-        # calc block ids
-        start_block_id = gene.start // block
-        end_block_id = gene.end // block
-        for i in xrange(start_block_id, end_block_id+1):
-            if i not in genes[strand][chrom]:
-                genes[strand][chrom][i] = []
-            genes[strand][chrom][i].append(gene)
+def _source_stat(fname):
+    """cache key of fname: size, mtime in microseconds and a hash of its
+    first and last CACHE_BLOCK bytes. An edit of the middle of a large
+    file keeping size and mtime is not seen"""
+    stat = os.stat(fname)
+    digest = hashlib.md5()
+    with open(fname, 'rb') as handle:
+        digest.update(handle.read(CACHE_BLOCK))
+        if stat.st_size > CACHE_BLOCK:
+            handle.seek(max(CACHE_BLOCK, stat.st_size - CACHE_BLOCK))
+            digest.update(handle.read(CACHE_BLOCK))
+    return [CACHE_VERSION, stat.st_size,
+            int(round(stat.st_mtime * 1000000)),
+            int(digest.hexdigest()[:15], 16)]
+
+
+def save_cache(genes, cachefile, stat):
+    """write genes to npz cachefile: gene and exon coordinates in flat
+    arrays, exons of gene i are offsets[i]:offsets[i+1]"""
+    names, strands, starts, ends, lengths, offsets = [], [], [], [], [], [0]
+    enames, estarts, eends, elengths = [], [], [], []
+    for gene in genes:
+        names.append(gene.name)
+        strands.append(gene.strand)
+        starts.append(gene.start)
+        ends.append(gene.end)
+        lengths.append(gene.length)
+        for exon in gene.utr5 + gene._exons + gene.utr3:
+            enames.append(exon.name)
+            estarts.append(exon.start)
+            eends.append(exon.end)
+            elengths.append(exon.length)
+        offsets.append(len(enames))
+    tmpfile = '{0}.{1}.tmp'.format(cachefile, os.getpid())
+    try:
+        with open(tmpfile, 'wb') as handle:
+            np.savez(handle, stat=np.array(stat, dtype=np.int64),
+                     names=np.array(names, dtype=str),
+                     strands=np.array(strands, dtype=str),
+                     starts=np.array(starts, dtype=np.int64),
+                     ends=np.array(ends, dtype=np.int64),
+                     lengths=np.array(lengths, dtype=np.int64),
+                     offsets=np.array(offsets, dtype=np.int64),
+                     enames=np.array(enames, dtype=str),
+                     estarts=np.array(estarts, dtype=np.int64),
+                     eends=np.array(eends, dtype=np.int64),
+                     elengths=np.array(elengths, dtype=np.int64))
+        os.rename(tmpfile, cachefile)
+    finally:
+        if os.path.isfile(tmpfile):     # not renamed, write failed
+            os.remove(tmpfile)
+
+
+def _new_exon(kls, mark, name, length, strand, start, end):
+    exon = kls.__new__(kls)             # values are ints, skip deal_num
+    exon.__dict__.update(mark=mark, name=name, length=length, strand=strand,
+                         start=start, end=end)
+    return exon
+
+
+class GeneModels(object):
+    """genes of a gene model cache as flat lists, the Gene of index i
+    (with its Exons) is made on first access"""
+    _KEYS = ('names', 'strands', 'starts', 'ends', 'lengths', 'offsets',
+             'enames', 'estarts', 'eends', 'elengths')
+
+    def __init__(self, data):
+        for key in self._KEYS:
+            setattr(self, key, data[key].tolist())
+        self._genes = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return '<GeneModels genes:{0}>'.format(len(self))
+
+    def chrom(self, i):
+        name = self.names[i]
+        return name.split('.')[-2] if '.' in name else None
+
+    def __getitem__(self, i):
+        try:
+            return self._genes[i]
+        except KeyError:
+            pass
+        strand = self.strands[i]
+        gene = _new_exon(Gene, 'GENE', self.names[i], self.lengths[i],
+                         strand, self.starts[i], self.ends[i])
+        gene.utr5, gene._exons, gene.utr3 = [], [], []
+        for j in xrange(self.offsets[i], self.offsets[i+1]):
+            name = self.enames[j]
+            exon = _new_exon(Exon, 'EXON', name, self.elengths[j], strand,
+                             self.estarts[j], self.eends[j])
+            if name == 'UTR3':
+                gene.utr3.append(exon)
+            elif name == 'UTR5':
+                gene.utr5.append(exon)
+            else:
+                gene._exons.append(exon)
+        self._genes[i] = gene
+        return gene
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+
+def load_cache(cachefile, stat=None):
+    """GeneModels of cachefile, None if it was not made from a source with
+    stat (see _source_stat)"""
+    data = np.load(cachefile)
+    try:
+        if stat is not None and data['stat'].tolist() != stat:
+            return None
+        return GeneModels(data)
+    finally:
+        data.close()
+
+
+def cached(fname, parser):
+    """genes of fname parsed by parser, GeneModels of the cache file
+    fname + '.genes.npz' when it was made from the same fname (size, mtime
+    and head and tail hash, see _source_stat), otherwise parse fname and write the cache (parsed genes are
+    still returned when the cache can not be written)"""
+    if np is None:
+        raise ImportError('numpy is required by the gene model cache')
+    cachefile = fname + CACHE_EXT
+    stat = _source_stat(fname)
+    if os.path.exists(cachefile):
+        try:
+            genes = load_cache(cachefile, stat)
+        except (IOError, KeyError, ValueError):
+            genes = None                # broken cache, build it again
+        if genes is not None:
+            return genes
+    genes = list(parser(fname))
+    if _source_stat(fname) == stat:
+        try:
+            save_cache(genes, cachefile, stat)
+        except (IOError, OSError):      # eg. read-only directory
+            pass
     return genes
 
 
+# **********************************************************************
+# index genes by chrom and strand for overlap and nearest queries
+# **********************************************************************
+class GeneIndex(object):
+    """Genes in one libinterval.IntervalIndex per (chrom, strand), the
+    chrom is taken from the gene name (chrom.name). Build it once and pass
+    it to every tool annotating against the same genes"""
+    def __init__(self, genes=()):
+        self._indexes = {}              # (chrom, strand) -> IntervalIndex
+        self._models = None
+        if isinstance(genes, GeneModels): # index numbers, make Gene on hit
+            self._models = genes
+            for i in xrange(len(genes)):
+                self._add(genes.chrom(i), genes.strands[i], genes.starts[i],
+                          genes.ends[i], i, genes.names[i])
+            return
+        for gene in genes:
+            self.add(gene)
+
+    def _add(self, chrom, strand, start, end, value, name):
+        if chrom is None:
+            raise ValueError('Gene name is not chrom.name: {0}'.format(name))
+        key = (chrom, strand)
+        try:
+            index = self._indexes[key]
+        except KeyError:
+            index = self._indexes[key] = IntervalIndex()
+        index.add(start, end, value)
+
+    def _gene(self, value):
+        return value if self._models is None else self._models[value]
+
+    def add(self, gene):
+        if self._models is not None:
+            raise ValueError('GeneIndex of GeneModels can not add genes')
+        self._add(gene.chrom, gene.strand, gene.start, gene.end, gene,
+                  gene.name)
+
+    def __len__(self):
+        return sum([len(index) for index in self._indexes.itervalues()])
+
+    def __repr__(self):
+        return '<GeneIndex genes:{0}>'.format(len(self))
+
+    @property
+    def chroms(self):
+        return sorted(set([chrom for chrom, strand in self._indexes]))
+
+    def _strand_indexes(self, chrom, strand):
+        strands = (strand,) if strand else ('+', '-')
+        return [self._indexes[(chrom, s)] for s in strands
+                if (chrom, s) in self._indexes]
+
+    def overlap(self, chrom, start, end, strand=None):
+        """genes on chrom (and strand if given) overlapping [start, end),
+        sorted by start"""
+        genes = []
+        for index in self._strand_indexes(chrom, strand):
+            genes.extend(index.overlap(start, end))
+        genes.sort(key=lambda item: (item[0], item[1]))
+        return [self._gene(gene) for start, end, gene in genes]
+
+    def nearest(self, chrom, pos, strand=None):
+        """(distance, [genes]) closest to 0-based pos, distance 0 means pos
+        is in the genes, None if chrom has no genes"""
+        best = None
+        for index in self._strand_indexes(chrom, strand):
+            hit = index.nearest(pos)
+            if hit is None:
+                continue
+            genes = [self._gene(gene) for start, end, gene in hit[1]]
+            if best is None or hit[0] < best[0]:
+                best = (hit[0], genes)
+            elif hit[0] == best[0]:
+                best[1].extend(genes)
+        return best
+
+
+def parse_gene_list(fname):
+    """GeneIndex of genes of gene list table fname"""
+    return GeneIndex(parse(fname))
+
+
 # **********************************************************************
 # test parse module
 # **********************************************************************
@@ -0,0 +1,198 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: libinterval.py
+#
+# static interval index: implicit interval tree over sorted arrays
+# **********************************************************************
+"""Index of [start, end) intervals (0-based, half-open) for overlap
+queries in O(log n + k), the implicit interval tree of cgranges.
+
+The intervals are sorted by start and kept in arrays, which are read as
+a complete binary search tree: the node at index i has level k (number
+of trailing 1 bits of i), its children are i - 2^(k-1) and i + 2^(k-1),
+the root is 2^K - 1 and leaves are the even indexes. Next to each node
+the max end of its subtree is kept, a query skips any subtree ending at
+or before its start, so a long interval only costs the query its own
+node. Small subtrees (level <= 3) are scanned linearly.
+
+nearest uses the ends sorted once more: when nothing overlaps the query
+the intervals ending at or before its start are exactly those left of it.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+SCAN_LEVEL = 3                          # scan subtrees of at most 15 nodes
+
+
+class IntervalIndex(object):
+    """intervals with values of one sequence, add all then query"""
+    def __init__(self, intervals=()):
+        self._pending = list(intervals) # (start, end, value)
+        self.starts = array('l')
+        self.ends = array('l')
+        self.maxends = array('l')       # max end of subtree of each node
+        self.values = []
+        self._level = 0                 # level of the root
+        self._end_order = array('l')    # indexes sorted by end
+        self._sorted_ends = array('l')
+
+    def add(self, start, end, value=None):
+        self._pending.append((start, end, value))
+
+    def build(self):
+        """sort added intervals into the index, called by queries"""
+        if not self._pending:
+            return
+        items = zip(self.starts, self.ends, self.values) + self._pending
+        items.sort(key=lambda item: (item[0], item[1]))
+        self._pending = []
+        self.starts = array('l', [item[0] for item in items])
+        self.ends = array('l', [item[1] for item in items])
+        self.values = [item[2] for item in items]
+        self._index_tree()
+        order = sorted(xrange(len(self.ends)), key=self.ends.__getitem__)
+        self._end_order = array('l', order)
+        self._sorted_ends = array('l', [self.ends[i] for i in order])
+
+    def _index_tree(self):
+        """max end of the subtree of each node, bottom up by level"""
+        ends = self.ends
+        size = len(ends)
+        maxends = array('l', ends)
+        last_i = last = 0               # last node of level, its max end
+        for i in xrange(0, size, 2):
+            last_i, last = i, ends[i]
+        k = 1
+        while 1 << k <= size:
+            x = 1 << (k - 1)
+            for i in xrange((x << 1) - 1, size, x << 2):
+                left = maxends[i - x]
+                right = maxends[i + x] if i + x < size else last
+                maxends[i] = max(ends[i], left, right)
+            # parent of last_i, nodes past size keep the max end of last
+            last_i = last_i - x if last_i >> k & 1 else last_i + x
+            if last_i < size and maxends[last_i] > last:
+                last = maxends[last_i]
+            k += 1
+        self.maxends = maxends
+        self._level = k - 1
+
+    def __len__(self):
+        return len(self.starts) + len(self._pending)
+
+    def __repr__(self):
+        return '<IntervalIndex intervals:{0}>'.format(len(self))
+
+    def _overlap(self, start, end):
+        """indexes of intervals overlapping [start, end), ascending"""
+        self.build()
+        starts, ends, maxends = self.starts, self.ends, self.maxends
+        size = len(starts)
+        hits = []
+        if not size:
+            return hits
+        stack = [((1 << self._level) - 1, self._level, False)]
+        while stack:
+            x, k, left_done = stack.pop()
+            if k <= SCAN_LEVEL:         # scan the small subtree in order
+                i = x >> k << k
+                last = min(i + (1 << (k + 1)) - 1, size)
+                while i < last and starts[i] < end:
+                    if ends[i] > start:
+                        hits.append(i)
+                    i += 1
+            elif not left_done:
+                stack.append((x, k, True))
+                y = x - (1 << (k - 1))  # left child, may be past size
+                if y >= size or maxends[y] > start:
+                    stack.append((y, k - 1, False))
+            elif x < size and starts[x] < end:
+                if ends[x] > start:
+                    hits.append(x)
+                stack.append((x + (1 << (k - 1)), k - 1, False))
+        return hits
+
+    def overlap(self, start, end):
+        """yield (start, end, value) of intervals overlapping [start, end),
+        sorted by start"""
+        hits = self._overlap(start, end)
+        starts, ends, values = self.starts, self.ends, self.values
+        for i in hits:
+            yield starts[i], ends[i], values[i]
+
+    def count(self, start, end):
+        return len(self._overlap(start, end))
+
+    def nearest(self, start, end=None):
+        """(distance, [(start, end, value), ...]) of intervals closest to
+        [start, end), distance 0 means overlapping, None if empty"""
+        if end is None:
+            end = start + 1
+        hits = list(self.overlap(start, end))
+        if hits:
+            return 0, hits
+        starts, ends, values = self.starts, self.ends, self.values
+        best, hits = None, []
+        # nothing overlaps: intervals ending at or before start are left of
+        # the query, the closest have the largest such end
+        j = bisect_right(self._sorted_ends, start)
+        if j:
+            maxend = self._sorted_ends[j - 1]
+            best = start - maxend + 1
+            left = sorted(self._end_order[bisect_left(self._sorted_ends,
+                                                      maxend):j])
+            hits = [(starts[i], ends[i], values[i]) for i in left]
+        hi = bisect_left(starts, end)
+        if hi < len(starts):            # closest interval after end
+            right = starts[hi]
+            dist = right - end + 1
+            if best is None or dist < best:
+                best, hits = dist, []
+            if dist == best:
+                for i in xrange(hi, bisect_right(starts, right)):
+                    hits.append((starts[i], ends[i], values[i]))
+        if best is None:
+            return None
+        return best, hits
+
+
+class GenomeIndex(object):
+    """IntervalIndex of each sequence name (chrom, tname, ...)"""
+    def __init__(self):
+        self._indexes = {}
+
+    def add(self, name, start, end, value=None):
+        try:
+            index = self._indexes[name]
+        except KeyError:
+            index = self._indexes[name] = IntervalIndex()
+        index.add(start, end, value)
+
+    def __contains__(self, name):
+        return name in self._indexes
+
+    def __getitem__(self, name):
+        return self._indexes[name]
+
+    def names(self):
+        return sorted(self._indexes)
+
+    def __len__(self):
+        return sum([len(index) for index in self._indexes.itervalues()])
+
+    def __repr__(self):
+        return '<GenomeIndex names:{0} intervals:{1}>'.format(
+            len(self._indexes), len(self))
+
+    def overlap(self, name, start, end):
+        if name not in self._indexes:
+            return iter(())
+        return self._indexes[name].overlap(start, end)
+
+    def nearest(self, name, start, end=None):
+        if name not in self._indexes:
+            return None
+        return self._indexes[name].nearest(start, end)
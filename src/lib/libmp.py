@@ -12,7 +12,8 @@ producer| consumer | reporter
 """
 
 
-from multiprocessing import Process, Queue
+from collections import deque
+from multiprocessing import Pool, Process, Queue
 
 SENTINEL = None
 
@@ -146,3 +147,43 @@ def run(producer=None, producer_name='producer', producer_args=(),
     _reporter.join()
 
 
+class _Call(object):
+    """picklable wrapper call target with item as args, same convention as
+    consumer: tuple or list item is expanded to positional args"""
+    def __init__(self, target, args=(), kwargs={}):
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self, item):
+        if isinstance(item, tuple) or isinstance(item, list):
+            _args = tuple(item) + self.args
+        else:
+            _args = (item,) + self.args
+        return self.target(*_args, **self.kwargs)
+
+
+def pool_map(target, items, args=(), kwargs={}, pnum=1):
+    """yield target(item, *args, **kwargs) for each item in order, using
+    pnum worker processes. At most pnum items are in flight so a lazy
+    items iterator is never read far ahead (keeps memory bounded). pnum
+    less than 2 runs target in current process"""
+    call = _Call(target, args, kwargs)
+    if not pnum or pnum < 2:
+        for item in items:
+            yield call(item)
+        return
+
+    pool = Pool(pnum)
+    try:
+        pending = deque()
+        for item in items:
+            pending.append(pool.apply_async(call, (item,)))
+            if len(pending) >= pnum:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
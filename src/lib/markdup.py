@@ -0,0 +1,273 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: markdup.py
+#
+# mark PCR/optical duplicates of coordinate sorted alignments
+# **********************************************************************
+"""Mark duplicates the way Picard MarkDuplicates does, in two streaming
+passes over a coordinate sorted sam file:
+
+1. Every mapped primary read gets its end: (library, reference, unclipped
+   5' position, strand). A read whose mate is mapped waits in a dict
+   until the mate shows up, then the pair joins the group of pairs with
+   the same two ends. Reads without a mapped mate are grouped as
+   fragments by their single end, as are reads whose mate never shows
+   up. A group is decided once the stream
+   is past its last end by more than window bases: the pair (fragment)
+   with the highest sum of base qualities >= 15 is kept and the others
+   are duplicates. Fragments at an end also used by a pair are all
+   duplicates. Duplicate records are kept as one bit per record ordinal
+   (groups are decided out of file order), one byte per 8 records.
+
+2. The file is read again and MASK_DUPLICATE is set on those records
+   (and cleared on the others).
+
+window must be larger than the longest read span including clips. The
+input must be a seekable file, two passes can not read stdin.
+"""
+
+import heapq
+import sys
+
+from pyngs.biofile import sam
+from pyngs.biofile.sam import (TAB, RE_CIGAR_OP, CIGAR_REF_OPS, MASK_REVERSE,
+                               MASK_UNMAPPED, MASK_MATE_UNMAPPED,
+                               MASK_MULTI_FRAG, MASK_SECONDARY,
+                               MASK_SUPPLEMENTARY, MASK_DUPLICATE)
+from pyngs.biofile.xopen import xopen
+
+MIN_BASEQ = 15                          # base quality counted in score
+WINDOW = 1000
+
+
+def _get_libraries(header):
+    """read group id -> library of @RG lines"""
+    libs = {}
+    for line in header:
+        if line.startswith('@RG'):
+            fields = dict(field.split(':', 1)
+                          for field in line.rstrip().split(TAB)[1:])
+            libs[fields.get('ID')] = fields.get('LB', '')
+    return libs
+
+
+def _five_prime(pos, cigar, reverse):
+    """unclipped 5' position of read"""
+    ops = RE_CIGAR_OP.findall(cigar)
+    if not reverse:
+        clip = 0
+        for length, op in ops:
+            if op not in 'SH':
+                break
+            clip += int(length)
+        return pos - clip
+    end = pos
+    for length, op in ops:
+        if op in CIGAR_REF_OPS:
+            end += int(length)
+    for length, op in reversed(ops):
+        if op not in 'SH':
+            break
+        end += int(length)
+    return end - 1
+
+
+def _score(qual):
+    return sum([q for q in [ord(c) - 33 for c in qual] if q >= MIN_BASEQ])
+
+
+class _Marker(object):
+    """pass 1 state, collect ordinals of duplicate records"""
+    def __init__(self, refs, libs, window=WINDOW):
+        self.refs = refs
+        self.libs = libs
+        self.window = window
+        self.pending = {}               # qname -> first mate
+        self.pairs = {}                 # (lib, end1, end2) -> group
+        self.frags = {}                 # (lib, end) -> group
+        self.pair_ends = {}             # (lib, end) -> reads of pairs
+        self._pair_heap = []            # (last end, key) of groups
+        self._frag_heap = []
+        self._end_heap = []
+        self.dups = bytearray()         # bit of each duplicate ordinal
+        self.dup_qnames = set()         # duplicate reads with unmapped mate
+        self.npair = self.nfrag = self.npairdup = self.nfragdup = 0
+
+    def add(self, ordinal, items):
+        flag = int(items[1])
+        rid = _get_rid(self.refs, items[2])
+        pos = int(items[3]) - 1
+        reverse = 1 if flag & MASK_REVERSE else 0
+        end = (rid, _five_prime(pos, items[5], reverse), reverse)
+        lib = ''
+        for tag in items[11:]:
+            if tag.startswith('RG:Z:'):
+                lib = self.libs.get(tag[5:].rstrip(), '')
+                break
+        score = _score(items[10]) if items[10] != '*' else 0
+
+        self.finish(rid, pos)
+
+        if flag & MASK_MULTI_FRAG and not flag & MASK_MATE_UNMAPPED:
+            if (lib, end) not in self.pair_ends:
+                self.pair_ends[(lib, end)] = 0
+                heapq.heappush(self._end_heap, (end[:2], (lib, end)))
+            self.pair_ends[(lib, end)] += 1
+            mate = self.pending.pop(items[0], None)
+            if mate is None:
+                self.pending[items[0]] = (ordinal, end, score, lib)
+                return
+            ends = sorted([mate[1], end])
+            key = (lib, ends[0], ends[1])
+            self._add_group(self.pairs, self._pair_heap, key, ends[1],
+                            score + mate[2], (mate[0], ordinal))
+            self.npair += 1
+        else:
+            qname = items[0] if flag & MASK_MULTI_FRAG else None
+            self._add_group(self.frags, self._frag_heap, (lib, end), end,
+                            score, (ordinal,), qname)
+            self.nfrag += 1
+
+    def _add_group(self, groups, heap, key, last, score, ordinals,
+                   qname=None):
+        group = groups.get(key)
+        if group is None:
+            groups[key] = [score, ordinals, qname, []]
+            heapq.heappush(heap, (last[:2], key))
+        elif score > group[0]:          # new best, old best is duplicate
+            group[3].append((group[1], group[2]))
+            group[:3] = [score, ordinals, qname]
+        else:
+            group[3].append((ordinals, qname))
+
+    def _mark(self, ordinals, qname):
+        dups = self.dups
+        for ordinal in ordinals:
+            idx = ordinal >> 3
+            if idx >= len(dups):
+                dups.extend(bytearray(max(idx + 1 - len(dups), len(dups))))
+            dups[idx] |= 1 << (ordinal & 7)
+        if qname is not None:
+            self.dup_qnames.add(qname)
+
+    def _drain(self):
+        """reads whose mate never showed up become fragments"""
+        for ordinal, end, score, lib in sorted(self.pending.itervalues()):
+            key = (lib, end)
+            if key in self.pair_ends:   # the end is not used by a pair
+                self.pair_ends[key] -= 1
+                if not self.pair_ends[key]:
+                    del self.pair_ends[key]
+            self._add_group(self.frags, self._frag_heap, (lib, end), end,
+                            score, (ordinal,))
+            self.nfrag += 1
+        self.pending = {}
+
+    def finish(self, rid=None, pos=None):
+        """decide groups the stream has passed, all when rid is None"""
+        if rid is None:
+            self._drain()
+
+        def _done(last):
+            return (rid is None or last[0] < rid or
+                    last[1] + self.window < pos)
+
+        while self._pair_heap and _done(self._pair_heap[0][0]):
+            last, key = heapq.heappop(self._pair_heap)
+            score, ordinals, qname, losers = self.pairs.pop(key)
+            for ordinals, qname in losers:
+                self._mark(ordinals, qname)
+            self.npairdup += len(losers)
+
+        while self._frag_heap and _done(self._frag_heap[0][0]):
+            last, key = heapq.heappop(self._frag_heap)
+            score, ordinals, qname, losers = self.frags.pop(key)
+            if key in self.pair_ends:   # fragment loses to any pair
+                losers.append((ordinals, qname))
+            for ordinals, qname in losers:
+                self._mark(ordinals, qname)
+            self.nfragdup += len(losers)
+
+        while self._end_heap and _done(self._end_heap[0][0]):
+            last, key = heapq.heappop(self._end_heap)
+            self.pair_ends.pop(key, None)
+
+
+def _get_rid(refs, rname):
+    try:
+        return refs[rname]
+    except KeyError:
+        raise ValueError('Reference not in @SQ header: {0}'.format(rname))
+
+
+def _check_sorted(items, last, refs):
+    rid = _get_rid(refs, items[2])
+    pos = int(items[3])
+    if (rid, pos) < last:
+        raise ValueError('Input is not sorted by coordinate: {0}:{1}'
+                         .format(items[2], pos))
+    return rid, pos
+
+
+def markdup(samfile, outfile, window=WINDOW, remove=False):
+    """mark duplicates of coordinate sorted samfile to outfile, remove
+    duplicates instead when remove is True, return (pairs, duplicate
+    pairs, fragments, duplicate fragments)"""
+    if samfile == '-':
+        raise ValueError('markdup reads samfile twice, stdin is not supported')
+    header = sam.read_header(samfile)
+    refs = sam._get_refs(header)
+    marker = _Marker(refs, _get_libraries(header), window=window)
+
+    # pass 1: collect duplicate ordinals
+    last = (-1, -1)
+    with xopen(samfile, 'r') as handle:
+        ordinal = -1
+        for line in handle:
+            if line.startswith('@') or not line.strip():
+                continue
+            ordinal += 1
+            items = line.rstrip('\r\n').split(TAB)
+            flag = int(items[1])
+            if flag & (MASK_UNMAPPED | MASK_SECONDARY | MASK_SUPPLEMENTARY):
+                continue
+            last = _check_sorted(items, last, refs)
+            marker.add(ordinal, items)
+    marker.finish()
+    dups = marker.dups
+
+    # pass 2: rewrite flags
+    out = xopen(outfile, 'w')
+    for line in header:
+        out.write(line + '\n')
+    out.write('@PG\tID:pyngs.markdup\tPN:markdup.py\n')
+    with xopen(samfile, 'r') as handle:
+        ordinal = -1
+        for line in handle:
+            if line.startswith('@') or not line.strip():
+                continue
+            ordinal += 1
+            items = line.split(TAB, 2)
+            flag = int(items[1])
+            if flag & (MASK_SECONDARY | MASK_SUPPLEMENTARY):
+                out.write(line)
+                continue
+            idx = ordinal >> 3
+            is_dup = (idx < len(dups) and
+                      dups[idx] & (1 << (ordinal & 7)) != 0)
+            if (flag & MASK_UNMAPPED and marker.dup_qnames and
+                items[0] in marker.dup_qnames):
+                is_dup = True           # unmapped mate of duplicate
+            if is_dup and remove:
+                continue
+            newflag = (flag | MASK_DUPLICATE if is_dup
+                       else flag & ~MASK_DUPLICATE)
+            if newflag != flag:
+                line = TAB.join((items[0], str(newflag), items[2]))
+            out.write(line)
+    if out is not sys.stdout:
+        out.close()
+
+    return marker.npair, marker.npairdup, marker.nfrag, marker.nfragdup
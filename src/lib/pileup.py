@@ -0,0 +1,189 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: pileup.py
+#
+# streaming pileup of coordinate sorted alignments
+# **********************************************************************
+"""Walk coordinate sorted Sam records and yield one Column per reference
+position with depth, base counts, mean base quality and strand counts.
+
+Only the columns still reachable by upcoming reads are kept: they live in
+a deque starting at the leftmost unfinished position, every read scatter
+its aligned bases into the deque by its CIGAR, and columns left of the
+next read start are finished and yielded. Memory is bounded by the
+longest read span, not by the number of reads.
+"""
+
+from collections import deque
+
+from pyngs.biofile import sam
+from pyngs.biofile.sam import (MASK_UNMAPPED, MASK_SECONDARY, MASK_FAILQC,
+                               MASK_DUPLICATE, MASK_REVERSE, parse_cigar)
+from pyngs.lib.libbin import MAX_POS
+
+DELETION = '*'                          # allele of deleted base
+ALLELES = 'ACGTN' + DELETION
+
+# reads with these flags are skipped by default as samtools does
+SKIP_FLAGS = MASK_UNMAPPED | MASK_SECONDARY | MASK_FAILQC | MASK_DUPLICATE
+
+
+class Column(object):
+    """alignments covering one reference position, pos is 0-based"""
+    def __init__(self, rname, pos):
+        self.rname = rname
+        self.pos = pos
+        self.counts = {}                # allele -> count
+        self.forward = 0                # reads on forward strand
+        self.reverse = 0                # reads on reverse strand
+        self._qsum = 0                  # sum of base quality
+        self._qnum = 0                  # number of bases with quality
+
+    def add(self, allele, qual, reverse):
+        self.counts[allele] = self.counts.get(allele, 0) + 1
+        if reverse:
+            self.reverse += 1
+        else:
+            self.forward += 1
+        if qual >= 0:
+            self._qsum += qual
+            self._qnum += 1
+
+    @property
+    def depth(self):
+        return self.forward + self.reverse
+
+    @property
+    def mean_qual(self):
+        """mean base quality of the bases (deletions have none)"""
+        return float(self._qsum) / self._qnum if self._qnum else 0.0
+
+    def count(self, allele):
+        return self.counts.get(allele.upper(), 0)
+
+    def allele_counts(self, ref, alt):
+        """return (refcount, altcount), alt may be comma separated, as
+        used by Ann.refcount and Ann.altcount"""
+        altcount = sum([self.count(each) for each in alt.split(',')
+                        if each != ref])
+        return self.count(ref), altcount
+
+    def __repr__(self):
+        return '\t'.join(map(str, [self.rname, self.pos + 1, self.depth] +
+                             [self.counts.get(a, 0) for a in ALLELES] +
+                             ['{0:.2f}'.format(self.mean_qual),
+                              self.forward, self.reverse]))
+
+
+def _add_read(columns, head, rec, min_baseq, start, end):
+    """scatter aligned bases of rec to columns, columns[0] is at head"""
+    seq = rec.seq
+    qual = rec.qual if rec.qual != '*' else None
+    reverse = rec.flag & MASK_REVERSE
+    rpos = rec.pos
+    qpos = 0
+    for op, length in parse_cigar(rec.cigar):
+        if op in 'M=X':
+            for i in xrange(length):
+                pos = rpos + i
+                if start <= pos < end:
+                    q = ord(qual[qpos+i]) - 33 if qual else -1
+                    if q >= min_baseq or q == -1:
+                        _get_column(columns, head, rec.rname, pos).add(
+                            seq[qpos+i].upper(), q, reverse)
+            rpos += length
+            qpos += length
+        elif op == 'D':
+            for pos in xrange(max(rpos, start), min(rpos + length, end)):
+                _get_column(columns, head, rec.rname, pos).add(
+                    DELETION, -1, reverse)
+            rpos += length
+        elif op == 'N':
+            rpos += length
+        elif op in 'IS':
+            qpos += length
+        # H and P consume neither
+
+
+def _get_column(columns, head, rname, pos):
+    idx = pos - head
+    if idx >= len(columns):
+        columns.extend([None] * (idx + 1 - len(columns)))
+    column = columns[idx]
+    if column is None:
+        column = columns[idx] = Column(rname, pos)
+    return column
+
+
+def pileup(records, start=0, end=None, min_mapq=0, min_baseq=0,
+           skip=SKIP_FLAGS):
+    """Yield Column of each covered position from coordinate sorted Sam
+    records, only positions in [start, end) are built when given (used
+    with SamFile.fetch)
+
+    Arguments:
+    - `min_mapq`: skip reads with mapping quality less than it
+    - `min_baseq`: skip bases with base quality less than it
+    - `skip`: skip reads with any of these flag bits
+    """
+    if end is None:
+        end = MAX_POS
+    columns = deque()
+    head = 0                            # position of columns[0]
+    rname = None
+
+    for rec in records:
+        if rec.flag & skip or rec.mapq < min_mapq:
+            continue
+        if rec.pos < 0 or rec.cigar == '*':
+            continue
+
+        if rec.rname != rname:
+            for column in columns:
+                if column is not None and column.depth:
+                    yield column
+            columns.clear()
+            rname = rec.rname
+            head = rec.pos
+        elif rec.pos < head:
+            raise ValueError('Records are not sorted by coordinate: {0}:{1}'
+                             .format(rec.rname, rec.pos + 1))
+
+        while columns and head < rec.pos: # finished columns
+            column = columns.popleft()
+            head += 1
+            if column is not None and column.depth:
+                yield column
+        if not columns:
+            head = rec.pos
+
+        _add_read(columns, head, rec, min_baseq, start, end)
+
+    for column in columns:
+        if column is not None and column.depth:
+            yield column
+
+
+def pileup_file(samfile, rname=None, start=0, end=None, **kwargs):
+    """pileup whole samfile, or region of rname using the sam index"""
+    if rname is None:
+        return pileup(sam.parse(samfile), **kwargs)
+    samfileobj = sam.read(samfile)
+    return pileup(samfileobj.fetch(rname, start, end), start=start, end=end,
+                  **kwargs)
+
+
+def count_alleles(samfile, anns, **kwargs):
+    """fill refcount and altcount of each Ann from the reads of indexed
+    samfile covering it, yield the Ann"""
+    samfileobj = sam.read(samfile)
+    for ann in anns:
+        ann.refcount = ann.altcount = 0
+        region = samfileobj.fetch(ann.chrom, ann.pos, ann.pos + 1)
+        for column in pileup(region, start=ann.pos, end=ann.pos + 1,
+                             **kwargs):
+            ann.refcount, ann.altcount = column.allele_counts(ann.ref,
+                                                              ann.alt)
+        yield ann
@@ -0,0 +1,454 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: samfilter.py
+#
+# declarative rules to route sam alignments to named outputs
+# **********************************************************************
+"""Rules are python expressions over the fields of one alignment:
+
+    columns:  qname flag rname pos mapq cigar rnext pnext tlen seq qual
+              (pos and pnext are 0-based)
+    flags:    paired proper_pair unmapped mate_unmapped reverse
+              mate_reverse read1 read2 secondary failqc duplicate
+              supplementary
+    cigar:    clipped (has soft clip), cigar_M cigar_I cigar_D cigar_N
+              cigar_S cigar_H ... (total length of the operation)
+    tags:     upper case tag name, eg. NM XT X0, MISSING (-1) when absent
+
+    eg. 'mapq < 20 or NM > 2'
+
+Rules of a read pair reach each mate as r1.<field> and r2.<field>, eg.
+"r1.XT == 'N' or r2.XT == 'N'".
+
+A Router holds an ordered rule table, each record goes to the output
+of the first matching rule, the default output when no rule matches,
+and the error output when a rule raises. Rules are parsed and checked
+once, records are split once and only the fields named by the rules
+that are evaluated get converted.
+
+Router.route_batch evaluates the rules as numpy masks over a
+sam.SamBatch, with the columns flag rname rnext pos pnext mapq tlen,
+the flags, clipped and the batch tags (single character tags compared
+with one character strings). rname and rnext are reference ids there,
+strings compared with them are looked up in the batch references ('='
+is not supported, an rnext of '=' is the id of rname). Absent tags are MISSING in both ways of evaluation,
+so a rule means the same for Router.route and route_batch. Pair rules
+need the mates of each pair in adjacent rows, read1 first.
+"""
+
+import ast
+import re
+
+from pyngs.biofile import sam
+from pyngs.biofile.sam import TAB, RE_CIGAR_OP
+
+try:
+    import numpy as np
+except ImportError:                     # numpy is only used by route_batch
+    np = None
+
+# name -> (column index, convert function)
+COLUMNS = {
+    'qname': (0, str),
+    'flag': (1, int),
+    'rname': (2, str),
+    'pos': (3, lambda x: int(x) - 1),
+    'mapq': (4, int),
+    'cigar': (5, str),
+    'rnext': (6, str),
+    'pnext': (7, lambda x: int(x) - 1),
+    'tlen': (8, int),
+    'seq': (9, str),
+    'qual': (10, str),
+    }
+
+FLAGS = {
+    'paired': sam.MASK_MULTI_FRAG,
+    'proper_pair': sam.MASK_PROP_ALIGN,
+    'unmapped': sam.MASK_UNMAPPED,
+    'mate_unmapped': sam.MASK_MATE_UNMAPPED,
+    'reverse': sam.MASK_REVERSE,
+    'mate_reverse': sam.MASK_MATE_REVERSE,
+    'read1': sam.MASK_READ1,
+    'read2': sam.MASK_READ2,
+    'secondary': sam.MASK_SECONDARY,
+    'failqc': sam.MASK_FAILQC,
+    'duplicate': sam.MASK_DUPLICATE,
+    'supplementary': sam.MASK_SUPPLEMENTARY,
+    }
+
+CONSTANTS = {'True': True, 'False': False, 'None': None,
+             'MISSING': sam.MISSING}
+
+RE_TAG = re.compile('^[A-Z][A-Z0-9]$')
+RE_CIGAR_FIELD = re.compile('^cigar_([MIDNSHPX])$')
+PAIR_NAMES = ('r1', 'r2')
+
+_NODES = (ast.Expression, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare,
+          ast.Name, ast.Attribute, ast.Num, ast.Str, ast.Tuple, ast.List,
+          ast.Load, ast.And, ast.Or, ast.Not, ast.USub, ast.Add, ast.Sub,
+          ast.Mult, ast.Div, ast.Mod, ast.BitAnd, ast.BitOr, ast.Eq,
+          ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn)
+
+# mfilsam categories, first match wins, pairs match none are 'good'
+PAIR_RULES = [
+    ('unmap', 'r1.unmapped and r2.unmapped'),   # both reads not mapped
+    ('onemap', 'r1.unmapped or r2.unmapped'),   # one of reads not mapped
+    ('n', "r1.XT == 'N' or r2.XT == 'N'"),      # mapped in N block
+    ('rep', 'not r1.mapq or not r2.mapq'),      # mapped in repeat region
+    ('cross', 'r1.rname != r2.rname'),          # mapped to two scaffolds
+    ('soft', 'r1.clipped or r2.clipped'),       # soft clip in reads
+    ('mate', "r1.XT == 'M' or r2.XT == 'M'"),   # mapped by mate sw
+    ('mul', 'r1.X0 > 1 or r2.X0 > 1 or '        # multi mapping position,
+            'r1.X1 > 1 or r2.X1 > 1 or '        # X0 + X1 > 1 without
+            'r1.X0 > 0 and r1.X1 > 0 or '       # adding absent tags
+            'r2.X0 > 0 and r2.X1 > 0'),
+    ('nm{nm}', 'r1.NM > {nm} or r2.NM > {nm}'), # too much mismatches
+    ]
+
+
+def _is_field(name):
+    return (name in COLUMNS or name in FLAGS or name == 'clipped' or
+            RE_TAG.match(name) or RE_CIGAR_FIELD.match(name))
+
+
+def _get_field(items, name):
+    """convert field name of the split sam line items"""
+    if name in COLUMNS:
+        idx, conv = COLUMNS[name]
+        return conv(items[idx])
+    if name in FLAGS:
+        return bool(int(items[1]) & FLAGS[name])
+    if name == 'clipped':
+        return 'S' in items[5]
+    match = RE_CIGAR_FIELD.match(name)
+    if match:
+        op = match.group(1)
+        return sum([int(l) for l, o in RE_CIGAR_OP.findall(items[5])
+                    if o == op])
+    prefix = name + ':'
+    for tag in items[11:]:
+        if tag.startswith(prefix):
+            tp, val = tag[3], tag[5:]
+            if tp == 'i':
+                return int(val)
+            elif tp == 'f':
+                return float(val)
+            return val
+    return sam.MISSING                  # absent tag, as in SamBatch
+
+
+class Record(object):
+    """lazy fields of one sam line, converted once on first access"""
+    def __init__(self, line):
+        self._items = line.rstrip('\r\n').split(TAB)
+        self._cache = {}
+
+    def __getitem__(self, name):
+        try:
+            return self._cache[name]
+        except KeyError:
+            if not _is_field(name):
+                raise
+        val = self._cache[name] = _get_field(self._items, name)
+        return val
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class Rule(object):
+    """one compiled rule expression"""
+    def __init__(self, expr, pair=False):
+        self.expr = expr
+        self.pair = pair
+        self._tree = ast.parse(expr.strip(), mode='eval')
+        self.fields = self._check(self._tree)
+        self._code = compile(self._tree, '<rule>', 'eval')
+        self._vcode = None
+
+    def __repr__(self):
+        return '<Rule {0}>'.format(self.expr)
+
+    def _check(self, tree):
+        """raise ValueError for unsupported syntax or unknown fields,
+        return the field names used"""
+        fields = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, _NODES):
+                raise ValueError('Unsupported syntax in rule {0}: {1}'
+                                 .format(self.expr, type(node).__name__))
+            if isinstance(node, ast.Attribute):
+                if (not self.pair or not isinstance(node.value, ast.Name) or
+                    node.value.id not in PAIR_NAMES):
+                    raise ValueError('Only r1.<field> and r2.<field> are '
+                                     'allowed in pair rule: {0}'
+                                     .format(self.expr))
+                if not _is_field(node.attr):
+                    raise ValueError('Unknown field in rule {0}: {1}'
+                                     .format(self.expr, node.attr))
+                fields.add(node.attr)
+            elif isinstance(node, ast.Name) and node.id not in CONSTANTS:
+                if self.pair:
+                    if node.id not in PAIR_NAMES:
+                        raise ValueError('Use r1.{1} or r2.{1} in pair rule: '
+                                         '{0}'.format(self.expr, node.id))
+                elif not _is_field(node.id):
+                    raise ValueError('Unknown field in rule {0}: {1}'
+                                     .format(self.expr, node.id))
+                else:
+                    fields.add(node.id)
+        return fields
+
+    def __call__(self, record, mate=None):
+        """evaluate on Record (or r1, r2 Records of a pair rule)"""
+        if self.pair:
+            return eval(self._code, dict(CONSTANTS, __builtins__={}),
+                        {'r1': record, 'r2': mate})
+        return eval(self._code, dict(CONSTANTS, __builtins__={}), record)
+
+    def mask(self, batch):
+        """bool array of the rule over sam.SamBatch rows (pairs of
+        adjacent rows for a pair rule)"""
+        if self._vcode is None:
+            tree = _VectorTransformer(self.expr).visit(
+                ast.parse(self.expr.strip(), mode='eval'))
+            self._vcode = compile(ast.fix_missing_locations(tree),
+                                  '<rule>', 'eval')
+        result = eval(self._vcode, dict(CONSTANTS, __builtins__={},
+                                        **_VECTOR_FUNCS),
+                      _BatchNamespace(batch, self.pair))
+        size = len(batch) // 2 if self.pair else len(batch)
+        return np.ones(size, dtype=np.bool_) & result
+
+
+# **********************************************************************
+# vectorized evaluation over SamBatch columns
+# **********************************************************************
+_VECTOR_FUNCS = {
+    '_and': lambda *args: reduce(np.logical_and, args),
+    '_or': lambda *args: reduce(np.logical_or, args),
+    '_not': lambda arg: np.logical_not(arg),
+    '_in': lambda arg, vals: np.in1d(arg, vals),
+    }
+
+_VECTOR_COLUMNS = {'flag': 'flag', 'rname': 'rid', 'rnext': 'mrid',
+                   'pos': 'pos', 'pnext': 'pnext', 'mapq': 'mapq',
+                   'tlen': 'tlen', 'clipped': 'clipped'}
+_REF_FIELDS = ('rname', 'rnext')        # compared as reference ids
+UNKNOWN_REF = -2                        # id of a name not in the batch
+
+
+class _VectorTransformer(ast.NodeTransformer):
+    """and/or/not to numpy logical functions, chained compare to _and of
+    compares, r1.x to name r1__x, strings compared with rname or rnext to
+    _rid(name), other one character strings to ord"""
+    def __init__(self, expr):
+        self.expr = expr
+
+    def _call(self, func, args):
+        return ast.Call(func=ast.Name(id=func, ctx=ast.Load()), args=args,
+                        keywords=[], starargs=None, kwargs=None)
+
+    def visit_BoolOp(self, node):
+        func = '_and' if isinstance(node.op, ast.And) else '_or'
+        return self._call(func, [self.visit(v) for v in node.values])
+
+    def visit_UnaryOp(self, node):
+        if isinstance(node.op, ast.Not):
+            return self._call('_not', [self.visit(node.operand)])
+        return self.generic_visit(node)
+
+    def _is_ref(self, node):
+        if isinstance(node, ast.Attribute):
+            return node.attr in _REF_FIELDS
+        return isinstance(node, ast.Name) and node.id in _REF_FIELDS
+
+    def _ref(self, node):
+        """reference name strings of node to _rid calls"""
+        if isinstance(node, ast.Str):
+            if node.s == '=':
+                raise ValueError("'=' is not supported by vectorized rule: "
+                                 "{0}".format(self.expr))
+            return self._call('_rid', [node])
+        if isinstance(node, (ast.Tuple, ast.List)):
+            return type(node)(elts=[self._ref(elt) for elt in node.elts],
+                              ctx=ast.Load())
+        return self.visit(node)
+
+    def visit_Compare(self, node):
+        operands = [node.left] + node.comparators
+        refs = [self._is_ref(operand) for operand in operands]
+        values = []
+        for i, operand in enumerate(operands):
+            if i and refs[i-1] or i + 1 < len(refs) and refs[i+1]:
+                values.append(self._ref(operand))
+            else:
+                values.append(self.visit(operand))
+        left = values[0]
+        parts = []
+        for op, right in zip(node.ops, values[1:]):
+            if isinstance(op, (ast.In, ast.NotIn)):
+                part = self._call('_in', [left, right])
+                if isinstance(op, ast.NotIn):
+                    part = self._call('_not', [part])
+            else:
+                part = ast.Compare(left=left, ops=[op], comparators=[right])
+            parts.append(part)
+            left = right
+        return parts[0] if len(parts) == 1 else self._call('_and', parts)
+
+    def visit_Attribute(self, node):
+        return ast.Name(id='{0}__{1}'.format(node.value.id, node.attr),
+                        ctx=ast.Load())
+
+    def visit_Str(self, node):
+        if len(node.s) != 1:
+            raise ValueError('Only one character strings are supported by '
+                             'vectorized rule: {0}'.format(self.expr))
+        return ast.Num(n=ord(node.s))
+
+
+class _BatchNamespace(object):
+    """field name -> column array of SamBatch"""
+    def __init__(self, batch, pair):
+        self._batch = batch
+        self._pair = pair
+
+    def _rid(self, rname):
+        """reference id of rname in the batch, as SamBatch._rid"""
+        if rname == '*':
+            return sam.MISSING
+        return self._batch.refs.get(rname, UNKNOWN_REF)
+
+    def __getitem__(self, name):
+        if name == '_rid':
+            return self._rid
+        if name in _VECTOR_FUNCS or name in CONSTANTS:
+            raise KeyError(name)        # found in globals
+        if self._pair:
+            if '__' not in name:
+                raise KeyError(name)
+            mate, name = name.split('__', 1)
+            rows = slice(0, None, 2) if mate == 'r1' else slice(1, None, 2)
+        else:
+            rows = slice(None)
+
+        batch = self._batch
+        if name in FLAGS:
+            return batch.has(FLAGS[name])[rows]
+        if name in _VECTOR_COLUMNS:
+            return getattr(batch, _VECTOR_COLUMNS[name])[rows]
+        if name in batch.tags:
+            return batch.tags[name][rows]
+        raise ValueError('Field {0} is not a SamBatch column'.format(name))
+
+
+class Router(object):
+    """Route records to the name of the first matching rule
+
+    Arguments:
+    - `rules`: [(name, expr), ...] in priority order
+    - `default`: name of records no rule match
+    - `error`: name of records a rule raise an error on
+    - `pair`: rules are pair rules over r1 and r2
+    """
+    def __init__(self, rules, default='good', error='err', pair=False):
+        self.rules = [(name, Rule(expr, pair=pair)) for name, expr in rules]
+        self.default = default
+        self.error = error
+        self.pair = pair
+
+    @property
+    def names(self):
+        """all output names, rules order then default and error"""
+        names = [name for name, rule in self.rules]
+        for name in (self.default, self.error):
+            if name not in names:
+                names.append(name)
+        return names
+
+    @property
+    def fields(self):
+        fields = set()
+        for name, rule in self.rules:
+            fields |= rule.fields
+        return fields
+
+    def route(self, line):
+        """output name of one sam line"""
+        record = Record(line)
+        try:
+            for name, rule in self.rules:
+                if rule(record):
+                    return name
+        except Exception:
+            return self.error
+        return self.default
+
+    def route_pair(self, line1, line2):
+        """output name of a read pair"""
+        record1, record2 = Record(line1), Record(line2)
+        try:
+            for name, rule in self.rules:
+                if rule(record1, record2):
+                    return name
+        except Exception:
+            return self.error
+        return self.default
+
+    def route_batch(self, batch):
+        """array of output index in self.names for each row of SamBatch
+        (each pair of adjacent rows in pair mode, ValueError if the rows
+        of a pair have different qname)"""
+        if np is None:
+            raise ImportError('numpy is required by Router.route_batch')
+        if self.pair:
+            _check_pairs(batch)
+        names = self.names
+        size = len(batch) // 2 if self.pair else len(batch)
+        marks = np.empty(size, dtype=np.int16)
+        marks.fill(names.index(self.default))
+        for name, rule in reversed(self.rules): # first match wins
+            marks[rule.mask(batch)] = names.index(name)
+        return marks
+
+
+def _check_pairs(batch):
+    """raise ValueError unless rows 2i and 2i+1 of batch are mates"""
+    lines = batch.lines
+    if len(lines) % 2:
+        raise ValueError('Odd number of rows in pair batch: {0}'
+                         .format(len(lines)))
+    for i in xrange(0, len(lines), 2):
+        qname = lines[i].split(TAB, 1)[0]
+        if lines[i+1].split(TAB, 1)[0] != qname:
+            raise ValueError('Mates are not in adjacent rows: {0}'
+                             .format(qname))
+
+
+def load_rules(fname):
+    """read rules from file, one 'name<TAB>expression' per line"""
+    rules = []
+    with open(fname, 'r') as handle:
+        for line in handle:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            name, expr = line.split(None, 1)
+            rules.append((name, expr))
+    return rules
+
+
+def pair_router(nm=2, rules=None):
+    """Router of mfilsam/filsam categories, nm is the max mismatches"""
+    rules = rules or [(name.format(nm=nm), expr.format(nm=nm))
+                      for name, expr in PAIR_RULES]
+    return Router(rules, default='good', error='err', pair=True)
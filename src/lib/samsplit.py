@@ -0,0 +1,176 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: samsplit.py
+#
+# split sam file by reference or to region balanced shards
+# **********************************************************************
+"""Split alignments of a sam file to one output per reference (rname) or
+to nshard outputs of about equal reference length, so pileup, coverage
+or variant calling can run on each part in its own job.
+
+Shards are made from the @SQ lengths: references are cut into nshard
+runs of consecutive regions, a long reference can be spread over
+several shards and a shard can hold many short references. A record goes
+to the shard holding its position, unmapped records go to 'unmapped'.
+
+Records are routed through xopen.BufferedWriter. With pnum > 1 the input
+is read in byte shards by pnum processes, each writing its own part
+files, the parts are joined in input order after the header, so sorted
+input gives sorted outputs.
+"""
+
+import os
+import shutil
+import sys
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import chain
+
+from pyngs.biofile import sam
+from pyngs.biofile.sam import TAB
+from pyngs.biofile.xopen import xopen, BufferedWriter
+from pyngs.lib.libmp import pool_map
+from pyngs.util import byte_shards, read_range
+
+UNMAPPED = 'unmapped'                   # key of records without rname
+BUFFER_SIZE = 4096                      # lines kept by each writer
+
+
+def make_shards(header, nshard):
+    """split references of @SQ header to at most nshard shards of about
+    equal length, return [[(rname, start, end), ...], ...]"""
+    sqs = sam.get_sq(header)
+    total = sum([length for rname, length in sqs])
+    size = max(1, -(-total // nshard))  # ceil
+    shards = [[]]
+    room = size
+    for rname, length in sqs:
+        start = 0
+        while start < length:
+            if not room:
+                shards.append([])
+                room = size
+            end = min(length, start + room)
+            shards[-1].append((rname, start, end))
+            room -= end - start
+            start = end
+    return shards
+
+
+def write_shards(out, shards):
+    """write shards as bed lines: rname, start, end, shard index"""
+    for i, shard in enumerate(shards):
+        for rname, start, end in shard:
+            print >>out, '{0}\t{1}\t{2}\t{3}'.format(rname, start, end, i)
+
+
+class _Router(object):
+    """map rname and 0-based pos to output key: rname, or shard index when
+    shards given. A class so it can be sent to worker processes"""
+    def __init__(self, shards=None):
+        self.shards = shards
+        self._starts = {}               # rname -> ([starts], [shard index])
+        for i, shard in enumerate(shards or ()):
+            for rname, start, end in shard:
+                starts, indices = self._starts.setdefault(rname, ([], []))
+                starts.append(start)
+                indices.append(i)
+
+    def __call__(self, rname, pos):
+        if rname == '*':
+            return UNMAPPED
+        if self.shards is None:
+            return rname
+        try:
+            starts, indices = self._starts[rname]
+        except KeyError:
+            raise ValueError('Reference not in @SQ header: {0}'.format(rname))
+        return indices[max(bisect_right(starts, pos) - 1, 0)]
+
+
+def out_name(prefix, key):
+    if isinstance(key, int):
+        return '{0}.shard{1}.sam'.format(prefix, key)
+    return '{0}.{1}.sam'.format(prefix, key)
+
+
+def _split_lines(lines, prefix, router, suffix='', header=None,
+                 size=BUFFER_SIZE):
+    writers = {}
+    for line in lines:
+        if line.startswith('@') or not line.strip():
+            continue
+        items = line.split(TAB, 4)
+        key = router(items[2], int(items[3]) - 1)
+        writer = writers.get(key)
+        if writer is None:
+            writer = writers[key] = BufferedWriter(
+                out_name(prefix, key) + suffix, size=size, header=header)
+        writer.write(line)
+    for writer in writers.itervalues():
+        writer.close()
+    return dict([(key, writer.count) for key, writer in writers.iteritems()])
+
+
+def _split_range(beg, end, part, samfile, prefix, router, size):
+    return _split_lines(read_range(samfile, beg, end), prefix, router,
+                        suffix='.part{0}'.format(part), size=size)
+
+
+def _join_parts(prefix, key, header, nparts):
+    with open(out_name(prefix, key), 'wb') as out:
+        out.write(''.join(header))
+        for part in nparts:
+            fname = '{0}.part{1}'.format(out_name(prefix, key), part)
+            with open(fname, 'rb') as handle:
+                shutil.copyfileobj(handle, out)
+            os.remove(fname)
+
+
+def _key_order(header, shards):
+    if shards is not None:
+        return range(len(shards)) + [UNMAPPED]
+    return [rname for rname, length in sam.get_sq(header)] + [UNMAPPED]
+
+
+def split(samfile, prefix, shards=None, pnum=1, size=BUFFER_SIZE):
+    """split samfile to prefix.{rname}.sam (or prefix.shard{i}.sam when
+    shards from make_shards given), each with the full header, return
+    OrderedDict of output key -> record count"""
+    router = _Router(shards)
+    if pnum < 2 or samfile.endswith('.gz') or samfile == '-':
+        handle = xopen(samfile, 'r')
+        header = []
+        line = handle.readline()
+        while line.startswith('@'):
+            header.append(line)
+            line = handle.readline()
+        counts = _split_lines(chain([line], handle), prefix, router,
+                              header=header, size=size)
+        if handle is not sys.stdin:
+            handle.close()
+    else:
+        samfileobj = sam.read(samfile)
+        offset = samfileobj._offset
+        samfileobj._handle.close()
+        header = [line + '\n' for line in sam.read_header(samfile)]
+        items = [(beg, end, part) for part, (beg, end) in
+                 enumerate(byte_shards(samfile, pnum * 4, offset))]
+        counts = {}
+        parts = {}
+        for (beg, end, part), result in zip(items, pool_map(
+                _split_range, items, args=(samfile, prefix, router, size),
+                pnum=pnum)):
+            for key, count in result.iteritems():
+                counts[key] = counts.get(key, 0) + count
+                parts.setdefault(key, []).append(part)
+        for key in parts:
+            _join_parts(prefix, key, header, parts[key])
+
+    order = _key_order(header, shards)
+    known = set(order)
+    return OrderedDict([(key, counts[key]) for key in order if key in counts] +
+                       [(key, counts[key]) for key in sorted(counts)
+                        if key not in known])
@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: agp2fa.py
+#
+# build scaffold sequences from agp file and contig fasta
+# **********************************************************************
+"""Usage: agp2fa.py [opts] agpfile contigfasta
+       -o or --output str  output fasta file, '-' is stdout [agp name .fa]
+       -w or --width  int  bases of each fasta line [60]
+       -h or --help        show this help message
+       contigfasta must be plain text, its .fai index is built if missing.
+       Scaffolds are written piece by piece, contigs on '-' strand are
+       reverse complemented and gaps are written as N of gaplen.
+"""
+
+import os
+import sys
+import getopt
+from pyngs.biofile import agp
+from pyngs.biofile.fasta import IndexedFasta, FastaWriter, LINE_WIDTH
+from pyngs.util import revcom
+
+CHUNK = 1 << 20                         # bases read from contig at once
+
+
+def write_scaffolds(agpfile, contigfile, out):
+    """write scaffolds of agpfile with sequences of contigfile to out, a
+    FastaWriter, agp lines of each scaffold must be consecutive"""
+    contigs = IndexedFasta(contigfile)
+    scaf = None
+    done = set()                        # scaffolds already written
+    for part in agp.parse(agpfile):
+        if part.scaf != scaf:
+            if part.scaf in done:
+                raise ValueError('Lines of scaffold are not consecutive in '
+                                 '{0}: {1}'.format(agpfile, part.scaf))
+            scaf = part.scaf
+            done.add(scaf)
+            out.start(scaf)
+        if part.is_gap:
+            for i in xrange(0, part.gaplen, CHUNK):
+                out.write('N' * min(CHUNK, part.gaplen - i))
+            continue
+        if part.contig not in contigs:
+            raise ValueError('Contig not in {0}: {1}'.format(contigfile,
+                                                            part.contig))
+        start, end = part.contig_start, part.contig_end
+        if part.strand == '-':          # read chunks from the end
+            for pos in xrange(end, start, -CHUNK):
+                out.write(revcom(contigs.fetch(part.contig,
+                                               max(pos - CHUNK, start), pos)))
+        else:
+            for seq in contigs.fetch_chunks(part.contig, start, end, CHUNK):
+                out.write(seq)
+    contigs.close()
+
+
+def show_usage():
+    print __doc__
+    exit()
+
+
+def main(argv):
+    output = None
+    width = LINE_WIDTH
+    try:
+        optlst, args = getopt.getopt(argv, 'ho:w:', ['help', 'output',
+                                                     'width'])
+        for opt, val in optlst:
+            if opt in ('-h', '--help'): # show usage
+                show_usage()
+            elif opt in ('-o', '--output'): # output fasta
+                output = val
+            elif opt in ('-w', '--width'): # fasta line width
+                width = int(val)
+    except getopt.GetoptError, e:
+        show_usage()
+
+    if len(args) != 2:                  # agp and contig fasta
+        show_usage()
+
+    agpfile, contigfile = args
+    if output is None:
+        output = '{0}.fa'.format(os.path.splitext(os.path.basename(
+            agpfile))[0])
+    out = FastaWriter(output, width=width)
+    write_scaffolds(agpfile, contigfile, out)
+    out.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
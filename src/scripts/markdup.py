@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: markdup.py
+#
+# mark or remove duplicates of coordinate sorted sam files
+# **********************************************************************
+"""Usage: markdup.py [-w window] [-r] samfile1 samfile2 ...
+       -w or --window int  longest read span including clips [1000]
+       -r or --remove      remove duplicates instead of marking them
+       -h or --help        show this help message
+       samfile must be a file sorted by coordinate (not stdin), output
+       is written to samfile name with .markdup.sam ext, counts are
+       written to stderr
+"""
+
+import os
+import sys
+import getopt
+from pyngs.lib.markdup import markdup, WINDOW
+
+
+def show_usage():
+    print __doc__
+    exit()
+
+
+def main(argv):
+    window = WINDOW
+    remove = False
+    try:
+        optlst, args = getopt.getopt(argv, 'hw:r', ['help', 'window',
+                                                    'remove'])
+        for opt, val in optlst:
+            if opt in ('-h', '--help'): # show usage
+                show_usage()
+            elif opt in ('-w', '--window'): # longest read span
+                window = int(val)
+            elif opt in ('-r', '--remove'): # remove duplicates
+                remove = True
+    except getopt.GetoptError, e:
+        show_usage()
+
+    if not args:                        # no sam file given
+        show_usage()
+
+    for arg in args:
+        name = os.path.splitext(os.path.basename(arg))[0]
+        npair, npairdup, nfrag, nfragdup = markdup(
+            arg, '{0}.markdup.sam'.format(name), window=window, remove=remove)
+        print >>sys.stderr, ('{0}: {1}/{2} duplicate pairs, {3}/{4} '
+                             'duplicate fragments'.format(
+                                 arg, npairdup, npair, nfragdup, nfrag))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
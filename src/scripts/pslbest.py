@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: pslbest.py
+#
+# keep the best alignments of each query of blat psl files
+# **********************************************************************
+"""Usage: pslbest.py [opts] pslfile1 pslfile2 ...
+       -n or --near   float  keep alignments scoring within near fraction
+                             of the best of the query [0.01]
+       -c or --cover  float  min fraction of query aligned [0.0]
+       -u or --unsorted      alignments of a query are not consecutive
+       -h or --help          show this help message
+       output is pslfile name with .best.psl ext, without psl header
+"""
+
+import os
+import sys
+import getopt
+from pyngs.biofile import psl
+
+
+def show_usage():
+    print __doc__
+    exit()
+
+
+def main(argv):
+    kwargs = {}
+    try:
+        optlst, args = getopt.getopt(argv, 'hn:c:u', ['help', 'near', 'cover',
+                                                     'unsorted'])
+        for opt, val in optlst:
+            if opt in ('-h', '--help'): # show usage
+                show_usage()
+            elif opt in ('-n', '--near'): # near best fraction
+                kwargs['near'] = float(val)
+            elif opt in ('-c', '--cover'): # min query cover
+                kwargs['min_cover'] = float(val)
+            elif opt in ('-u', '--unsorted'): # not grouped by query
+                kwargs['grouped'] = False
+    except getopt.GetoptError, e:
+        show_usage()
+
+    if not args:                        # no psl file given
+        show_usage()
+
+    for arg in args:
+        name = os.path.splitext(os.path.basename(arg))[0]
+        with open('{0}.best.psl'.format(name), 'w') as out:
+            for hit in psl.best_hits(arg, **kwargs):
+                print >>out, repr(hit)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: samcov.py
+#
+# coverage of sam alignments as bedGraph, binned or per gene summary
+# **********************************************************************
+"""Samcov a tool to calc coverage of sam file grouped by reference
+
+Usage: samcov.py [opts] samfile1 samfile2 ....
+       detail option as below:
+       -b or --binsize int  output mean coverage of each binsize window
+                            instead of bedGraph
+       -g or --genes   str  gene list table (libgene format), write
+                            coverage summary of each gene to .gene.cov
+       -r or --refgene str  UCSC refGene.txt, same as -g
+       -q or --mapq    int  skip reads with mapping quality less than [0]
+       -h or --help         show this help message
+       output is samfile name with .bedgraph or .bin{binsize}.cov ext
+"""
+
+import os
+import sys
+import getopt
+from pyngs.lib.coverage import coverage
+from pyngs.lib import libgene
+from pyngs.biofile import refgene
+
+
+def samcov(samfile, binsize=None, genefile=None, refgenefile=None,
+           mapq=0):
+    name = os.path.splitext(os.path.basename(samfile))[0]
+    if binsize:
+        out = open('{0}.bin{1}.cov'.format(name, binsize), 'w')
+    else:
+        out = open('{0}.bedgraph'.format(name), 'w')
+
+    genes = gene_out = None
+    if genefile:
+        genes = libgene.parse(genefile)
+    elif refgenefile:
+        genes = refgene.parse(refgenefile)
+    if genes is not None:
+        gene_out = open('{0}.gene.cov'.format(name), 'w')
+
+    coverage(samfile, out, binsize=binsize, genes=genes, gene_out=gene_out,
+             min_mapq=mapq)
+
+    for handle in (out, gene_out):
+        if handle is not None:
+            handle.close()
+
+
+def show_usage():
+    print __doc__
+    exit()
+
+
+def main(argv):
+    kwargs = {}
+    try:
+        optlst, args = getopt.getopt(
+            argv, 'hb:g:r:q:', ['help', 'binsize', 'genes', 'refgene',
+                                'mapq'])
+        for opt, val in optlst:
+            if opt in ('-h', '--help'): # show usage
+                show_usage()
+            elif opt in ('-b', '--binsize'): # binned coverage
+                kwargs['binsize'] = int(val)
+            elif opt in ('-g', '--genes'): # gene list table
+                kwargs['genefile'] = val
+            elif opt in ('-r', '--refgene'): # ucsc refGene
+                kwargs['refgenefile'] = val
+            elif opt in ('-q', '--mapq'): # mapping quality threshold
+                kwargs['mapq'] = int(val)
+    except getopt.GetoptError, e:
+        show_usage()
+
+    if not args:                        # no sam file given
+        show_usage()
+
+    for arg in args:
+        samcov(arg, **kwargs)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
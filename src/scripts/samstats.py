@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: samstats.py
+#
+# flagstat like summary of sam files
+# **********************************************************************
+"""Usage: samstats.py [-t pnum] samfile1 samfile2 ...
+       -t or --pnum int  process number used to count each file [1]
+       -h or --help      show this help message
+       report of each samfile is written to samfile name with .stats ext
+"""
+
+import os
+import sys
+import getopt
+from pyngs.biofile.sam import stats
+
+
+def show_usage():
+    print __doc__
+    exit()
+
+
+def main(argv):
+    pnum = 1
+    try:
+        optlst, args = getopt.getopt(argv, 'ht:', ['help', 'pnum'])
+        for opt, val in optlst:
+            if opt in ('-h', '--help'): # show usage
+                show_usage()
+            elif opt in ('-t', '--pnum'): # process number
+                pnum = int(val)
+    except getopt.GetoptError, e:
+        show_usage()
+
+    if not args:                        # no sam file given
+        show_usage()
+
+    for arg in args:
+        name = os.path.splitext(os.path.basename(arg))[0]
+        with open('{0}.stats'.format(name), 'w') as out:
+            for line in stats(arg, pnum=pnum).report():
+                print >>out, line
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
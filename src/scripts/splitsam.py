@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: splitsam.py
+#
+# split sam file to one file per reference or region balanced shards
+# **********************************************************************
+"""Usage: splitsam.py [opts] samfile
+       -o or --prefix  str  prefix of outputs [samfile name]
+       -n or --nshard  int  split to about nshard outputs of equal
+                            reference length instead of one output per
+                            reference, regions of each shard are written
+                            to prefix.shards.bed
+       -t or --pnum    int  process number used to read samfile [1]
+       -b or --buffer  int  lines kept in memory for each output [4096]
+       -h or --help         show this help message
+       outputs are prefix.{rname}.sam or prefix.shard{i}.sam and
+       prefix.unmapped.sam, each with the full header
+"""
+
+import os
+import sys
+import getopt
+from pyngs.biofile import sam
+from pyngs.lib import samsplit
+
+
+def show_usage():
+    print __doc__
+    exit()
+
+
+def main(argv):
+    prefix = nshard = None
+    pnum = 1
+    size = samsplit.BUFFER_SIZE
+    try:
+        optlst, args = getopt.getopt(argv, 'ho:n:t:b:', ['help', 'prefix',
+                                                         'nshard', 'pnum',
+                                                         'buffer'])
+        for opt, val in optlst:
+            if opt in ('-h', '--help'): # show usage
+                show_usage()
+            elif opt in ('-o', '--prefix'): # output prefix
+                prefix = val
+            elif opt in ('-n', '--nshard'): # region balanced shards
+                nshard = int(val)
+            elif opt in ('-t', '--pnum'): # process number
+                pnum = int(val)
+            elif opt in ('-b', '--buffer'): # lines buffered per output
+                size = int(val)
+    except getopt.GetoptError, e:
+        show_usage()
+
+    if len(args) != 1:                  # one sam file
+        show_usage()
+
+    samfile = args[0]
+    if prefix is None:
+        prefix = os.path.splitext(os.path.basename(samfile))[0]
+
+    shards = None
+    if nshard:
+        shards = samsplit.make_shards(sam.read_header(samfile), nshard)
+        with open('{0}.shards.bed'.format(prefix), 'w') as out:
+            samsplit.write_shards(out, shards)
+
+    for key, count in samsplit.split(samfile, prefix, shards=shards,
+                                     pnum=pnum, size=size).iteritems():
+        print >>sys.stderr, '{0}\t{1}'.format(
+            samsplit.out_name(prefix, key), count)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
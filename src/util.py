@@ -54,3 +54,42 @@ def show_info(info):
     """
     print >>sys.stderr, time.strftime('%Y-%m-%d %H:%M:%S'), info
 
+
+
+# **********************************************************************
+# split text file to line aligned byte ranges for parallel processing
+# **********************************************************************
+def byte_shards(fname, nshard, start=0):
+    """split fname from offset start to at most nshard [beg, end) byte
+    ranges, each boundary is moved to the start of the next line"""
+    size = os.path.getsize(fname)
+    bounds = [start]
+    with open(fname, 'rb') as handle:
+        for i in xrange(1, nshard):
+            offset = start + (size - start) * i // nshard
+            if offset <= bounds[-1]:
+                continue
+            handle.seek(offset - 1, 0)  # offset-1 is newline: line start
+            handle.readline()
+            offset = handle.tell()
+            if offset >= size:
+                break
+            if offset > bounds[-1]:
+                bounds.append(offset)
+    if size > bounds[-1]:
+        bounds.append(size)
+    return zip(bounds[:-1], bounds[1:])
+
+
+def read_range(fname, beg, end):
+    """yield lines of fname starting in byte range [beg, end), beg must be
+    the start of a line"""
+    with open(fname, 'rb') as handle:
+        handle.seek(beg, 0)
+        offset = beg
+        while offset < end:
+            line = handle.readline()
+            if not line:
+                break
+            offset += len(line)
+            yield line
@@ -0,0 +1,133 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: test_agp.py
+# **********************************************************************
+
+import imp
+import os
+import random
+import shutil
+import string
+import tempfile
+
+import pyngs
+from pyngs.biofile import agp, fasta
+
+COMPLEMENT = string.maketrans('ACGT', 'TGCA')
+
+
+def make_agp(dirname, nscaf=3, seed=1):
+    """agp file, contig sequences and scaffold sequences built from them"""
+    rng = random.Random(seed)
+    contigs, scafs = {}, {}
+    fname = os.path.join(dirname, 'test.agp')
+    with open(fname, 'w') as handle:
+        for i in xrange(nscaf):
+            scaf = 'scaf{0}'.format(i)
+            seq = []
+            for j in xrange(rng.randint(1, 6)):
+                if j:
+                    gap = rng.randint(10, 100)
+                    print >>handle, '\t'.join(map(str, [
+                        scaf, len(seq) + 1, len(seq) + gap, j * 2, 'N', gap,
+                        'scaffold', 'yes', 'paired-ends']))
+                    seq.extend('N' * gap)
+                name = 'ctg{0}_{1}'.format(i, j)
+                contig = ''.join([rng.choice('ACGT')
+                                  for k in xrange(rng.randint(200, 2000))])
+                contigs[name] = contig
+                start = rng.randint(0, 50)
+                end = len(contig) - rng.randint(0, 50)
+                part = contig[start:end]
+                strand = rng.choice('+-')
+                if strand == '-':
+                    part = part.translate(COMPLEMENT)[::-1]
+                print >>handle, '\t'.join(map(str, [
+                    scaf, len(seq) + 1, len(seq) + len(part), j * 2 + 1, 'W',
+                    name, start + 1, end, strand]))
+                seq.extend(part)
+            scafs[scaf] = ''.join(seq)
+    return fname, contigs, scafs
+
+
+def test_liftover():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname, contigs, scafs = make_agp(dirname)
+        lift = agp.Liftover(fname)
+        rng = random.Random(2)
+        for scaf, seq in scafs.iteritems():
+            positions = range(len(seq))
+            names, lifted, reverse = lift.to_contig_array(scaf, positions)
+            for pos in positions:
+                hit = lift.to_contig(scaf, pos)
+                if seq[pos] == 'N':
+                    assert hit is None and names[pos] is None
+                    assert lifted[pos] == -1
+                    continue
+                contig, cpos, strand = hit
+                base = contigs[contig][cpos]
+                if strand == '-':
+                    base = base.translate(COMPLEMENT)
+                assert base == seq[pos]
+                assert (names[pos], lifted[pos], reverse[pos]) == \
+                    (contig, cpos, strand == '-')
+                assert lift.to_scaffold(contig, cpos) == (scaf, pos, strand)
+
+        for contig, seq in contigs.iteritems():
+            for i in xrange(20):
+                start = rng.randint(0, len(seq) - 1)
+                end = min(len(seq), start + rng.randint(1, 100))
+                hit = lift.lift_interval(contig, start, end)
+                first = lift.to_scaffold(contig, start)
+                last = lift.to_scaffold(contig, end - 1)
+                if first is None or last is None:
+                    assert hit is None
+                    continue
+                scaf, sstart, send, strand = hit
+                assert sorted([first[1], last[1]]) == [sstart, send - 1]
+                part = scafs[scaf][sstart:send]
+                if strand == '-':
+                    part = part.translate(COMPLEMENT)[::-1]
+                assert part == seq[start:end]
+        assert lift.to_scaffold('nothing', 0) is None
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_write_scaffolds():
+    agp2fa = imp.load_source('agp2fa', os.path.join(
+        os.path.dirname(pyngs.__file__), 'scripts', 'agp2fa.py'))
+    dirname = tempfile.mkdtemp()
+    chunk = agp2fa.CHUNK
+    try:
+        agp2fa.CHUNK = 100              # several chunks of each contig
+        fname, contigs, scafs = make_agp(dirname, nscaf=5)
+        contigfile = os.path.join(dirname, 'contigs.fa')
+        out = fasta.FastaWriter(contigfile)
+        for name in sorted(contigs):
+            out.start(name)
+            out.write(contigs[name])
+        out.close()
+        outfile = os.path.join(dirname, 'scafs.fa')
+        out = fasta.FastaWriter(outfile, width=70)
+        agp2fa.write_scaffolds(fname, contigfile, out)
+        out.close()
+        assert [(rec.name, rec.seq) for rec in fasta.parse(outfile)] == \
+            sorted(scafs.items())
+
+        lines = open(fname).readlines()
+        with open(fname, 'a') as handle:    # scaf0 comes back at the end
+            handle.write(lines[0])
+        try:
+            agp2fa.write_scaffolds(fname, contigfile,
+                                   fasta.FastaWriter(outfile))
+        except ValueError as e:
+            assert 'scaf' in str(e)
+        else:
+            assert False
+    finally:
+        agp2fa.CHUNK = chunk
+        shutil.rmtree(dirname)
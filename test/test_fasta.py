@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: test_fasta.py
+# **********************************************************************
+
+import os
+import random
+import shutil
+import tempfile
+
+from pyngs.biofile import fasta
+
+
+def test_write_and_fetch():
+    rng = random.Random(1)
+    seqs = [('seq{0}'.format(i), ''.join([rng.choice('ACGTN') for j in
+                                          xrange(rng.randint(1, 5000))]))
+            for i in xrange(20)]
+    seqs.append(('exact', 'A' * 120))
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(dirname, 'test.fa')
+        out = fasta.FastaWriter(fname, width=60, size=1000)
+        for name, seq in seqs:
+            out.start(name)
+            pos = 0
+            while pos < len(seq):       # written in pieces of any size
+                step = rng.randint(1, 300)
+                out.write(seq[pos:pos+step])
+                pos += step
+        out.close()
+        assert [(rec.name, rec.seq) for rec in fasta.parse(fname)] == seqs
+        lengths = [len(line.rstrip('\n')) for line in open(fname)
+                   if not line.startswith('>')]
+        assert max(lengths) == 60 and min(lengths) > 0
+
+        records = fasta.IndexedFasta(fname)
+        assert records.names == [name for name, seq in seqs]
+        for name, seq in seqs:
+            assert records.length(name) == len(seq)
+            assert records.fetch(name) == seq
+            for i in xrange(20):
+                start = rng.randint(0, len(seq))
+                end = start + rng.randint(0, 200)
+                assert records.fetch(name, start, end) == seq[start:end]
+            assert ''.join(records.fetch_chunks(name, 7, None, 100)) == \
+                seq[7:]
+        records.close()
+    finally:
+        shutil.rmtree(dirname)
@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: test_gene.py
+# **********************************************************************
+
+import os
+import random
+import shutil
+import tempfile
+
+from pyngs.biofile import ann, refgene
+from pyngs.lib import annotate, libgene
+
+
+def make_refgene(dirname, n=1000, seed=1):
+    """refGene table with dense loci and long genes sorting first and last
+    on each chrom"""
+    rng = random.Random(seed)
+    loci = [rng.randint(0, 2000000) for i in xrange(20)]
+    rows = []
+    for i in xrange(n):
+        chrom = rng.choice(['chr1', 'chr2'])
+        strand = rng.choice('+-')
+        if i < 4:                       # long genes, first and last
+            chrom, gap = ('chr1', 'chr2')[i % 2], 2000000
+            txstart = 1000 if i < 2 else 2010000
+        else:
+            txstart = rng.choice(loci) + rng.randint(0, 5000)
+            gap = rng.randint(50, 3000)
+        starts, ends = [], []
+        pos = txstart
+        for j in xrange(rng.randint(1, 6)):
+            start = pos + (gap if j else 0)
+            starts.append(start)
+            ends.append(start + rng.randint(30, 400))
+            pos = ends[-1]
+        cds = rng.randint(txstart, pos - 1)
+        rows.append((chrom, txstart, [
+            0, 'NM_{0}'.format(i), chrom, strand, txstart, pos, cds,
+            rng.randint(cds + 1, pos), len(starts),
+            ''.join(['{0},'.format(x) for x in starts]),
+            ''.join(['{0},'.format(x) for x in ends]), 0, 'G{0}'.format(i),
+            'cmpl', 'cmpl', '0,' * len(starts)]))
+    rows.sort(key=lambda row: row[:2])
+    fname = os.path.join(dirname, 'refGene.txt')
+    with open(fname, 'w') as handle:
+        for chrom, txstart, row in rows:
+            print >>handle, '\t'.join(map(str, row))
+    return fname
+
+
+def naive_nearest(genes, pos):
+    best, hits = None, []
+    for gene in genes:
+        if gene.start <= pos < gene.end:
+            dist = 0
+        elif gene.end <= pos:
+            dist = pos - gene.end + 1
+        else:
+            dist = gene.start - pos
+        if best is None or dist < best:
+            best, hits = dist, [gene]
+        elif dist == best:
+            hits.append(gene)
+    return None if best is None else (best, sorted(map(repr, hits)))
+
+
+def check_index(index, genes):
+    rng = random.Random(2)
+    assert max([gene.end - gene.start for gene in genes]) > 1000000
+    for i in xrange(300):
+        chrom = rng.choice(['chr1', 'chr2'])
+        strand = rng.choice([None, '+', '-'])
+        start = rng.randint(0, 4100000)
+        end = start + rng.choice([1, 100, 10000])
+        candidates = [gene for gene in genes if gene.chrom == chrom and
+                      (strand is None or gene.strand == strand)]
+        expect = [gene for gene in candidates
+                  if gene.start < end and gene.end > start]
+        got = index.overlap(chrom, start, end, strand)
+        assert sorted(map(repr, got)) == sorted(map(repr, expect))
+        nearest = index.nearest(chrom, start, strand)
+        assert (nearest[0], sorted(map(repr, nearest[1]))) == \
+            naive_nearest(candidates, start)
+    assert index.overlap('chr9', 0, 100) == []
+
+
+def test_gene_index():
+    dirname = tempfile.mkdtemp()
+    try:
+        for n in range(10, 400, 7) + [1000]:
+            fname = make_refgene(dirname, n)
+            genes = list(refgene.parse(fname))
+            check_index(refgene.parse_gene_list(fname), genes)
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_cache():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_refgene(dirname)
+        mtime = int(os.stat(fname).st_mtime)  # exact when set again
+        os.utime(fname, (mtime, mtime))
+        cachefile = fname + libgene.CACHE_EXT
+        genes = list(refgene.parse(fname))
+        expect = [repr(gene) for gene in genes]
+        # the cache can not be written: genes are still parsed
+        tmpfile = '{0}.{1}.tmp'.format(cachefile, os.getpid())
+        os.mkdir(tmpfile)
+        assert [repr(gene) for gene in refgene.parse(fname, cache=True)] == \
+            expect
+        assert not os.path.exists(cachefile)
+        os.rmdir(tmpfile)
+
+        assert [repr(gene) for gene in refgene.parse(fname, cache=True)] == \
+            expect
+        assert os.path.exists(cachefile)
+        models = libgene.load_cache(cachefile)
+        assert isinstance(models, libgene.GeneModels)
+        assert [repr(gene) for gene in models] == expect
+        assert [[repr(exon) for exon in gene.fullexons] for gene in models] \
+            == [[repr(exon) for exon in gene.fullexons] for gene in genes]
+        check_index(refgene.parse_gene_list(fname, cache=True), genes)
+
+        os.utime(fname, (mtime, mtime + 0.5))   # changed source: stale
+        assert libgene.load_cache(cachefile,
+                                  libgene._source_stat(fname)) is None
+        os.utime(fname, (mtime, mtime))
+        assert libgene.load_cache(cachefile,
+                                  libgene._source_stat(fname)) is not None
+        # same size and mtime, edited head or tail
+        data = open(fname).read()
+        for edited in ('#' + data[1:], data[:-2] + '\t\n'):
+            with open(fname, 'w') as handle:
+                handle.write(edited)
+            os.utime(fname, (mtime, mtime))
+            assert libgene.load_cache(cachefile,
+                                      libgene._source_stat(fname)) is None
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_sweep():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_refgene(dirname)
+        genes = list(refgene.parse(fname))
+        index = refgene.parse_gene_list(fname)
+        rng = random.Random(3)
+        anns, found = [], set()
+        for chrom in ('chr1', 'chr2'):
+            for pos in sorted([rng.randint(0, 4100000)
+                               for i in xrange(300)]):
+                anns.append(ann.Ann('', chrom, pos + 1, 'A', 'C', 1, 1, 0,
+                                    -1, 0, '-', '-'))
+        for record, hits in annotate.sweep(anns, genes):
+            expect = [gene for gene in genes if gene.chrom == record.chrom
+                      and gene.start <= record.pos < gene.end]
+            assert sorted(map(repr, index.overlap(
+                record.chrom, record.pos, record.pos + 1))) == \
+                sorted(map(repr, expect))
+            assert sorted([repr(hit[0]) for hit in hits]) == \
+                sorted(map(repr, expect))
+            classes = [annotate.CLASS_ORDER[hit[2]] for hit in hits]
+            assert classes == sorted(classes)
+            for gene, exon, cls in hits:
+                found.add(repr(gene))
+                inside = [item for item in gene.fullexons
+                          if item.start <= record.pos < item.end]
+                assert exon == (inside[0].name if inside else
+                                annotate.INTRON)
+        for record in annotate.annotate(anns, genes):
+            if record.exon == annotate.INTERGENIC:
+                assert record.gene == '-'
+        long_genes = [repr(gene) for gene in genes
+                      if gene.genelength > 1000000]
+        assert len(long_genes) == 4 and found.issuperset(long_genes)
+        try:
+            list(annotate.sweep(anns[::-1], genes))
+        except ValueError:
+            pass
+        else:
+            assert False
+    finally:
+        shutil.rmtree(dirname)
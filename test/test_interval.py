@@ -0,0 +1,113 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: test_interval.py
+# **********************************************************************
+
+import random
+
+from pyngs.lib.libinterval import IntervalIndex, GenomeIndex
+
+
+def naive_nearest(items, start, end):
+    hits = [item for item in items if item[0] < end and item[1] > start]
+    if hits:
+        return 0, sorted(hits)
+    best, hits = None, []
+    for item in items:
+        dist = start - item[1] + 1 if item[1] <= start else item[0] - end + 1
+        if best is None or dist < best:
+            best, hits = dist, [item]
+        elif dist == best:
+            hits.append(item)
+    return None if best is None else (best, sorted(hits))
+
+
+def make_items(rng, n, long_interval):
+    items = []
+    for i in xrange(n):
+        start = rng.randint(0, 100000)
+        items.append((start, start + rng.choice([1, 10, 100, 1000]), i))
+    if long_interval:
+        items.append((rng.randint(0, 1000), 10000000, -1))
+    return items
+
+
+def test_overlap():
+    rng = random.Random(1)
+    for n in (0, 1, 2, 7, 15, 16, 17, 100, 1000, 5000):
+        for long_interval in (False, True):
+            items = make_items(rng, n, long_interval)
+            index = IntervalIndex(items)
+            for i in xrange(200):
+                start = rng.randint(-100, 110000)
+                end = start + rng.choice([1, 10, 1000])
+                expect = [item for item in items
+                          if item[0] < end and item[1] > start]
+                got = list(index.overlap(start, end))
+                assert sorted(got) == sorted(expect)
+                assert [item[0] for item in got] == sorted([item[0]
+                                                            for item in got])
+                assert index.count(start, end) == len(expect)
+                nearest = index.nearest(start, end)
+                if nearest is not None:
+                    nearest = (nearest[0], sorted(nearest[1]))
+                assert nearest == naive_nearest(items, start, end)
+
+
+def test_long_interval_last():
+    # the long interval sorts last, so the max end must reach the nodes
+    # whose right subtree runs past the size of the arrays
+    rng = random.Random(2)
+    for n in xrange(1, 300):
+        items = [(i * 10, i * 10 + 5, i) for i in xrange(n - 1)]
+        items.append((n * 10, 1000000, 'long'))
+        index = IntervalIndex(items)
+        assert list(index.overlap(500000, 500001)) == [items[-1]]
+        for i in xrange(20):
+            start = rng.randint(-10, n * 10 + 20)
+            end = start + rng.choice([1, 10, 100])
+            expect = [item for item in items
+                      if item[0] < end and item[1] > start]
+            assert list(index.overlap(start, end)) == expect
+            nearest = index.nearest(start, end)
+            assert (nearest[0], sorted(nearest[1])) == \
+                naive_nearest(items, start, end)
+
+
+def test_random_long_intervals():
+    rng = random.Random(3)
+    for n in (10, 42, 74, 82, 100, 500, 1023, 1025):
+        items = []
+        for i in xrange(n):
+            start = rng.randint(0, 100000)
+            items.append((start, start + rng.choice([1, 10, 100, 1000,
+                                                     200000]), i))
+        index = IntervalIndex(items)
+        for i in xrange(200):
+            start = rng.randint(-100, 310000)
+            end = start + rng.choice([1, 10, 1000])
+            expect = [item for item in items
+                      if item[0] < end and item[1] > start]
+            assert sorted(index.overlap(start, end)) == sorted(expect)
+
+
+def test_add_after_query():
+    index = IntervalIndex()
+    index.add(100, 200, 'a')
+    assert list(index.overlap(150, 160)) == [(100, 200, 'a')]
+    index.add(0, 1000000, 'long')
+    index.add(150, 151, 'b')
+    assert [item[2] for item in index.overlap(150, 151)] == ['long', 'a', 'b']
+    assert index.nearest(2000000) == (1000001, [(0, 1000000, 'long')])
+
+
+def test_genome_index():
+    index = GenomeIndex()
+    index.add('chr1', 10, 20, 'a')
+    index.add('chr2', 10, 20, 'b')
+    assert list(index.overlap('chr1', 0, 100)) == [(10, 20, 'a')]
+    assert list(index.overlap('chr3', 0, 100)) == []
+    assert index.nearest('chr2', 30) == (11, [(10, 20, 'b')])
+    assert index.names() == ['chr1', 'chr2'] and len(index) == 2
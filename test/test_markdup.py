@@ -0,0 +1,133 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: test_markdup.py
+# **********************************************************************
+
+import os
+import random
+import shutil
+import tempfile
+
+from pyngs.biofile import sam
+from pyngs.lib import markdup
+
+
+HEADER = ['@HD\tVN:1.0\tSO:coordinate',
+          '@SQ\tSN:chr1\tLN:100000']
+
+CIGARS = ['50M', '5S45M', '45M5S', '20M2D30M']
+
+
+def make_sam(dirname, npair=300, nfrag=200, seed=1, norphan=0):
+    rng = random.Random(seed)
+    starts = [rng.randint(1, 5000) for i in xrange(npair // 3)]
+    reads = []
+    for i in xrange(npair):
+        pos1 = rng.choice(starts)
+        pos2 = pos1 + rng.choice([200, 300])
+        qname = 'p{0}'.format(i)
+        for mate, pos, mpos, flag in ((1, pos1, pos2, 0x63),
+                                      (2, pos2, pos1, 0x93)):
+            reads.append((pos, qname, flag, mpos))
+    for i in xrange(nfrag):
+        reads.append((rng.choice(starts), 'f{0}'.format(i),
+                      rng.choice([0, 16]), 0))
+    for i in xrange(norphan):           # mate mapped but not in the file
+        pos = rng.choice(starts) + 20000
+        reads.append((pos, 'o{0}'.format(i), 0x63, pos + 200))
+    reads.sort(key=lambda read: read[0])
+    fname = os.path.join(dirname, 'dup.sam')
+    with open(fname, 'w') as handle:
+        for line in HEADER:
+            print >>handle, line
+        for pos, qname, flag, mpos in reads:
+            qual = ''.join([rng.choice('#5I') for i in xrange(50)])
+            print >>handle, '\t'.join(map(str, (
+                qname, flag, 'chr1', pos, 60, rng.choice(CIGARS),
+                '=' if mpos else '*', mpos, 0, 'A' * 50, qual)))
+    return fname
+
+
+def naive_dups(fname):
+    """duplicate qnames by grouping all reads at once"""
+    mates, pairs, frags = {}, {}, {}
+    for i, rec in enumerate(sam.parse(fname)):
+        reverse = 1 if rec.flag & sam.MASK_REVERSE else 0
+        end = (markdup._five_prime(rec.pos, rec.cigar, reverse), reverse)
+        score = markdup._score(rec.qual)
+        if rec.flag & sam.MASK_MULTI_FRAG:
+            if rec.qname not in mates:
+                mates[rec.qname] = (end, score)
+                continue
+            mate_end, mate_score = mates[rec.qname]
+            key = tuple(sorted([mate_end, end]))
+            pairs.setdefault(key, []).append((score + mate_score, i,
+                                              rec.qname))
+        else:
+            frags.setdefault(end, []).append((score, i, rec.qname))
+    pair_ends = set()
+    for key in pairs:
+        pair_ends.update(key)
+    dups = set()
+    for groups, is_pair in ((pairs, True), (frags, False)):
+        for key, group in groups.iteritems():
+            best = max(group, key=lambda item: (item[0], -item[1]))
+            for item in group:
+                if item is not best or (not is_pair and key in pair_ends):
+                    dups.add(item[2])
+    return dups
+
+
+def test_markdup():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_sam(dirname)
+        outfile = os.path.join(dirname, 'out.sam')
+        npair, npairdup, nfrag, nfragdup = markdup.markdup(fname, outfile)
+        assert (npair, nfrag) == (300, 200)
+        expect = naive_dups(fname)
+        assert npairdup + nfragdup == len(expect)
+        records = list(sam.parse(outfile))
+        assert len(records) == 800
+        got = set([rec.qname for rec in records
+                   if rec.flag & sam.MASK_DUPLICATE])
+        assert got == expect
+
+        markdup.markdup(fname, outfile, remove=True)
+        kept = [rec.qname for rec in sam.parse(outfile)]
+        assert len(kept) == 800 - npairdup * 2 - nfragdup
+        assert not expect & set(kept)
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_orphans():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_sam(dirname, npair=30, nfrag=20, norphan=40)
+        outfile = os.path.join(dirname, 'out.sam')
+        npair, npairdup, nfrag, nfragdup = markdup.markdup(fname, outfile)
+        assert (npair, nfrag) == (30, 60)
+        orphans = [rec for rec in sam.parse(outfile)
+                   if rec.qname.startswith('o')]
+        ndup = len([rec for rec in orphans
+                    if rec.flag & sam.MASK_DUPLICATE])
+        # grouped as fragments, one kept at each 5' end
+        ends = set([markdup._five_prime(rec.pos, rec.cigar, 0)
+                    for rec in orphans])
+        assert len(orphans) == 40 and ndup == 40 - len(ends)
+        assert nfragdup >= ndup > 0
+
+        lines = open(fname).read().replace('\tchr1\t', '\tchr9\t', 1)
+        with open(fname, 'w') as handle:
+            handle.write(lines)
+        try:
+            markdup.markdup(fname, outfile)
+        except ValueError as e:
+            assert 'chr9' in str(e)
+        else:
+            assert False
+    finally:
+        shutil.rmtree(dirname)
@@ -0,0 +1,139 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: test_psl.py
+# **********************************************************************
+
+import os
+import pickle
+import random
+import shutil
+import tempfile
+
+from pyngs.biofile import psl
+
+
+TSIZES = {'chr1': 3000000, 'chr2': 500000}
+
+
+def make_psl(dirname, n=500, seed=1, sort=True, name='test.psl'):
+    rng = random.Random(seed)
+    rows = []
+    for i in xrange(n):
+        qname = 'q{0}'.format(rng.randint(0, n // 3))
+        tname = rng.choice(sorted(TSIZES))
+        sizes = [rng.randint(20, 200) for j in xrange(rng.randint(1, 5))]
+        qstarts, tstarts = [], []
+        qpos, tpos = rng.randint(0, 50), rng.randint(0, TSIZES[tname] - 20000)
+        for size in sizes:
+            qstarts.append(qpos)
+            tstarts.append(tpos)
+            qpos += size + rng.choice([0, 0, 3])
+            tpos += size + rng.randint(0, 2000)
+        match = sum(sizes)
+        mismatch = rng.randint(0, match // 10)
+        rows.append([match - mismatch, mismatch, 0, 0, 0, 0, len(sizes) - 1,
+                     0, rng.choice('+-'), qname, qpos + 50, qstarts[0],
+                     qstarts[-1] + sizes[-1], tname, TSIZES[tname],
+                     tstarts[0], tstarts[-1] + sizes[-1], len(sizes),
+                     ''.join(['{0},'.format(x) for x in sizes]),
+                     ''.join(['{0},'.format(x) for x in qstarts]),
+                     ''.join(['{0},'.format(x) for x in tstarts])])
+    if sort:
+        rows.sort(key=lambda row: row[9])
+    fname = os.path.join(dirname, name)
+    with open(fname, 'w') as handle:
+        for row in rows:
+            print >>handle, '\t'.join(map(str, row))
+    return fname
+
+
+def test_cache():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_psl(dirname)
+        expect = [repr(item) for item in psl.parse(fname)]
+        assert len(expect) == 500
+        # the cache can not be written: parse without it
+        tmpfile = '{0}{1}.{2}.tmp'.format(fname, psl.CACHE_EXT, os.getpid())
+        os.mkdir(tmpfile)
+        assert [repr(item) for item in psl.parse(fname, cache=True)] == expect
+        assert not os.path.exists(fname + psl.CACHE_EXT)
+        os.rmdir(tmpfile)
+
+        assert [repr(item) for item in psl.parse(fname, cache=True)] == expect
+        assert os.path.exists(fname + psl.CACHE_EXT)
+        assert [repr(item) for item in psl.parse(fname, cache=True)] == expect
+        assert [item.tblocks for item in psl.parse(fname, cache=True)] == \
+            [item.tblocks for item in psl.parse(fname)]
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_truncated_cache():
+    dirname = tempfile.mkdtemp()
+    chunk = psl.CACHE_CHUNK
+    try:
+        psl.CACHE_CHUNK = 64
+        fname = make_psl(dirname)
+        cachefile = fname + psl.CACHE_EXT
+        expect = [repr(item) for item in psl.parse(fname)]
+        list(psl.parse(fname, cache=True))
+        data = open(cachefile, 'rb').read()
+        for size in (len(data) - 1, len(data) * 2 // 3, len(data) // 3):
+            with open(cachefile, 'wb') as handle:
+                handle.write(data[:size])
+            assert [repr(item) for item in psl.parse(fname, cache=True)] \
+                == expect
+            assert open(cachefile, 'rb').read() == data   # rebuilt
+    finally:
+        psl.CACHE_CHUNK = chunk
+        shutil.rmtree(dirname)
+
+
+def test_pickle():
+    dirname = tempfile.mkdtemp()
+    try:
+        items = list(psl.parse(make_psl(dirname)))[:20]
+        for protocol in (0, 1, 2):
+            loaded = pickle.loads(pickle.dumps(items, protocol))
+            assert map(repr, loaded) == map(repr, items)
+            assert [item.tblocks for item in loaded] == \
+                [item.tblocks for item in items]
+    finally:
+        shutil.rmtree(dirname)
+
+
+def naive_best(psls, near):
+    groups = {}
+    for item in psls:
+        groups.setdefault(item.qname, []).append(item)
+    best = []
+    for group in groups.itervalues():
+        top = max([item.score for item in group])
+        best.extend([item for item in group
+                     if item.score >= top - abs(top) * near])
+    return sorted(map(repr, best))
+
+
+def test_best_hits():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_psl(dirname)
+        expect = naive_best(psl.parse(fname), 0.05)
+        got = sorted(map(repr, psl.best_hits(fname, near=0.05)))
+        assert got == expect
+        unsorted = make_psl(dirname, sort=False, name='unsorted.psl')
+        got = sorted(map(repr, psl.best_hits(unsorted, near=0.05,
+                                             grouped=False, maxhits=50,
+                                             npart=4, tmpdir=dirname)))
+        assert got == expect
+        try:
+            list(psl.best_hits(unsorted))
+        except ValueError:
+            pass
+        else:
+            assert False, 'ungrouped input not rejected'
+    finally:
+        shutil.rmtree(dirname)
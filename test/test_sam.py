@@ -0,0 +1,284 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: test_sam.py
+# **********************************************************************
+
+import os
+import random
+import shutil
+import tempfile
+
+from pyngs.biofile import sam
+from pyngs.lib import coverage, pileup, samsplit
+
+
+HEADER = ['@HD\tVN:1.0\tSO:coordinate',
+          '@SQ\tSN:chr1\tLN:200000',
+          '@SQ\tSN:chr2\tLN:50000']
+
+CIGARS = ['50M', '20M500N30M', '5S45M', '20M2I28M', '25M3D25M']
+
+
+def make_sam(dirname, n=500, seed=1):
+    random.seed(seed)
+    lines = []
+    for rid, (rname, length) in enumerate((('chr1', 200000),
+                                           ('chr2', 50000))):
+        for i in xrange(n):
+            pos = random.randint(1, length - 1000)
+            lines.append((rid, pos, '\t'.join(map(str, (
+                'r{0}.{1}'.format(rid, i), 0, rname, pos, 60,
+                random.choice(CIGARS), '*', 0, 0, 'A' * 50, 'I' * 50,
+                'NM:i:{0}'.format(random.randint(0, 5)))))))
+    lines.sort()
+    fname = os.path.join(dirname, 'test.sam')
+    with open(fname, 'w') as handle:
+        for line in HEADER:
+            print >>handle, line
+        for rid, pos, line in lines:
+            print >>handle, line
+    return fname
+
+
+def test_fetch():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_sam(dirname)
+        sam.index(fname)
+        records = list(sam.parse(fname))
+        samfile = sam.read(fname)
+        for rname, start, end in (('chr1', 0, 1), ('chr1', 1000, 1500),
+                                  ('chr1', 50000, 120000), ('chr2', 0, None),
+                                  ('chr3', 0, 100)):
+            expect = [repr(rec) for rec in records if rec.rname == rname and
+                      (end is None or rec.pos < end) and rec.aend > start]
+            got = [repr(rec) for rec in samfile.fetch(rname, start, end)]
+            assert got == expect
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_sort():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_sam(dirname)
+        lines = [line for line in open(fname) if not line.startswith('@')]
+        random.shuffle(lines)
+        shuffled = os.path.join(dirname, 'shuffled.sam')
+        with open(shuffled, 'w') as handle:
+            for line in HEADER[1:]:
+                print >>handle, line
+            handle.writelines(lines)
+
+        outfile = os.path.join(dirname, 'sorted.sam')
+        sam.sort(shuffled, outfile, memory=4096, maxopen=4)
+        assert sam.read(outfile).header[0].endswith('SO:coordinate')
+        records = list(sam.parse(outfile))
+        assert sorted(map(repr, records)) == sorted(map(repr, sam.parse(fname)))
+        coords = [(rec.rname, rec.pos) for rec in records]
+        assert coords == sorted(coords)
+
+        sam.sort(fname, outfile, by=sam.SORT_QUERYNAME, memory=4096)
+        names = [rec.qname for rec in sam.parse(outfile)]
+        assert names == sorted(names)
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_fetch_long_reference():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(dirname, 'long.sam')
+        with open(fname, 'w') as handle:
+            print >>handle, '@SQ\tSN:chr1\tLN:800000000'
+            for i, pos in enumerate((100, 300000000, 536870000, 600000000,
+                                     700000000)):
+                print >>handle, '\t'.join(map(str, (
+                    'r{0}'.format(i), 0, 'chr1', pos, 60, '50M', '*', 0, 0,
+                    'A' * 50, 'I' * 50)))
+        sam.index(fname)
+        samfile = sam.read(fname)
+        names = lambda *region: [rec.qname for rec in samfile.fetch(*region)]
+        assert names('chr1') == ['r0', 'r1', 'r2', 'r3', 'r4']
+        assert names('chr1', 550000000, 800000000) == ['r3', 'r4']
+        assert names('chr1', 536870000, 536870001) == ['r2']
+        assert names('chr1', 0, 1000) == ['r0']
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_pair_lines():
+    rng = random.Random(2)
+    lines = []
+    for i in xrange(1000):
+        for mask in (sam.MASK_READ1, sam.MASK_READ2):
+            lines.append('\t'.join(map(str, [
+                'r{0}'.format(i), sam.MASK_MULTI_FRAG | mask, 'chr1',
+                rng.randint(1, 10000), 60, '50M', '=', 1, 0, 'A' * 50,
+                'I' * 50])))
+    lines.append('\t'.join(['single', str(sam.MASK_MULTI_FRAG), 'chr1', '1',
+                            '60', '50M', '=', '1', '0', 'A', 'I']))
+    rng.shuffle(lines)
+    for maxreads in (1000000, 50):
+        orphans = []
+        pairs = list(sam.pair_lines(lines, maxreads=maxreads, npart=4,
+                                    orphan=orphans.append))
+        assert len(pairs) == 1000
+        assert sorted([line1.split('\t')[0] for line1, line2 in pairs]) == \
+            sorted(['r{0}'.format(i) for i in xrange(1000)])
+        for line1, line2 in pairs:
+            read1, read2 = sam._parse_line(line1), sam._parse_line(line2)
+            assert read1.qname == read2.qname
+            assert read1.flag & sam.MASK_READ1 and read2.flag & sam.MASK_READ2
+        assert [line.split('\t')[0] for line in orphans] == ['single']
+
+
+def naive_depth(records, ops):
+    """{(rname, pos): number of reads with a cigar op of ops there}"""
+    depth = {}
+    for rec in records:
+        pos = rec.pos
+        for length, op in sam.RE_CIGAR_OP.findall(rec.cigar):
+            length = int(length)
+            if op in 'MDN=X':
+                if op in ops:
+                    for i in xrange(pos, pos + length):
+                        key = (rec.rname, i)
+                        depth[key] = depth.get(key, 0) + 1
+                pos += length
+    return depth
+
+
+def test_pileup():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_sam(dirname)
+        expect = naive_depth(sam.parse(fname), 'MD')
+        columns = list(pileup.pileup_file(fname))
+        assert dict([((col.rname, col.pos), col.depth)
+                     for col in columns]) == expect
+        coords = [(col.rname, col.pos) for col in columns]
+        assert coords == sorted(coords)
+
+        sam.index(fname)
+        region = [(col.rname, col.pos, col.depth)
+                  for col in pileup.pileup_file(fname, 'chr1', 5000, 9000)]
+        assert region == [(rname, pos, depth) for rname, pos, depth in
+                          [(col.rname, col.pos, col.depth) for col in columns]
+                          if rname == 'chr1' and 5000 <= pos < 9000]
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_coverage_depth():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_sam(dirname)
+        expect = naive_depth(sam.parse(fname), 'M')
+        lengths = {'chr1': 200000, 'chr2': 50000}
+        got = {}
+        for rname, depth in coverage.iter_depth(fname):
+            assert len(depth) == lengths[rname]
+            for pos in depth.nonzero()[0].tolist():
+                got[(rname, pos)] = int(depth[pos])
+        assert got == expect
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_stats():
+    rng = random.Random(3)
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(dirname, 'flags.sam')
+        flags = []
+        with open(fname, 'w') as handle:
+            for line in HEADER:
+                print >>handle, line
+            for i in xrange(3000):
+                flag = rng.choice([0, 4, 16, 256, 1024, 2048, 0x63, 0x93,
+                                   0x69, 0x99])
+                flags.append(flag)
+                print >>handle, '\t'.join(map(str, [
+                    'r{0}'.format(i), flag, rng.choice(['chr1', 'chr2']),
+                    rng.randint(1, 1000), rng.randint(0, 60),
+                    rng.choice(CIGARS), rng.choice(['=', 'chr2']), 1,
+                    rng.randint(-500, 500), 'A' * 50, 'I' * 50,
+                    'NM:i:{0}'.format(rng.randint(0, 3))]))
+        serial = sam.stats(fname)
+        parallel = sam.stats(fname, pnum=3)
+        for name in sam.SamStats.COUNTERS:
+            assert getattr(serial, name) == getattr(parallel, name)
+        assert serial.nm == parallel.nm and serial.tlen == parallel.tlen
+        assert serial.total == 3000
+        assert serial.mapped == sum([1 for flag in flags
+                                     if not flag & sam.MASK_UNMAPPED])
+        assert serial.secondary == flags.count(256)
+        assert serial.duplicate == flags.count(1024)
+        assert serial.paired == sum([1 for flag in flags
+                                     if flag & sam.MASK_MULTI_FRAG])
+        assert sum(serial.nm.values()) == sum(serial.mapq.values())
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_batches():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_sam(dirname)
+        records = list(sam.parse(fname))
+        batches = list(sam.parse_batches(fname, size=300, tags=('NM', 'XT')))
+        assert [len(batch) for batch in batches] == [300, 300, 300, 100]
+        rows = []
+        for batch in batches:
+            for i in xrange(len(batch)):
+                rows.append((batch.flag[i], batch.rid[i], batch.pos[i],
+                             batch.mapq[i], batch.clipped[i],
+                             batch.NM[i], batch.XT[i]))
+        refs = {'chr1': 0, 'chr2': 1}
+        lines = [line for line in open(fname) if not line.startswith('@')]
+        assert rows == [(rec.flag, refs[rec.rname], rec.pos, rec.mapq,
+                         'S' in rec.cigar, int(line.split('NM:i:')[1]),
+                         sam.MISSING)
+                        for rec, line in zip(records, lines)]
+        batch = batches[0]
+        keep = batch.has(sam.MASK_REVERSE) | (batch.pos > 100000)
+        assert batch.select(keep) == [line for line in batch.lines
+                                      if int(line.split('\t')[3]) > 100001]
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_split():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_sam(dirname)
+        lines = [line for line in open(fname) if not line.startswith('@')]
+        shards = samsplit.make_shards(HEADER, 3)
+        assert len(shards) == 3
+        for pnum in (1, 3):
+            prefix = os.path.join(dirname, 'part{0}'.format(pnum))
+            counts = samsplit.split(fname, prefix, shards, pnum=pnum, size=50)
+            assert sum(counts.values()) == len(lines)
+            got = []
+            for key, count in counts.iteritems():
+                outfile = samsplit.out_name(prefix, key)
+                assert sam.read_header(outfile) == HEADER
+                part = [line for line in open(outfile)
+                        if not line.startswith('@')]
+                assert len(part) == count
+                for line in part:
+                    items = line.split('\t')
+                    pos = int(items[3]) - 1
+                    assert [1 for rname, start, end in shards[key]
+                            if rname == items[2] and start <= pos < end]
+                got.extend(part)
+            assert got == lines         # shards are in file order
+
+            counts = samsplit.split(fname, prefix, pnum=pnum)
+            assert counts.keys() == ['chr1', 'chr2']
+            assert counts['chr1'] == 500
+    finally:
+        shutil.rmtree(dirname)
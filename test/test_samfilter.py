@@ -0,0 +1,109 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: test_samfilter.py
+# **********************************************************************
+
+import random
+
+from pyngs.biofile import sam
+from pyngs.lib import samfilter
+
+
+REFS = {'chr1': 0, 'chr2': 1}
+
+TAGS = [[], ['NM:i:0'], ['NM:i:5'], ['NM:i:1', 'XT:A:U', 'X0:i:1'],
+        ['XT:A:N', 'X0:i:1'], ['XT:A:M'], ['X0:i:1', 'X1:i:1'],
+        ['X1:i:3'], ['X0:i:2', 'NM:i:3']]
+
+
+def make_line(i, mate, rng):
+    flag = sam.MASK_MULTI_FRAG | (sam.MASK_READ1 if mate == 1
+                                  else sam.MASK_READ2)
+    if rng.random() < 0.05:
+        flag |= sam.MASK_UNMAPPED
+    return '\t'.join(map(str, [
+        'r{0}'.format(i), flag, rng.choice(['chr1'] * 9 + ['chr2']),
+        rng.randint(1, 1000), rng.choice([0, 30, 60, 60, 60, 60]),
+        rng.choice(['50M'] * 5 + ['5S45M']), '=', 1, 0, 'A' * 50, 'I' * 50] +
+        rng.choice(TAGS)))
+
+
+def test_tagless_pairs():
+    router = samfilter.pair_router(nm=2)
+    lines = []
+    for nm in (None, None, None, 5):
+        for mate in (1, 2):
+            line = '\t'.join(['r', str(sam.MASK_MULTI_FRAG), 'chr1', '100',
+                              '60', '50M', '=', '100', '0', 'A' * 50,
+                              'I' * 50])
+            if nm is not None:
+                line += '\tNM:i:{0}'.format(nm)
+            lines.append(line)
+    names = [router.route_pair(lines[i], lines[i+1])
+             for i in xrange(0, len(lines), 2)]
+    assert names == ['good', 'good', 'good', 'nm2']
+
+
+def test_route_same_as_batch():
+    rng = random.Random(1)
+    router = samfilter.pair_router(nm=2)
+    lines = [make_line(i // 2, i % 2 + 1, rng) for i in xrange(2000)]
+    batch = sam.SamBatch(lines, dict(REFS), tags=('NM', 'XT', 'X0', 'X1'))
+    marks = router.route_batch(batch)
+    names = router.names
+    for i in xrange(0, len(lines), 2):
+        assert router.route_pair(lines[i], lines[i+1]) == names[marks[i//2]]
+
+    router = samfilter.Router([('low', 'mapq < 20 or NM > 2'),
+                               ('rev', 'reverse or XT == MISSING')])
+    for line, mark in zip(lines, router.route_batch(batch)):
+        assert router.route(line) == router.names[mark]
+
+
+def test_batch_references():
+    rng = random.Random(2)
+    lines = []
+    for i in xrange(500):
+        items = make_line(i // 2, i % 2 + 1, rng).split('\t')
+        items[2] = rng.choice(['chr1', 'chr2', 'chr3', '*'])
+        items[6] = rng.choice(['chr1', 'chr2', '*'])
+        lines.append('\t'.join(items))
+    batch = sam.SamBatch(lines, dict(REFS), tags=('NM', 'XT'))
+    router = samfilter.Router([('one', "rname == '1'"),
+                               ('two', "'chr2' == rname != rnext"),
+                               ('mate', "rnext in ('chr1', '*')"),
+                               ('x', "rname != 'chrX' and XT == 'U'")])
+    marks = router.route_batch(batch)
+    assert [router.route(line) for line in lines] == \
+        [router.names[mark] for mark in marks]
+    assert set(marks) == set([1, 2, 3, 4])   # no reference is named 1
+
+    router = samfilter.Router([('cross', "r1.rname == 'chr3' != r2.rname")],
+                              pair=True)
+    marks = router.route_batch(batch)
+    assert [router.route_pair(lines[i], lines[i+1])
+            for i in xrange(0, len(lines), 2)] == \
+        [router.names[mark] for mark in marks]
+
+    try:
+        samfilter.Router([('same', "rnext == '='")]).route_batch(batch)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_batch_pairs_adjacent():
+    rng = random.Random(3)
+    router = samfilter.pair_router(nm=2)
+    lines = [make_line(i // 2, i % 2 + 1, rng) for i in xrange(10)]
+    for rows in (lines[1:], lines[1:-1]):
+        try:
+            router.route_batch(sam.SamBatch(rows, dict(REFS),
+                                            tags=('NM', 'XT', 'X0', 'X1')))
+        except ValueError:
+            pass
+        else:
+            assert False
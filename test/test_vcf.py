@@ -0,0 +1,316 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+# **********************************************************************
+# file: test_vcf.py
+# **********************************************************************
+
+import gzip
+import itertools
+import os
+import random
+import shutil
+import tempfile
+
+from pyngs.biofile import bgzf, vcf
+
+
+def make_record(ref, alt, calls, format_='GT:PL'):
+    line = '\t'.join(['chrX', '100', '.', ref, alt, '50', 'PASS', '.',
+                      format_] + calls)
+    samples = ['s{0}'.format(i) for i in xrange(len(calls))]
+    return vcf.parse_vcfrecord(line, samples)
+
+
+def test_genotype_order():
+    for ploidy in (1, 2, 3, 4):
+        genotypes = sorted(itertools.combinations_with_replacement(
+            range(4), ploidy), key=lambda alleles: alleles[::-1])
+        for index, alleles in enumerate(genotypes):
+            assert vcf.genotype_alleles(index, ploidy) == alleles
+            if ploidy == 2:
+                assert vcf.genotype_index(*alleles) == index
+
+
+def test_genotypes():
+    record = make_record('A', 'G,T', ['1:50,0,60', '0/1:30,0,40,50,60,70',
+                                      './.:.', '0/2:9,9,9,9,9,0',
+                                      '1/2/2:9,9,9,9,9,9,9,9,0,9'])
+    assert record.genotypes() == ['G', 'A/G', './.', 'T/T', 'G/T/T']
+    assert [call.genotype for call in record.calls] == record.genotypes()
+    assert vcf.call_genotypes(record).tolist() == [1, 1, vcf.MISSING, 5, 8]
+
+    record = make_record('A', 'G', ['1:50,0'])
+    assert record.calls[0].genotype == 'G'
+    record.calls[0].set('PL', '0,50')
+    assert record.calls[0].genotype == 'A'
+
+    record = make_record('A', '.', ['0:0', '0/0:0'])
+    assert record.genotypes() == ['A', 'A/A']
+
+
+CONTIGS = (('chr1', 300000), ('chr2', 800000000))
+
+
+def make_vcf(dirname, n=3000, seed=1):
+    rng = random.Random(seed)
+    fname = os.path.join(dirname, 'test.vcf')
+    with open(fname, 'w') as handle:
+        print >>handle, '##fileformat=VCFv4.2'
+        for chrom, length in CONTIGS:
+            print >>handle, '##contig=<ID={0},length={1}>'.format(chrom,
+                                                                  length)
+        print >>handle, '\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT',
+                                   'QUAL', 'FILTER', 'INFO', 'FORMAT', 's1'])
+        for chrom, length in CONTIGS:
+            for pos in sorted(rng.sample(xrange(1, length - 10000), n)):
+                info = 'DP=10'
+                if rng.random() < 0.1:      # symbolic record with END
+                    end = pos + rng.randint(1, 5000)
+                    info = rng.choice(['END={0};DP=10', 'DP=10;END={0}'])
+                    info = info.format(end)
+                print >>handle, '\t'.join(map(str, [
+                    chrom, pos, '.', rng.choice(['A', 'AC', 'ACGT']), 'G',
+                    50, 'PASS', info, 'GT:DP', '0/1:10']))
+    return fname
+
+
+def naive_end(record):
+    end = record.info.get('END')
+    return int(end) if end is not None else record.pos + len(record.ref)
+
+
+def test_bgzf():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_vcf(dirname)
+        gzfile = bgzf.bgzip(fname)
+        assert bgzf.is_bgzf(gzfile)
+        assert gzip.open(gzfile).read() == open(fname).read()
+
+        offsets, lines = [], []
+        with bgzf.BgzfReader(gzfile) as reader:
+            while True:
+                offsets.append(reader.tell())
+                line = reader.readline()
+                if not line:
+                    break
+                lines.append(line)
+        assert ''.join(lines) == open(fname).read()
+        assert len(set([offset >> 16 for offset in offsets])) > 1
+        with bgzf.BgzfReader(gzfile) as reader:
+            for i in random.Random(2).sample(xrange(len(lines)), 200):
+                reader.seek(offsets[i])
+                assert reader.readline() == lines[i]
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_fetch():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_vcf(dirname)
+        gzfile = bgzf.bgzip(fname)
+        records = list(vcf.parse(fname))
+        rng = random.Random(3)
+        regions = [('chr1', 0, None), ('chr2', 550000000, None),
+                   ('chr3', 0, 100)]
+        for chrom, length in CONTIGS:
+            for i in xrange(50):
+                start = rng.randint(0, length)
+                regions.append((chrom, start,
+                                start + rng.choice([1, 100, 100000])))
+        for name in (fname, gzfile):
+            vcf.index(name)
+            vcffile = vcf.parse(name)
+            for chrom, start, end in regions:
+                expect = [record.line for record in records
+                          if record.chrom == chrom and
+                          (end is None or record.pos < end) and
+                          naive_end(record) > start]
+                got = [record.line
+                       for record in vcffile.fetch(chrom, start, end)]
+                assert got == expect
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_writer():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_vcf(dirname, n=500)
+        vcffile = vcf.parse(fname)
+        vcffile.header.add(vcf.Info('AF', 'A', 'Float', 'Allele frequency'))
+        vcffile.header.add(vcf.Format('DP', '1', 'Integer', 'Depth'))
+        records = list(vcffile)
+        for name in ('copy.vcf', 'copy.vcf.gz'):
+            outfile = os.path.join(dirname, name)
+            with vcf.Writer.like(outfile, vcffile, size=64) as writer:
+                for i, record in enumerate(records):
+                    if i % 3 == 0:
+                        record.set_info('AF', [0.5])
+                        record.del_info('DP')
+                        record.call('s1').set('DP', 20)
+                    writer.write(record)
+            assert writer.count == len(records)
+            copy = vcf.parse(outfile)
+            assert 'AF' in copy.header.infos and 'DP' in copy.header.formats
+            assert copy.samples == ['s1']
+            for i, (record, other) in enumerate(zip(records, copy)):
+                assert other.line == record.to_line()
+                if i % 3 == 0:
+                    assert other.get('AF') == [0.5]
+                    assert other.get('DP') is None
+                    assert other.call('s1').value('DP') == 20
+                else:
+                    assert other.line == record.line
+            assert i == len(records) - 1
+    finally:
+        shutil.rmtree(dirname)
+
+
+SAMPLE_META = [
+    '##fileformat=VCFv4.2',
+    '##INFO=<ID=DP,Number=1,Type=Integer,Description="Total depth">',
+    '##INFO=<ID=AF,Number=A,Type=Float,Description="Allele frequency">',
+    '##INFO=<ID=DB,Number=0,Type=Flag,Description="dbSNP member">',
+    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+    '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">',
+    '##FORMAT=<ID=GQ,Number=1,Type=Float,Description="Genotype quality">',
+    '##FORMAT=<ID=PL,Number=G,Type=Integer,Description="Likelihoods">']
+
+GTS = ['0/0', '0/1', '1/1', '1|0', './.', '.']
+
+
+def make_samples_vcf(dirname, n=200, nsample=3, seed=4):
+    """VCF with typed INFO and FORMAT, return file name and the rows"""
+    rng = random.Random(seed)
+    rows = []
+    for i in xrange(n):
+        calls = []
+        for j in xrange(nsample):
+            if rng.random() < 0.1:
+                calls.append(['./.', '.', '.'])
+            else:
+                calls.append([rng.choice(GTS), str(rng.randint(0, 99)),
+                              '{0:.1f}'.format(rng.random() * 99)])
+        info = ['DP={0}'.format(rng.randint(0, 999)),
+                'AF={0:.2f}'.format(rng.random())]
+        if rng.random() < 0.3:
+            info.append('DB')
+        rows.append(['chr1', str(i * 10 + 1), '.', 'A', 'G', '50', 'PASS',
+                     ';'.join(info), 'GT:DP:GQ'] +
+                    [':'.join(call) for call in calls])
+    fname = os.path.join(dirname, 'samples.vcf')
+    with open(fname, 'w') as handle:
+        for line in SAMPLE_META:
+            print >>handle, line
+        print >>handle, '\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT',
+                                   'QUAL', 'FILTER', 'INFO', 'FORMAT'] +
+                                  ['s{0}'.format(j) for j in xrange(nsample)])
+        for row in rows:
+            print >>handle, '\t'.join(row)
+    return fname, rows
+
+
+def test_parse():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname, rows = make_samples_vcf(dirname)
+        vcffile = vcf.parse(fname)
+        assert vcffile.samples == ['s0', 's1', 's2']
+        records = list(vcffile)
+        assert len(records) == len(rows)
+        for record, row in zip(records, rows):
+            assert record.pos == int(row[1]) - 1
+            assert (record.chrom, record.ref, record.alt) == \
+                (row[0], row[3], row[4])
+            calls = [item.split(':') for item in row[9:]]
+            assert record.values('GT') == [call[0] for call in calls]
+            for call, items in zip(record.calls, calls):
+                assert call.data == items
+                assert call['DP'] == items[1]
+            assert record.call('s1').sample == 's1'
+            assert record.to_line() == '\t'.join(row)
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_genotype_matrix():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname, rows = make_samples_vcf(dirname)
+        matrix = vcf.genotype_matrix(fname)
+        assert matrix['GT'].shape == (len(rows), 3)
+        assert matrix['POS'].tolist() == [int(row[1]) - 1 for row in rows]
+        codes = {'0/0': 0, '0/1': 1, '1/1': 2, '1|0': 1}
+        for i, row in enumerate(rows):
+            calls = [item.split(':') for item in row[9:]]
+            assert matrix['GT'][i].tolist() == [codes.get(call[0],
+                                                          vcf.MISSING)
+                                                for call in calls]
+            assert matrix['DP'][i].tolist() == [
+                int(call[1]) if call[1] != '.' else vcf.MISSING
+                for call in calls]
+            for value, call in zip(matrix['GQ'][i].tolist(), calls):
+                if call[2] == '.':
+                    assert value != value  # nan
+                else:
+                    assert abs(value - float(call[2])) < 1e-3
+    finally:
+        shutil.rmtree(dirname)
+
+
+
+def test_typed_values():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname, rows = make_samples_vcf(dirname)
+        for record, row in zip(vcf.parse(fname), rows):
+            info = dict([item.split('=') if '=' in item else (item, True)
+                         for item in row[7].split(';')])
+            assert record.get('DP') == int(info['DP'])
+            assert record.get('AF') == [float(info['AF'])]
+            assert record.get('DB') == ('DB' in info or None)
+            for call, item in zip(record.calls, row[9:]):
+                gt, dp, gq = item.split(':')
+                assert call.value('DP') == (int(dp) if dp != '.' else None)
+                assert call.GQ == (float(gq) if gq != '.' else None)
+                assert call.GT == (gt if gt != '.' else None)
+    finally:
+        shutil.rmtree(dirname)
+
+def count_records(records):
+    """records per chrom of a shard, run in worker processes"""
+    counts = {}
+    for record in records:
+        counts[record.chrom] = counts.get(record.chrom, 0) + 1
+    return counts
+
+
+def add_counts(total, counts):
+    for chrom, count in counts.iteritems():
+        total[chrom] = total.get(chrom, 0) + count
+    return total
+
+
+def test_shards():
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = make_vcf(dirname, n=1000)
+        expect = count_records(vcf.parse(fname))
+        gzfile = bgzf.bgzip(fname)
+        vcf.index(gzfile)
+        for name in (fname, gzfile):
+            shards = vcf.make_shards(name, 8)
+            assert len(shards) > 1
+            lines = []
+            for shard in shards:
+                lines.extend([record.line
+                              for record in vcf.iter_shard(name, shard)])
+            assert lines == [record.line for record in vcf.parse(fname)]
+            total = vcf.reduce_shards(name, count_records, add_counts, {},
+                                      pnum=2, nshard=8)
+            assert total == expect
+    finally:
+        shutil.rmtree(dirname)